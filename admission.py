@@ -0,0 +1,199 @@
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+import grpc
+
+# Request metadata with the priority of a request, see PRIORITIES
+PRIORITY_METADATA_KEY = 'tms-priority'
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+# Lower runs first
+PRIORITIES = {INTERACTIVE: 0, BULK: 1}
+# Bulk requests are rejected once the queues are this full, so there's
+# always room left for interactive ones
+BULK_QUEUE_SHARE = 0.5
+
+
+class Rejected(Exception):
+    """Raised to stop working on a request, that is answered with this status."""
+
+    def __init__(self, code: grpc.StatusCode, details: str):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+
+
+class PrioritySemaphore:
+    """Semaphore that lets the waiter with the highest priority in first, in
+    arrival order among the ones with the same priority. Used as a context
+    manager, it waits with the default priority and no timeout.
+    """
+
+    def __init__(self, value: int=1):
+        self.condition = threading.Condition(threading.Lock())
+        self.value = value
+        # heap of (priority, arrival) of the waiting threads
+        self.waiters = []
+        self.arrivals = itertools.count()
+
+    def acquire(self, blocking: bool=True, timeout: float=None, priority: int=0):
+        with self.condition:
+            if self.value > 0 and len(self.waiters) == 0:
+                self.value -= 1
+                return True
+            if not blocking:
+                return False
+            waiter = (priority, next(self.arrivals))
+            heapq.heappush(self.waiters, waiter)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                while self.value == 0 or self.waiters[0] != waiter:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+                self.value -= 1
+                return True
+            finally:
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+                # the next waiter may be the first one now
+                self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.value += 1
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_args):
+        self.release()
+
+
+class AdmittedRequest:
+    """Deadline, priority and gRPC context of a request being served."""
+
+    def __init__(self, context, model: str, priority: int, on_reject=None):
+        self.context = context
+        self.model = model
+        self.priority = priority
+        self.on_reject = on_reject
+        remaining = None if context is None else context.time_remaining()
+        # without a deadline gRPC may report an infinite or huge time remaining
+        if remaining is None or remaining > threading.TIMEOUT_MAX:
+            self.deadline = None
+        else:
+            self.deadline = time.monotonic() + remaining
+
+    def remaining(self):
+        """Seconds until the deadline, or None without one."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def reject(self, code: grpc.StatusCode, details: str):
+        """Sets the status of the request and raises Rejected."""
+        if self.context is not None:
+            self.context.set_code(code)
+            self.context.set_details(details)
+        if self.on_reject is not None:
+            self.on_reject(self.model, code)
+        raise Rejected(code, details)
+
+    def check(self, needed_s: float=None):
+        """Rejects the request if it was cancelled, or has less than needed_s left."""
+        if self.context is not None and not self.context.is_active():
+            self.reject(grpc.StatusCode.CANCELLED, 'Cancelled by the client')
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.reject(grpc.StatusCode.DEADLINE_EXCEEDED, 'Deadline exceeded')
+        if remaining is not None and needed_s is not None and remaining < needed_s:
+            self.reject(grpc.StatusCode.DEADLINE_EXCEEDED,
+                        f'Not enough time left to run {self.model}: '
+                        f'{remaining*1000:.0f}ms, it takes about {needed_s*1000:.0f}ms')
+
+
+class AdmissionController:
+    """Decides which requests a worker takes. Requests are rejected early with
+    RESOURCE_EXHAUSTED while the worker has max_in_flight requests, or the model
+    has max_queued waiting for it, half of those for bulk requests. Requests
+    that were cancelled, or whose deadline is shorter than the model usually
+    takes, are rejected without running the model. Zero limits are unbounded.
+    """
+
+    def __init__(self, max_in_flight: int=0, max_queued: int=0, on_reject=None):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        # called with the model and status code of every rejected request
+        self.on_reject = on_reject
+        self.lock = threading.Lock()
+        # model -> moving average of the seconds it takes to run
+        self.latencies = {}
+        # model -> moving average of the seconds per item of its batches,
+        # kept apart since a batch takes longer than a single run
+        self.item_latencies = {}
+        self.local = threading.local()
+
+    def observe(self, model: str, seconds: float, batch_size: int=None):
+        """Updates the latency estimate of the model with one of its runs,
+        of a batch of batch_size items or of a single input if None."""
+        latencies = self.latencies if batch_size is None else self.item_latencies
+        if batch_size is not None:
+            seconds /= max(1, batch_size)
+        with self.lock:
+            latency = latencies.get(model)
+            latencies[model] = seconds if latency is None else 0.8*latency + 0.2*seconds
+
+    def estimate(self, model: str, queued: int=0, concurrency: int=1, batch_size: int=None):
+        """Seconds a request would take to run, behind the queued ones, or
+        None if the model didn't run yet. Batches are estimated from the
+        time per item of the previous ones."""
+        with self.lock:
+            if batch_size is None:
+                latency = self.latencies.get(model)
+            else:
+                latency = self.item_latencies.get(model)
+        if latency is None:
+            return None
+        if batch_size is not None:
+            latency *= max(1, batch_size)
+        return latency*(1 + queued//max(1, concurrency))
+
+    @contextlib.contextmanager
+    def request(self, context, model: str, in_flight: int, queued: int, concurrency: int=1, *,
+                batch_size: int=None):
+        """Admits the request or rejects it, raising Rejected. The admitted
+        request is the current one of this thread within this context."""
+        priority = _priority(context)
+        request = AdmittedRequest(context, model, priority, self.on_reject)
+        share = 1. if priority == PRIORITIES[INTERACTIVE] else BULK_QUEUE_SHARE
+        if 0 < self.max_in_flight and in_flight >= max(1, self.max_in_flight*share):
+            request.reject(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                           f'Worker overloaded, {in_flight} requests in flight')
+        if 0 < self.max_queued and queued >= max(1, self.max_queued*share):
+            request.reject(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                           f'Model {model} overloaded, {queued} requests queued')
+        request.check(self.estimate(model, queued, concurrency, batch_size))
+
+        self.local.request = request
+        try:
+            yield request
+        finally:
+            self.local.request = None
+
+    def current(self):
+        """AdmittedRequest served by this thread, if any."""
+        return getattr(self.local, 'request', None)
+
+
+def _priority(context):
+    if context is None:
+        return PRIORITIES[INTERACTIVE]
+    for key, value in context.invocation_metadata() or ():
+        if key == PRIORITY_METADATA_KEY:
+            return PRIORITIES.get(value, PRIORITIES[INTERACTIVE])
+    return PRIORITIES[INTERACTIVE]
@@ -0,0 +1,119 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class Expired(Exception):
+    """Raised by BatchScheduler.run when the call deadline passed before it ran."""
+
+
+class BatchScheduler:
+    """Merges concurrent single item calls for a model into run_batch calls.
+
+    Each call to run() enqueues its input and blocks until the batch it was
+    merged into has been processed. A batch is closed once it has
+    max_batch_size items or max_wait_ms has passed since its first item.
+    Only calls with the same args are merged together. Up to num_threads
+    batches are formed and run at the same time, as allowed by the semaphore.
+    """
+
+    def __init__(self, model, semaphore, max_batch_size: int, max_wait_ms: float,
+                 num_threads: int=1, on_batch=None):
+        self.model = model
+        # called with the size of every batch
+        self.on_batch = on_batch
+        self.semaphore = semaphore
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0., max_wait_ms) / 1000.
+        self.queue = queue.Queue()
+
+        self.threads = [threading.Thread(target=self._loop, daemon=True)
+                        for _ in range(max(1, num_threads))]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, data, args, timing: dict=None, deadline: float=None):
+        """Same interface as ModelInterface.run, but executed within a batch.
+        The seconds it waited for its batch, and that the batch took to run,
+        are set on the 'wait' and 'run' keys of timing. Calls still waiting
+        at their deadline, a time.monotonic() value, raise Expired and are
+        left out of their batch."""
+        future = Future()
+        self.queue.put((data, args, future, time.perf_counter(), timing, deadline))
+        try:
+            return future.result(None if deadline is None else max(0., deadline-time.monotonic()))
+        except FutureTimeout:
+            raise Expired() from None
+
+    def close(self):
+        """Stops the threads once the calls already queued have run."""
+        for _ in self.threads:
+            self.queue.put(None)
+
+    def _next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    item = self.queue.get(timeout=timeout)
+                else:
+                    # the wait is over, but still take whatever is already queued
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None: # closed, runs this batch and stops on the next one
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            groups = {}
+            for item in batch:
+                key = json.dumps(item[1], sort_keys=True)
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                self._run_batch(items)
+
+    def _run_batch(self, items):
+        # calls whose callers stopped waiting
+        now = time.monotonic()
+        for item in items:
+            if item[5] is not None and item[5] <= now:
+                item[2].set_exception(Expired())
+        items = [x for x in items if not x[2].done()]
+        if len(items) == 0:
+            return
+        data = [x[0] for x in items]
+        args = items[0][1]
+        if self.on_batch is not None:
+            self.on_batch(len(items))
+        try:
+            with self.semaphore:
+                begin = time.perf_counter()
+                results = self.model.run_batch(data, args)
+                end = time.perf_counter()
+            if len(results) != len(items):
+                raise ValueError(
+                    f'run_batch returned {len(results)} results for {len(items)} inputs')
+        except BaseException as e:  # pylint: disable=broad-except
+            for _, _, future, _, _, _ in items:
+                future.set_exception(e)
+            return
+
+        for (_, _, future, enqueued, timing, _), result in zip(items, results):
+            if timing is not None:
+                timing['wait'] = begin - enqueued
+                timing['run'] = end - begin
+            future.set_result(result)
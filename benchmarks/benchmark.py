@@ -0,0 +1,251 @@
+"""Load tests Tiny Model Server with the synthetic models bench_matmul and
+bench_sleep. Each scenario drives a ModelClient either on a closed loop, with
+a fixed number of callers sending requests back to back, or on an open loop,
+with requests arriving at a fixed rate no matter how long they take. Results
+are saved as JSON and compared to a baseline, failing on regressions.
+
+Run it from the repository root:
+
+    python -m benchmarks.benchmark --workers 2 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.benchmark --workers 2 --baseline benchmarks/baseline.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_client import ModelClient
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(__file__), 'scenarios.json')
+# Throughput may drop, and the p99 latency grow, by this fraction of the
+# baseline before it is reported as a regression
+DEFAULT_TOLERANCE = 0.2
+# Requests in flight on open loop scenarios, the ones above it wait on the client
+MAX_OPEN_LOOP_IN_FLIGHT = 256
+
+
+def summarize(latencies: list, errors: int, elapsed_s: float, batch: int=1):
+    """Throughput and latency percentiles of a scenario run, in milliseconds."""
+    latencies_ms = np.array(latencies)*1000 if len(latencies) > 0 else np.zeros(1)
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': requests/elapsed_s,
+        'items_per_s': requests*batch/elapsed_s,
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def run_closed_loop(call, concurrency: int, duration_s: float):
+    """Each of the concurrency callers sends its next request once the previous
+    one is answered. Returns the latencies, the number of errors and the time it took."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s
+
+    def caller():
+        while time.perf_counter() < deadline:
+            begin = time.perf_counter()
+            ok = call()
+            latency = time.perf_counter() - begin
+            with lock:
+                latencies.append(latency)
+                errors[0] += not ok
+
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter()-begin
+
+
+def run_open_loop(call, rate: float, duration_s: float):
+    """Sends rate requests per second, each one on its schedule even if the
+    previous ones haven't been answered. Latencies are measured from the
+    scheduled time, so the time requests wait behind a slow server counts."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def timed_call(scheduled):
+        ok = call()
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            errors[0] += not ok
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=MAX_OPEN_LOOP_IN_FLIGHT) as executor:
+        for i in range(int(rate*duration_s)):
+            scheduled = begin + i/rate
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            executor.submit(timed_call, scheduled)
+    return latencies, errors[0], time.perf_counter()-begin
+
+
+def _scenario_call(model: ModelClient, scenario: dict):
+    """Function that sends one request of the scenario, returning whether it succeeded."""
+    batch = scenario.get('batch', 1)
+    args = scenario.get('args', {})
+    if scenario.get('input', 'image') == 'text':
+        item = 'a'*scenario.get('size', 1000)
+        run = model.run_text if batch == 1 else model.run_text_batch
+    else:
+        height, width = scenario.get('size', (224, 224))
+        item = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+        run = model.run_image if batch == 1 else model.run_image_batch
+    data = item if batch == 1 else [item]*batch
+
+    def call():
+        try:
+            results = run(data, args)
+        except Exception:  # pylint: disable=broad-except
+            return False
+        results = results if batch > 1 else [results]
+        return not any(isinstance(x, dict) and 'error' in x for x in results)
+    return call
+
+
+def run_scenario(scenario: dict, ip: str, port: str):
+    model = ModelClient(scenario['model'], ip, port, **scenario.get('client', {}))
+    try:
+        call = _scenario_call(model, scenario)
+        duration_s = scenario.get('duration_s', 5)
+        if scenario.get('mode', 'closed') == 'open':
+            def run(seconds):
+                return run_open_loop(call, scenario['rate'], seconds)
+        else:
+            def run(seconds):
+                return run_closed_loop(call, scenario.get('concurrency', 1), seconds)
+        run(scenario.get('warmup_s', 1))
+        latencies, errors, elapsed_s = run(duration_s)
+    finally:
+        model.close()
+    return summarize(latencies, errors, elapsed_s, scenario.get('batch', 1))
+
+
+def compare(results: dict, baseline: dict, tolerance: float=DEFAULT_TOLERANCE):
+    """Returns the regressions of the results relative to the baseline."""
+    regressions = []
+    for name, base in baseline['scenarios'].items():
+        current = results['scenarios'].get(name)
+        if current is None:
+            continue
+        if current['throughput_rps'] < base['throughput_rps']*(1-tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']:.1f} rps, "
+                               f"baseline {base['throughput_rps']:.1f} rps")
+        if current['p99_ms'] > base['p99_ms']*(1+tolerance):
+            regressions.append(f"{name}: p99 latency {current['p99_ms']:.1f}ms, "
+                               f"baseline {base['p99_ms']:.1f}ms")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name}: {current['errors']} errors, baseline {base['errors']}")
+    return regressions
+
+
+@contextlib.contextmanager
+def local_server(workers: int, port: str='50000', env: dict=None):
+    """Runs server.py with the given number of workers on the port within this context."""
+    env = {**os.environ, 'NUM_PARALLEL_WORKERS': str(workers), **(env or {})}
+    process = subprocess.Popen([sys.executable, 'server.py', '--port', str(port)], env=env,
+                               start_new_session=True, stdout=subprocess.DEVNULL)
+    try:
+        yield process
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def _print_results(results: dict):
+    print(f"{'scenario':32} {'rps':>9} {'items/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>6}")
+    for name, res in results['scenarios'].items():
+        print(f"{name:32} {res['throughput_rps']:9.1f} {res['items_per_s']:9.1f} "
+              f"{res['p50_ms']:8.2f} {res['p95_ms']:8.2f} {res['p99_ms']:8.2f} {res['errors']:6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--workers', type=int, default=max(1, multiprocessing.cpu_count()//2),
+                        help='server workers to start')
+    parser.add_argument('--scenarios', default=SCENARIOS_PATH, help='JSON list of scenarios')
+    parser.add_argument('--only', default=None,
+                        help='comma separated names of the scenarios to run')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='overrides the seconds of every scenario')
+    parser.add_argument('--output', default=None, help='where to save the results JSON')
+    parser.add_argument('--baseline', default=None, help='results JSON to compare with')
+    parser.add_argument('--save-baseline', default=None, help='saves the results as a baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--no-server', action='store_true',
+                        help='benchmarks a server that is already running')
+    parser.add_argument('--ip', default='localhost')
+    parser.add_argument('--port', default='50000')
+    opts = parser.parse_args()
+
+    with open(opts.scenarios, encoding='utf-8') as f:
+        scenarios = json.load(f)
+    if opts.only is not None:
+        names = opts.only.split(',')
+        scenarios = [x for x in scenarios if x['name'] in names]
+    if opts.duration is not None:
+        scenarios = [{**x, 'duration_s': opts.duration} for x in scenarios]
+
+    results = {
+        'meta': {
+            'workers': opts.workers,
+            'cpus': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'scenarios': {},
+    }
+    if opts.no_server:
+        server = contextlib.nullcontext()
+    else:
+        server = local_server(opts.workers, opts.port)
+    with server:
+        for scenario in scenarios:
+            print(f"Running {scenario['name']}...", flush=True)
+            results['scenarios'][scenario['name']] = {
+                **run_scenario(scenario, opts.ip, opts.port), 'scenario': scenario}
+
+    _print_results(results)
+    for path in (opts.output, opts.save_baseline):
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    if opts.baseline is not None:
+        with open(opts.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import collections
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Returned by ResultCache.get when the key is not cached
+MISS = object()
+
+
+def _estimate_size(value):
+    """Rough size in bytes of a model result."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_estimate_size(x) for x in value)
+    return len(json.dumps(value, default=str))
+
+
+class ResultCache:
+    """LRU cache of the results of a model, bounded by number of entries and by
+    size, with an optional time to live. Identical calls that arrive while the
+    first one is still running wait for its result instead of running the
+    model again.
+    """
+
+    def __init__(self, max_entries: int=1024, max_mb: float=64, ttl_s: float=None):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb*1024*1024)
+        self.ttl_s = ttl_s
+        self.lock = threading.Lock()
+        # key -> (value, size, expiration time)
+        self.entries = collections.OrderedDict()
+        self.in_flight = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(model: str, args: dict, *inputs):
+        """Hashes the model name, its args and the input bytes, texts or numpy arrays."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(model.encode())
+        digest.update(json.dumps(args, sort_keys=True).encode())
+        for data in inputs:
+            if isinstance(data, np.ndarray):
+                digest.update(f'{data.dtype.str}{data.shape}'.encode())
+                data = np.ascontiguousarray(data).data
+            elif isinstance(data, str):
+                data = data.encode()
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+        return digest.digest()
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+            self._remove(key)
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return MISS
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        if isinstance(value, dict) and 'error' in value:
+            return
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        expiration = None if self.ttl_s is None else time.monotonic()+self.ttl_s
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expiration)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def get_or_compute(self, key, compute, retry_on: tuple=()):
+        """Returns the cached result, or the one of the identical call that is
+        already running, or computes it. When the running call raises one of
+        retry_on, an error of that call alone, the calls waiting for it start
+        over instead of raising it too."""
+        while True:
+            with self.lock:
+                value = self._get(key)
+                if value is not MISS:
+                    return value
+                future = self.in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self.in_flight[key] = future
+                else:
+                    self.deduplicated += 1
+
+            if owner:
+                return self._compute(key, compute, future)
+            try:
+                return future.result()
+            except retry_on:
+                continue
+
+    def _compute(self, key, compute, future):
+        try:
+            value = compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions,
+            }
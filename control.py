@@ -0,0 +1,206 @@
+import itertools
+import multiprocessing
+from multiprocessing import connection
+import os
+import threading
+
+# How much longer than the timeout of a broadcast a worker waits for the
+# supervisor to send back the results
+RESULTS_MARGIN_S = 5
+
+
+class ControlChannel:
+    """Lets a server worker run a command on every worker, such as reloading
+    a model. Each worker has a pipe to the supervisor process, which forwards
+    the commands to every worker and gathers their replies. Nothing is shared
+    among the workers, so one may crash and be replaced without leaving a
+    queue or a lock behind. Each worker answers its commands on background
+    threads while it keeps serving requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        # sequence -> state of a broadcast waiting for its results
+        self.pending = {}
+        # in the supervisor: pid -> connection to each worker, in start order
+        self.workers = {}
+        self.send_locks = {}
+        # workers that started serving
+        self.ready = set()
+        # called when a worker asks to stop the server
+        self.on_stop = None
+        self.router = None
+        self.wakeup = None
+        # in a worker: its connection to the supervisor
+        self.connection = None
+        self.send_lock = threading.Lock()
+
+    def add(self, pid: int, worker_connection):
+        """Starts routing the messages of a new worker, in the supervisor."""
+        with self.lock:
+            self.workers[pid] = worker_connection
+            self.send_locks[pid] = threading.Lock()
+            if self.router is None:
+                self.wakeup = multiprocessing.Pipe(duplex=False)
+                self.router = threading.Thread(target=self._route, daemon=True)
+                self.router.start()
+        self.wakeup[1].send_bytes(b'')
+
+    def attach(self, worker_connection):
+        """Connects a forked worker to the supervisor, through its end of the pipe."""
+        # the copies of the other pipes would keep them open when their
+        # processes exit, and the locks may have been held while forking
+        for other in self.workers.values():
+            other.close()
+        if self.wakeup is not None:
+            for end in self.wakeup:
+                end.close()
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.workers = {}
+        self.send_locks = {}
+        self.ready = set()
+        self.router = None
+        self.wakeup = None
+        self.connection = worker_connection
+
+    def _route(self):
+        while True:
+            with self.lock:
+                workers = {conn: pid for pid, conn in self.workers.items()}
+            for conn in connection.wait(list(workers) + [self.wakeup[0]]):
+                if conn is self.wakeup[0]:
+                    conn.recv_bytes()
+                    continue
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError): # the worker exited
+                    self._remove(workers[conn])
+                    continue
+                self._handle(workers[conn], message)
+
+    def _remove(self, pid):
+        with self.lock:
+            self.workers.pop(pid).close()
+            del self.send_locks[pid]
+            self.ready.discard(pid)
+            for waiting in self.pending.values():
+                waiting['pids'].discard(pid)
+                if waiting['pids'] <= waiting['results'].keys():
+                    waiting['done'].set()
+
+    def _handle(self, pid, message):
+        kind = message[0]
+        if kind == 'reply':
+            _, sequence, result = message
+            with self.lock:
+                waiting = self.pending.get(sequence)
+                # late replies of a previous command that timed out are dropped
+                if waiting is not None:
+                    waiting['results'][pid] = result
+                    if waiting['pids'] <= waiting['results'].keys():
+                        waiting['done'].set()
+        elif kind == 'broadcast':
+            threading.Thread(target=self._broadcast_for, args=(pid, message),
+                             daemon=True).start()
+        elif kind == 'ready':
+            with self.lock:
+                self.ready.add(pid)
+        elif kind == 'stop' and self.on_stop is not None:
+            self.on_stop()
+
+    def _broadcast_for(self, pid, message):
+        _, sequence, command, args, timeout, ready_only = message
+        results = self.broadcast(command, args, timeout, ready_only)
+        self._send(pid, ('results', sequence, results))
+
+    def _send(self, pid, message):
+        with self.lock:
+            conn = self.workers.get(pid)
+            send_lock = self.send_locks.get(pid)
+        if conn is None:
+            return
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, ValueError): # the worker exited
+                pass
+
+    def _send_to_supervisor(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def listen(self, handler, on_close=None):
+        """Answers the commands sent to this worker with handler(command, args).
+        Calls on_close if the supervisor goes away."""
+        threading.Thread(target=self._listen, args=(handler, on_close), daemon=True).start()
+
+    def _listen(self, handler, on_close):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError): # the supervisor exited
+                if on_close is not None:
+                    on_close()
+                return
+            if message[0] == 'command':
+                threading.Thread(target=self._answer, args=(handler,)+message[1:],
+                                 daemon=True).start()
+            elif message[0] == 'results':
+                _, sequence, results = message
+                with self.lock:
+                    waiting = self.pending.get(sequence)
+                    if waiting is not None:
+                        waiting['results'] = results
+                        waiting['done'].set()
+
+    def _answer(self, handler, sequence, command, args):
+        try:
+            result = handler(command, args)
+        except BaseException as e:  # pylint: disable=broad-except
+            result = {'pid': os.getpid(), 'error': str(e)}
+        try:
+            self._send_to_supervisor(('reply', sequence, result))
+        except OSError: # the supervisor exited
+            pass
+
+    def ready_to_serve(self):
+        """Tells the supervisor this worker started serving."""
+        self._send_to_supervisor(('ready',))
+
+    def request_stop(self):
+        """Asks the supervisor to stop every worker."""
+        self._send_to_supervisor(('stop',))
+
+    def broadcast(self, command: str, args: dict, timeout: float, ready_only: bool = False):
+        """Runs the command on every worker, this one included, returning their
+        results in the order the workers started. Workers that didn't answer in
+        time get None, and a single None is returned if the supervisor didn't.
+        With ready_only, the workers still loading their models are skipped
+        instead of waited for."""
+        with self.lock:
+            sequence = next(self.sequence)
+            pids = [x for x in self.workers if not ready_only or x in self.ready]
+            waiting = self.pending[sequence] = {
+                'pids': set(pids), 'results': {}, 'done': threading.Event()}
+        try:
+            if self.connection is not None:
+                try:
+                    self._send_to_supervisor(
+                        ('broadcast', sequence, command, args, timeout, ready_only))
+                except OSError: # the supervisor exited
+                    return [None]
+                if not waiting['done'].wait(timeout + RESULTS_MARGIN_S):
+                    return [None]
+                return waiting['results']
+
+            for pid in pids:
+                self._send(pid, ('command', sequence, command, args))
+            if len(pids) > 0:
+                waiting['done'].wait(timeout)
+            return [waiting['results'].get(pid) for pid in pids]
+        finally:
+            with self.lock:
+                del self.pending[sequence]
@@ -0,0 +1,67 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+
+import numpy as np
+
+# Trailing metadata key where every worker reports its load
+LOAD_METADATA_KEY = 'tms-load'
+
+
+class LoadTracker:
+    """Keeps track of a worker load: the requests in flight, the ones waiting
+    for each model, and the latency of the recent requests. It is reported to
+    the clients so they can balance their requests among the workers.
+    """
+
+    def __init__(self, latency_window: int=256):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # requests served so far
+        self.requests = 0
+        self.queued = collections.defaultdict(int)
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    @contextlib.contextmanager
+    def track(self):
+        """Accounts a request in flight while within this context."""
+        begin = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.latencies.append(time.perf_counter()-begin)
+
+    @contextlib.contextmanager
+    def waiting(self, model: str):
+        """Accounts a request waiting for the given model while within this context."""
+        with self.lock:
+            self.queued[model] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.queued[model] -= 1
+
+    def snapshot(self, extra_queued: dict=None):
+        with self.lock:
+            queued = {k: v for k,v in self.queued.items() if v > 0}
+            for model, num in (extra_queued or {}).items():
+                if num > 0:
+                    queued[model] = queued.get(model, 0) + num
+            latencies = list(self.latencies)
+            in_flight = self.in_flight
+
+        p50 = None if len(latencies) == 0 else float(np.median(latencies))*1000
+        return {
+            'pid': os.getpid(),
+            'in_flight': in_flight,
+            'queued': queued,
+            'p50_latency_ms': p50,
+        }
@@ -0,0 +1,179 @@
+import bisect
+import collections
+import contextlib
+import threading
+import time
+
+# Upper bounds of the histogram buckets, the last one is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+PAYLOAD_BUCKETS = tuple(1024*4**i for i in range(10)) # 1KB to 256MB
+
+COUNTERS = {
+    'tms_requests_total': 'Requests by model and RPC.',
+    'tms_errors_total': 'Requests that returned an error, by model and RPC.',
+    'tms_rejected_total': 'Requests rejected without running the model, by model, RPC '
+                          'and status code: overloaded, cancelled or out of time.',
+}
+HISTOGRAMS = {
+    'tms_request_seconds': ('Request latency, from receiving it to serializing its results.',
+                            LATENCY_BUCKETS),
+    'tms_stage_seconds': ('Time spent on each stage of a request: wait for the model, '
+                          'decode the inputs, run the model and encode the results.',
+                          LATENCY_BUCKETS),
+    'tms_batch_size': ('Inputs of each batch request, and of each batch formed by '
+                       'dynamic batching (rpc="dynamic_batching").', BATCH_SIZE_BUCKETS),
+    'tms_payload_bytes': ('Size of the requests and responses messages.', PAYLOAD_BUCKETS),
+}
+
+
+class RequestMetrics:
+    """What is measured of a single request, see Metrics.request."""
+
+    def __init__(self, rpc: str, model: str):
+        self.rpc = rpc
+        self.model = model
+        self.stages = collections.defaultdict(float)
+        self.error = False
+        self.batch_size = None
+        self.request_bytes = None
+        self.response_bytes = None
+
+
+class Metrics:
+    """Counters and histograms of the requests of a worker. The snapshots of
+    every worker are merged with merge_snapshots, and exported with to_prometheus.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value
+        self.counters = collections.defaultdict(float)
+        # (name, labels) -> [count of each bucket..., sum]
+        self.histograms = {}
+        self.local = threading.local()
+
+    def inc(self, name: str, labels: dict, value: float=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name: str, labels: dict, value: float):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0]*(len(buckets)+1) + [0.]
+            values[bisect.bisect_left(buckets, value)] += 1
+            values[-1] += value
+
+    @contextlib.contextmanager
+    def request(self, rpc: str, model: str):
+        """Measures the request handled by this thread within this context,
+        yielding its RequestMetrics so the handler may add to it."""
+        request = RequestMetrics(rpc, model)
+        self.local.request = request
+        begin = time.perf_counter()
+        try:
+            yield request
+        except BaseException:
+            request.error = True
+            raise
+        finally:
+            self.local.request = None
+            self._record(request, time.perf_counter()-begin)
+
+    def current(self):
+        """RequestMetrics of the request handled by this thread, if any."""
+        return getattr(self.local, 'request', None)
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        """Adds the time within this context to a stage of the current request."""
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter()-begin)
+
+    def add_stage(self, stage: str, seconds: float):
+        request = self.current()
+        if request is not None:
+            request.stages[stage] += seconds
+
+    def _record(self, request: RequestMetrics, seconds: float):
+        labels = {'model': request.model, 'rpc': request.rpc}
+        self.inc('tms_requests_total', labels)
+        if request.error:
+            self.inc('tms_errors_total', labels)
+        self.observe('tms_request_seconds', labels, seconds)
+        for stage, stage_seconds in request.stages.items():
+            self.observe('tms_stage_seconds', {**labels, 'stage': stage}, stage_seconds)
+        if request.batch_size is not None:
+            self.observe('tms_batch_size', labels, request.batch_size)
+        for direction, size in (('in', request.request_bytes), ('out', request.response_bytes)):
+            if size is not None:
+                self.observe('tms_payload_bytes', {**labels, 'direction': direction}, size)
+
+    def snapshot(self):
+        """JSON serializable copy of the metrics."""
+        with self.lock:
+            return {
+                'counters': [[name, dict(labels), value]
+                             for (name, labels), value in self.counters.items()],
+                'histograms': [[name, dict(labels), list(values)]
+                               for (name, labels), values in self.histograms.items()],
+            }
+
+
+def merge_snapshots(snapshots: list):
+    """Sums the snapshots of many workers."""
+    counters = collections.defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(sorted(labels.items())))] += value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            if key in histograms:
+                histograms[key] = [a+b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), values]
+                       for (name, labels), values in histograms.items()],
+    }
+
+
+def _format_labels(labels: dict):
+    if len(labels) == 0:
+        return ''
+    escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for k, v in labels.items()}
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(escaped.items())) + '}'
+
+
+def to_prometheus(snapshot: dict):
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for metric, labels, value in sorted(snapshot['counters'], key=str):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for metric, labels, values in sorted(snapshot['histograms'], key=str):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f'{bound:g}'
+                lines.append(f'{name}_bucket{_format_labels({**labels, "le": le})} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
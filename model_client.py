@@ -1,15 +1,28 @@
 import abc
+import asyncio
+import collections
+import contextlib
+import functools
+import os
 import time
 import json
 import math
+import random
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from multiprocessing import shared_memory
 
 import grpc
 import numpy as np
 from grpc_health.v1 import health_pb2, health_pb2_grpc
-from PIL import Image
 
+import shm
 import utils
+from admission import PRIORITY_METADATA_KEY, PRIORITIES, INTERACTIVE
+from load import LOAD_METADATA_KEY
+from preprocess import Preprocessor
 import server_pb2
 import server_pb2_grpc
 
@@ -20,195 +33,1196 @@ class ConnectionTimeout(Exception):
         print('Could not connect to model server. Perhaps check the following: '+\
               f'IP: {ip}, port: {port}, timeout: {timeout}s')
 
+# How often the topology is asked again while the server workers start, and
+# how long every host has to answer each time
+TOPOLOGY_RETRY_S = 0.1
+TOPOLOGY_TIMEOUT_S = 1
+# A worker stops getting requests after this many consecutive requests fail
+# without an answer from it, or when it fails a health check, until it passes one
+EJECT_AFTER_FAILURES = 5
+FAILURE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+HEALTH_CHECK_TIMEOUT_S = 1
+# How long the workers have to connect on their own ports, before the client
+# reaches them on the shared port of their server instead
+WORKER_CONNECT_TIMEOUT_S = 2
+
+# The workers are known by the address of their own port and their pid, since
+# the pids of different hosts may be the same
+Worker = collections.namedtuple('Worker', ['address', 'pid'])
+
+
+def _split_host_port(host: str, default_port: str):
+    """Splits host:port, [ipv6]:port or a host without port."""
+    if host.startswith('['):
+        name, _, port = host[1:].partition(']')
+        return name, port.lstrip(':') or default_port
+    if host.count(':') == 1:
+        name, port = host.split(':')
+        return name, port
+    return host, default_port
+
+
+def _join_host_port(name: str, port: str):
+    return f'[{name}]:{port}' if ':' in name else f'{name}:{port}'
+
+
+def _client_config(config, options: dict):
+    """The config, or the default one, with the options passed one by one."""
+    unknown = set(options) - set(ClientConfig._fields)
+    if len(unknown) > 0:
+        raise TypeError(f'Unexpected client options {sorted(unknown)}')
+    return (config or ClientConfig())._replace(**options)
+
+
 class InputType(Enum):
     IMAGE = 1
     TEXT = 2
 
+class LoadBalancer(Enum):
+    ROUND_ROBIN = 1
+    # worker with the least requests, counting ours in flight plus the
+    # ones the worker last reported as running or queued
+    LEAST_OUTSTANDING = 2
+    # the least loaded of two random workers
+    POWER_OF_TWO = 3
+
+
+# Options of ModelClient and AsyncModelClient, that may also be passed one by
+# one as keyword arguments:
+# - max_chunk and balancer, how the requests are spread among the workers
+# - shared_memory, image_encoding and image_quality, how the images are sent
+# - deadline_s and priority, see admission.py on the server
+# - refresh_s, how often the workers are listed again
+ClientConfig = collections.namedtuple(
+    'ClientConfig',
+    ['max_chunk', 'balancer', 'shared_memory', 'image_encoding', 'image_quality',
+     'deadline_s', 'priority', 'refresh_s'],
+    defaults=[None, LoadBalancer.ROUND_ROBIN, True, None, 90, None, INTERACTIVE, 30])
 
-class ModelClient(abc.ABC):
-    def __init__(self, model: str, ip: str, port: str='50000', timeout: int=60*5):
+
+class _ModelClientBase(abc.ABC):
+    """What ModelClient and AsyncModelClient share: their setup, the workers
+    and how the requests are balanced among them, and building the requests
+    and parsing the responses. Nothing here waits for the server.
+    """
+    def __init__(self, model: str, ip: str, port: str, timeout: int, config: ClientConfig):
         self.model = model
+        self._set_deadline_and_priority(config.deadline_s, config.priority)
+        # compresses the images before sending them, see utils.IMAGE_ENCODINGS
+        self.image_encoding = config.image_encoding
+        self.image_quality = config.image_quality
+        # batches are split in chunks of at most max_chunk items, or evenly
+        # among all server workers when it is None
+        self.max_chunk = config.max_chunk
+        self.balancer = config.balancer
+        self._init_workers(ip, port, config.refresh_s)
+        self.timeout = timeout
+        # images are sent through shared memory when the server is on the same host
+        self.shared_memory = config.shared_memory
+        self.shm_pool = None
+        # set once connected
+        self.num_server_workers = None
+        self.size = None
+        self.preprocessor = None
+
+    def _init_workers(self, ip, port: str, refresh_s: float):
+        self.hosts = [ip] if isinstance(ip, str) else list(ip)
+        self.port = port
+        # host -> its addresses the last time it was resolved
+        self.resolved = {}
+        self.refresh_s = refresh_s
+        self.last_refresh = time.monotonic()
+        self.refreshing = False
         self.stub_idx = 0
+        # Worker -> channel, of every known worker
         self.channels = {}
+        self.health_stubs = {}
+        # Worker -> stub, of the workers that get requests, so the ejected
+        # ones are in channels but not in stubs
         self.stubs = {}
+        # models loaded by each worker, and (address, id) of its server
+        self.worker_models = {}
+        self.worker_servers = {}
+        # server id -> what it supports beyond the first versions of the API
+        self.server_features = {}
+        # channels of the workers that are gone, closed on the next refresh,
+        # once their requests in flight have finished
+        self.retired = []
+        self.retired_shm_pool = None
+        self.load_lock = threading.Lock()
+        self.outstanding = collections.defaultdict(int)
+        self.server_load = collections.defaultdict(int)
+        # consecutive failed requests of each worker
+        self.failures = collections.Counter()
 
-        self._connect(ip, port, timeout)
-        self.num_server_workers = self._get_num_parallel_workers()
-        # opens one channel/stub per parallel server worker
-        while len(self.channels) < self.num_server_workers:
-            self._connect(ip, port, timeout)
+    def _set_deadline_and_priority(self, deadline_s, priority):
+        # The server skips the requests that can't finish before their deadline,
+        # and runs the interactive ones ahead of the bulk ones, see admission.py
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority {priority}, expected one of {list(PRIORITIES)}')
+        self.deadline_s = deadline_s
+        self.call_metadata = ((PRIORITY_METADATA_KEY, priority),)
 
-        self.health_stubs = {k: health_pb2_grpc.HealthStub(v) for k,v in self.channels.items()}
-        self.size = self.get_input_shape()
+    def _call_timeout(self, method: str):
+        """Only the requests that run the model have a deadline, others such as
+        Profile may take longer."""
+        return self.deadline_s if method.startswith('Run') else None
 
-    def _connect(self, ip: str, port: str, timeout: int):
+    def _channel_options(self):
         # Change options to accept send large messages. And also sets
-        # use_local_subhannel_pool enable connections to different workers when using so_reuseport
-        options = [
+        # use_local_subhannel_pool so each client opens its own connections
+        return [
             ('grpc.max_receive_message_length', int(1e9)),
             ('grpc.max_send_message_length', int(1e9)),
             ('grpc.use_local_subchannel_pool', 1)]
-        channel = grpc.insecure_channel(f'{ip}:{port}', options=options)
-        stub = server_pb2_grpc.ServerStub(channel)
 
-        begin = time.time()
-        pid = None
-        while pid is None: # keep trying to connect until timeout
+    def _update_servers(self, servers: dict, results: dict):
+        """Keeps the ready workers of the servers that answered, returning the
+        addresses of the servers whose workers are still starting, and of the
+        ones that didn't answer."""
+        failed, starting = [], []
+        for address, result in results.items():
+            if isinstance(result, grpc.RpcError):
+                if result.code() not in FAILURE_CODES:
+                    raise result
+                failed.append(address)
+                continue
+            workers = [x for x in result['workers'] if x['ready']]
+            servers[address] = {'server_id': result.get('server_id', address), 'workers': workers,
+                                'features': result.get('features', [])}
+            if len(workers) < result['num_workers']:
+                starting.append(address)
+        return starting, failed
+
+    def _resolve(self):
+        """The addresses of the hosts, resolving each name to all of its
+        addresses. The names that fail to resolve keep their last addresses."""
+        addresses = []
+        for host in self.hosts:
+            name, port = _split_host_port(host, self.port)
             try:
-                response = stub.GetPID(
-                    server_pb2.StringArg(data=self.model))
-                pid = json.loads(response.data)['pid']
-            except grpc._channel._InactiveRpcError:
-                time.sleep(1)
-            if time.time()-begin > timeout and pid is None:
-                raise ConnectionTimeout(ip, port, timeout)
-
-        if pid in self.channels:
-            channel.close()
-            return
-        self.channels[pid] = channel
-        self.stubs[pid] = stub
+                infos = socket.getaddrinfo(name, port, type=socket.SOCK_STREAM)
+                self.resolved[host] = [_join_host_port(x[4][0], port) for x in infos]
+            except socket.gaierror:
+                pass
+            addresses += self.resolved.get(host, [])
+        return list(dict.fromkeys(addresses))
+
+    def _apply_topology(self, servers: dict, addresses: list):
+        """Returns the workers to add, the ones of the servers that answered
+        that load our model, and the ones to remove: those their server doesn't
+        list anymore, and the ones of the addresses the hosts don't resolve to.
+        A server reached on many addresses is only used on one of them."""
+        known = {address for address, _ in self.worker_servers.values()}
+        listed, answered = [], set()
+        for address in sorted(servers, key=lambda x: x not in known):
+            server_id = servers[address]['server_id']
+            if server_id in answered:
+                continue
+            answered.add(server_id)
+            self.server_features[server_id] = set(servers[address].get('features', []))
+            host, _ = address.rsplit(':', 1)
+            listed += [{**x, 'key': self._worker_key(host, address, x),
+                        'server': (address, server_id)} for x in servers[address]['workers']]
+        selected = {x['key']: x for x in self._select_workers(listed)}
+        if len(selected) == 0:
+            # keeps the current workers while no server lists any
+            return [], []
+        added = [x for key, x in selected.items() if key not in self.channels]
+        removed = [key for key, (address, server_id) in self.worker_servers.items()
+                   if key not in selected and (server_id in answered or address not in addresses)]
+        return added, removed
+
+    def _worker_key(self, host: str, address: str, worker: dict):
+        """The worker on its own port, or on the shared port of its server if
+        it was unreachable on its own."""
+        shared = Worker(address, worker['pid'])
+        if shared in self.channels:
+            return shared
+        return Worker(f'{host}:{worker["port"]}', worker['pid'])
+
+    def _select_workers(self, workers: list):
+        """The workers that load our model, or all of them if none does, so
+        the requests get the server error."""
+        serving = [x for x in workers if self.model in x['models']]
+        return serving or workers
+
+    def _server_ids(self):
+        return {server_id for _, server_id in self.worker_servers.values()}
+
+    def _servers_support(self, feature: str):
+        """Whether all the servers of our workers have the feature, see
+        server.SERVER_FEATURES."""
+        return all(feature in self.server_features.get(x, ()) for x in self._server_ids())
+
+    def _on_shared_port(self, workers: list):
+        """The workers keyed by the shared port of their server, where the
+        kernel spreads the connections of the channels among all workers."""
+        return [{**x, 'key': Worker(x['server'][0], x['key'].pid)} for x in workers
+                if x['key'].address != x['server'][0]]
+
+    def _add_worker(self, worker: dict, create_channel):
+        key = worker['key']
+        self.channels[key] = create_channel(key.address, options=self._channel_options())
+        self.health_stubs[key] = health_pb2_grpc.HealthStub(self.channels[key])
+        self.worker_models[key] = worker['models']
+        self.worker_servers[key] = worker['server']
+
+    def _remove_worker(self, key):
+        """Stops using a worker, returning its channel to be closed."""
+        with self.load_lock:
+            self.stubs.pop(key, None)
+            for worker_state in (self.outstanding, self.server_load, self.failures):
+                worker_state.pop(key, None)
+        del self.health_stubs[key]
+        del self.worker_models[key]
+        del self.worker_servers[key]
+        return self.channels.pop(key)
+
+    def _eject(self, key):
+        """Stops sending requests to a worker, but the last one, returning
+        whether the others may take its requests. Call with load_lock."""
+        if key in self.stubs and len(self.stubs) > 1:
+            del self.stubs[key]
+        return key not in self.stubs
+
+    def _readmit(self, key):
+        with self.load_lock:
+            if key in self.channels and key not in self.stubs:
+                self.stubs[key] = server_pb2_grpc.ServerStub(self.channels[key])
+                self.failures[key] = 0
+
+    def _check_shared_memory(self, added: list):
+        """Stops using shared memory once the workers are on many servers,
+        before the added workers get any request."""
+        server_ids = self._server_ids() | {x['server'][1] for x in added}
+        if self.shm_pool is not None and len(server_ids) > 1:
+            self.retired_shm_pool, self.shm_pool = self.shm_pool, None
+
+    def _shared_memory_probe(self):
+        """Creates a segment with a random token, that the server must be able to read."""
+        token = os.urandom(16)
+        try:
+            segment = shared_memory.SharedMemory(create=True, size=len(token))
+        except OSError:
+            return None, None
+        segment.buf[:len(token)] = token
+        arg = server_pb2.StringArg(data=json.dumps({'name': segment.name, 'token': token.hex()}))
+        return segment, arg
+
+    def _shared_memory_lease(self):
+        if self.shm_pool is None:
+            return contextlib.nullcontext()
+        return self.shm_pool.lease()
 
     def _load_balancer_pid(self):
-        """Simple Round Robing load balancer that returns the stub index to be used."""
+        """Returns the pid of the worker that should receive the next request."""
         self.stub_idx = (self.stub_idx+1) % len(self.stubs)
         pids = list(self.stubs.keys())
-        return pids[self.stub_idx]
+        if self.balancer == LoadBalancer.ROUND_ROBIN or len(pids) == 1:
+            return pids[self.stub_idx]
+
+        if self.balancer == LoadBalancer.POWER_OF_TWO:
+            pids = random.sample(pids, 2)
+        else:
+            # rotates the candidates so that ties are broken by round robin
+            pids = pids[self.stub_idx:] + pids[:self.stub_idx]
+        return min(pids, key=self._worker_load)
+
+    def _worker_load(self, pid):
+        return self.outstanding[pid] + self.server_load[pid]
 
-    def _get_stub(self):
-        idx = self._load_balancer_pid()
-        return self.stubs[idx]
+    def _acquire_pid(self):
+        """Chooses a worker and accounts a request in flight on it, returning
+        the worker and its stub."""
+        with self.load_lock:
+            self._schedule_refresh()
+            pid = self._load_balancer_pid()
+            self.outstanding[pid] += 1
+            return pid, self.stubs[pid]
 
-    def _get_image_arg(self, image: np.array, args:dict=''):
-        image_proto = utils.numpy_to_proto(image)
+    def _release_pid(self, pid, trailing_metadata, error=None):
+        """Finishes a request on a worker, updating its load with the one it
+        reported. Ejects the worker after too many requests failed without
+        an answer from it, or right away if it's unavailable, such as when its
+        port refuses connections. Returns whether it was ejected, so the
+        request may go to another worker."""
+        with self.load_lock:
+            if pid not in self.channels:
+                # removed by a refresh in the meantime
+                return False
+            self.outstanding[pid] -= 1
+            answered = False
+            for key, value in trailing_metadata or ():
+                if key == LOAD_METADATA_KEY:
+                    self._update_load(pid, json.loads(value))
+                    answered = True
+            if error is None or answered or error.code() not in FAILURE_CODES:
+                self.failures[pid] = 0
+                return False
+            self.failures[pid] += 1
+            if self.failures[pid] >= EJECT_AFTER_FAILURES \
+                    or error.code() == grpc.StatusCode.UNAVAILABLE:
+                return self._eject(pid)
+            return False
+
+    def _update_load(self, pid, load: dict):
+        self.server_load[pid] = load['in_flight'] + sum(load['queued'].values())
+
+    def _parse_response(self, response):
+        return utils.decode_results(response)
+
+    def _parse_image_response(self, response):
+        metadata = json.loads(response.data)
+        if not response.HasField('image'):
+            return None, metadata
+        return utils.proto_to_numpy(response.image), metadata
+
+    def _parse_batch_image_response(self, response):
+        metadata = json.loads(response.data)
+        if isinstance(metadata, dict) and 'error' in metadata:
+            return metadata
+        return list(zip(utils.proto_to_numpy_list(response.images), metadata))
+
+    def _image_to_proto(self, image, lease=None):
+        """Image files are passed through, and numpy images are either compressed
+        with image_encoding or sent as raw pixels."""
+        if isinstance(image, bytes):
+            return utils.image_file_to_proto(image)
+        if self.image_encoding is not None:
+            return utils.numpy_to_encoded_proto(image, self.image_encoding, self.image_quality)
+        return utils.numpy_to_proto(image, lease)
+
+    def _get_image_arg(self, image: np.array, args:dict='', encoding: str='', lease=None):
+        image_proto = self._image_to_proto(image, lease)
         return server_pb2.ImageArgs(
                 image=image_proto,
                 model=self.model,
-                args=json.dumps(args))
+                args=json.dumps(args),
+                encoding=encoding)
 
-    def _get_batch_image_arg(self, image: np.array, args:dict=''):
-        image_proto = utils.numpy_list_to_proto(image)
+    def _get_batch_image_arg(self, image: np.array, args:dict='', encoding: str='',
+                             lease=None):
+        if self.image_encoding is None and self._servers_support('batch_tensor') \
+                and utils.is_batch_tensor(image):
+            # a single buffer, that the model gets as an array without copies
+            request = server_pb2.BatchImageArgs(
+                    model=self.model,
+                    args=json.dumps(args),
+                    encoding=encoding)
+            utils.numpy_list_to_batch_proto(image, lease, request.tensor)
+            return request
+        if self.image_encoding is None and not any(isinstance(x, bytes) for x in image):
+            image_proto = utils.numpy_list_to_proto(image, lease)
+        else:
+            image_proto = [self._image_to_proto(x) for x in image]
         return server_pb2.BatchImageArgs(
                 images=image_proto,
                 model=self.model,
-                args=json.dumps(args))
+                args=json.dumps(args),
+                encoding=encoding)
 
-    def _get_text_arg(self, text: str, args:dict=''):
+    def _get_text_arg(self, text: str, args:dict='', encoding: str=''):
         return server_pb2.TextArgs(
                 text=text,
                 model=self.model,
-                args=json.dumps(args))
+                args=json.dumps(args),
+                encoding=encoding)
 
-    def _get_batch_text_arg(self, text: list[str], args:dict=''):
+    def _get_batch_text_arg(self, text: list[str], args:dict='', encoding: str=''):
         return server_pb2.BatchTextArgs(
                 texts=text,
                 model=self.model,
-                args=json.dumps(args))
+                args=json.dumps(args),
+                encoding=encoding)
 
 
     def _form_batch(self, inputs: list, input_type: InputType):
         if len(inputs) == 0:
             return None
-
-        batch_inputs = []
-        if input_type == InputType.TEXT:
-            batch_inputs = inputs
-        elif self.size is not None:
+        if input_type == InputType.IMAGE and self.preprocessor is not None:
             # In order to avoid passing unnecessary data to model server, resize and change
             # the colors before sending them
-            gray = len(self.size) == 2
-            for im in inputs:
-                if min(im.shape) == 0: # invalid image
-                    batch_inputs.append(
-                        np.zeros((self.size[0],self.size[1],3),dtype=np.uint8))
-                    continue
+            return self.preprocessor.run(inputs)
+        return inputs
 
-                if im.shape[0] != self.size[0] or im.shape[1] > self.size[1]:
-                    scale = self.size[0]/im.shape[0]
-                    if scale < 1:
-                        cols = min(self.size[1], math.ceil(scale*im.shape[1]))
-                        tmp_img = Image.fromarray(im)
-                        tmp_img = tmp_img.resize((cols, self.size[0]), Image.BICUBIC)
-                        im = np.array(tmp_img)
-
-                if gray and len(im.shape) > 2:
-                    im = im.convert('L')
-                batch_inputs.append(im)
-        else:
-            batch_inputs = inputs
+    def _preprocess_image(self, image):
+        if self.preprocessor is None:
+            return image
+        return self.preprocessor.run([image])[0]
 
-        return batch_inputs
+    def _split_batch(self, batch: list):
+        """Splits a batch into contiguous chunks, to be sent to different workers."""
+        chunk_size = self.max_chunk or math.ceil(len(batch)/len(self.stubs))
+        chunk_size = max(1, chunk_size)
+        return [batch[i:i+chunk_size] for i in range(0, len(batch), chunk_size)]
 
-    def _get_num_parallel_workers(self):
-        stub = self._get_stub()
-        response = stub.GetNumParallelWorkers(
-                server_pb2.StringArg(data=self.model))
-        return json.loads(response.data)['num_workers']
+    def _merge_chunks(self, chunks: list, responses: list):
+        """Puts the chunks results back in input order. A chunk that failed, either
+        with an exception or an error response, reports its error on each item.
+        """
+        if all(isinstance(x, np.ndarray) for x in responses):
+            return np.concatenate(responses)
+
+        results = []
+        for chunk, response in zip(chunks, responses):
+            if isinstance(response, BaseException):
+                response = {'error': str(response)}
+            if isinstance(response, dict) and 'error' in response:
+                results.extend([response]*len(chunk))
+            else:
+                results.extend(response)
+        return results
 
     def _bad_input(self):
         return {}
 
-    def run_image(self, image: np.array, args:dict=''):
-        """Runs an image into the given model."""
-        if image is None or min(image.shape[0:2]) <= 2:
+    def _is_bad_image(self, image):
+        if isinstance(image, bytes):
+            return len(image) == 0
+        if image is None:
+            return True
+        if image.ndim in (2, 3):
+            return min(image.shape[0:2]) <= 2
+        # other tensors, such as features or stacks of images
+        return image.size == 0
+
+    def _get_stream_arg(self, sequence_id: int, frame, args:dict='', encoding: str='',
+                        lease=None):
+        return server_pb2.StreamImageArgs(
+                sequence_id=sequence_id,
+                image=self._image_to_proto(frame, lease),
+                model=self.model,
+                args=json.dumps(args),
+                encoding=encoding)
+
+    def _apply_health(self, res: dict):
+        with self.load_lock:
+            for pid in res['stopped_serving']:
+                self._eject(pid)
+        for pid in res['serving']:
+            self._readmit(pid)
+
+    @abc.abstractmethod
+    def _schedule_refresh(self):
+        """Starts a refresh on the background when it's due. Call with load_lock."""
+
+
+class ModelClient(_ModelClientBase):
+    """Client of a model, that balances its requests among all the workers of
+    the server. ip may also be a list of hosts, with or without their ports,
+    or a DNS name with many addresses, such as a headless service, to balance
+    them among the workers of all those servers. Every refresh_s the client
+    resolves the hosts again, and follows the workers that come and go. The
+    options are given as a ClientConfig, or one by one as keyword arguments.
+    """
+    def __init__(self, model: str, ip: str, port: str='50000', timeout: int=60*5, *,
+                 config: ClientConfig=None, **options):
+        super().__init__(model, ip, port, timeout, _client_config(config, options))
+        # sends the chunks of a batch at the same time, see _size_executor
+        self.executor = None
+        self.connect()
+
+    def connect(self):
+        """Opens one channel per server worker, and gets the input shape of the model."""
+        self._connect(self.timeout)
+        self.num_server_workers = len(self.stubs)
+
+        if self.shared_memory and len(self._server_ids()) == 1:
+            self.shm_pool = self._negotiate_shared_memory()
+        self.size = self.get_input_shape()
+        self.preprocessor = None if self.size is None else Preprocessor(self.size)
+
+    def _connect(self, timeout: int):
+        """Opens one channel/stub per server worker that loads our model, on
+        the port of each worker, connecting to all of them at the same time."""
+        deadline = time.monotonic() + timeout
+        servers, addresses = self._discover(timeout)
+        added, _ = self._apply_topology(servers, addresses)
+        self._connect_workers(added, max(0, deadline-time.monotonic()))
+        if len(self.stubs) == 0:
+            raise ConnectionTimeout(self.hosts, self.port, timeout)
+
+    def _discover(self, timeout: float):
+        """Asks every address of the hosts for the workers of its server,
+        waiting for a server to answer, and for the workers of the ones that
+        answered to be ready. Once one answers, the others have TOPOLOGY_TIMEOUT_S
+        more to start. Returns address -> topology, and the addresses."""
+        deadline = time.monotonic() + timeout
+        servers = {}
+        answered_at = None
+        addresses = pending = self._resolve()
+        while True:
+            starting, failed = self._update_servers(servers, self._get_topologies(pending))
+            if len(servers) > 0 and answered_at is None:
+                answered_at = time.monotonic()
+            if answered_at is not None and time.monotonic()-answered_at > TOPOLOGY_TIMEOUT_S:
+                failed = []
+            pending = starting + failed
+            if (len(servers) > 0 and len(pending) == 0) or time.monotonic() >= deadline:
+                return servers, addresses
+            time.sleep(TOPOLOGY_RETRY_S)
+            if len(servers) == 0:
+                addresses = pending = self._resolve()
+
+    def _get_topologies(self, addresses: list):
+        """address -> GetTopology response, or the error, asking all of them at
+        the same time. The channels are new every time, so the servers that
+        just started are found without waiting for the reconnection backoff."""
+        with contextlib.ExitStack() as stack:
+            calls = {}
+            for address in addresses:
+                channel = stack.enter_context(
+                    grpc.insecure_channel(address, options=self._channel_options()))
+                calls[address] = server_pb2_grpc.ServerStub(channel).GetTopology.future(
+                    server_pb2.EmptyArgs(), wait_for_ready=True, timeout=TOPOLOGY_TIMEOUT_S)
+            results = {}
+            for address, call in calls.items():
+                try:
+                    results[address] = json.loads(call.result().data)
+                except grpc.RpcError as e:
+                    results[address] = e
+            return results
+
+    def _connect_workers(self, workers: list, timeout: float):
+        """Opens a channel to each worker, connecting to all of them at the same
+        time, and sends them requests once connected. The workers that can't be
+        reached on their own ports, such as when only the shared port is
+        published, get a channel on the shared port of their server instead."""
+        deadline = time.monotonic() + timeout
+        unreachable = self._open_channels(workers, min(timeout/2, WORKER_CONNECT_TIMEOUT_S))
+        self._open_channels(self._on_shared_port(unreachable),
+                            max(0, deadline-time.monotonic()))
+        self._size_executor()
+
+    def _size_executor(self):
+        """Grows the executor to a thread per worker, as workers are added. The
+        calls on the old one finish, and its threads exit once it's unused."""
+        if self.executor is None or \
+                self.executor._max_workers < len(self.channels):  # pylint: disable=protected-access
+            self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.channels)))
+
+    def _open_channels(self, workers: list, timeout: float):
+        """Connects to the workers, returning the ones that didn't connect."""
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            self._add_worker(worker, grpc.insecure_channel)
+        futures = {x['key']: grpc.channel_ready_future(self.channels[x['key']]) for x in workers}
+        unreachable = []
+        for worker, future in zip(workers, futures.values()):
+            try:
+                future.result(timeout=max(0, deadline-time.monotonic()))
+            except grpc.FutureTimeoutError:
+                # the worker went away since it was listed, or its port is closed
+                self._remove_worker(worker['key']).close()
+                unreachable.append(worker)
+                continue
+            self._readmit(worker['key'])
+        return unreachable
+
+    def refresh(self):
+        """Checks the health of every worker, and resolves the hosts and asks
+        them for their workers again, adding the new ones and removing the ones
+        that are gone. Runs every refresh_s while the client sends requests."""
+        retired, self.retired = self.retired, []
+        for channel in retired:
+            channel.close()
+        self.health_check()
+        servers, addresses = self._discover(0)
+        added, removed = self._apply_topology(servers, addresses)
+        self._check_shared_memory(added)
+        self._connect_workers(added, TOPOLOGY_TIMEOUT_S)
+        for key in removed:
+            self.retired.append(self._remove_worker(key))
+
+    def _schedule_refresh(self):
+        """Starts a refresh on the background when it's due. Call with load_lock."""
+        if self.refresh_s is None or self.refreshing \
+                or time.monotonic()-self.last_refresh < self.refresh_s:
+            return
+        self.refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except grpc.RpcError:
+            pass
+        finally:
+            self.last_refresh = time.monotonic()
+            self.refreshing = False
+
+    def _negotiate_shared_memory(self):
+        """Returns a SharedMemoryPool if the server can read our shared memory."""
+        segment, arg = self._shared_memory_probe()
+        if segment is None:
+            return None
+        try:
+            response = self._call('CheckSharedMemory', arg)
+        except grpc.RpcError: # older servers, without shared memory support
+            return None
+        finally:
+            segment.close()
+            segment.unlink()
+        return shm.SharedMemoryPool() if response['ok'] else None
+
+    def close(self):
+        for channel in list(self.channels.values()) + self.retired:
+            channel.close()
+        for pool in (self.shm_pool, self.retired_shm_pool):
+            if pool is not None:
+                pool.close()
+
+    def _call(self, method: str, run_arg, parse_response=None, retry: bool=True):
+        pid, stub = self._acquire_pid()
+        trailing_metadata, error = None, None
+        try:
+            response, call = getattr(stub, method).with_call(
+                run_arg, timeout=self._call_timeout(method), metadata=self.call_metadata)
+            trailing_metadata = call.trailing_metadata()
+        except grpc.RpcError as e:
+            # rejected requests also report the worker load
+            trailing_metadata, error = e.trailing_metadata(), e
+        finally:
+            ejected = self._release_pid(pid, trailing_metadata, error)
+        if error is not None:
+            # the worker went away, the request is tried once on another one
+            if not (ejected and retry):
+                raise error
+            return self._call(method, run_arg, parse_response, retry=False)
+        return (parse_response or self._parse_response)(response)
+
+    def _run_batch(self, method: str, get_arg, batch: list, args:dict='',
+                   parse_response=None):
+        chunks = self._split_batch(batch)
+        if len(chunks) == 1:
+            return self._call(method, get_arg(batch, args), parse_response)
+
+        futures = [self.executor.submit(self._call, method, get_arg(chunk, args), parse_response)
+                   for chunk in chunks]
+        responses = []
+        for future in futures:
+            try:
+                responses.append(future.result())
+            except grpc.RpcError as e:
+                responses.append(e)
+        return self._merge_chunks(chunks, responses)
+
+
+    def run_image(self, image: np.array, args:dict='',
+                  encoding: str=utils.JSON_ENCODING):
+        """Runs an image into the given model. The image may be a numpy image, or
+        the bytes of a JPEG, PNG or WebP file that the server decodes."""
+        if self._is_bad_image(image):
             return self._bad_input()
-        stub = self._get_stub()
-        run_arg = self._get_image_arg(image, args)
-        response = stub.RunImage(run_arg)
-        return json.loads(response.data)
+        image = self._preprocess_image(image)
+        with self._shared_memory_lease() as lease:
+            return self._call('RunImage', self._get_image_arg(image, args, encoding, lease))
 
-    def run_image_batch(self, images: list[np.array], args:dict=''):
-        """Runs a batch of images into the given model."""
+    def run_image_batch(self, images: list[np.array], args:dict='',
+                        encoding: str=utils.JSON_ENCODING):
+        """Runs a batch of images into the given model. Just like run_image,
+        images may also be the bytes of image files."""
         batch = self._form_batch(images, InputType.IMAGE)
         if batch is None:
             return self._bad_input()
-        stub = self._get_stub()
-        run_arg = self._get_batch_image_arg(batch, args)
-        response = stub.RunBatchImage(run_arg)
-        return json.loads(response.data)
+        with self._shared_memory_lease() as lease:
+            get_arg = functools.partial(self._get_batch_image_arg, encoding=encoding, lease=lease)
+            return self._run_batch('RunBatchImage', get_arg, batch, args)
+
+    def run_image_to_image(self, image: np.array, args:dict=''):
+        """Runs an image into the given model, that returns another image. Returns
+        the resulting numpy image and its metadata, or None and an error dict.
+        """
+        if self._is_bad_image(image):
+            return None, self._bad_input()
+        image = self._preprocess_image(image)
+        with self._shared_memory_lease() as lease:
+            return self._call('RunImageToImage', self._get_image_arg(image, args, lease=lease),
+                              self._parse_image_response)
+
+    def run_image_to_image_batch(self, images: list[np.array], args:dict=''):
+        """Runs a batch of images into the given model, that returns other images.
+        Returns a list with a (numpy image, metadata) pair for each input.
+        """
+        batch = self._form_batch(images, InputType.IMAGE)
+        if batch is None:
+            return []
+        with self._shared_memory_lease() as lease:
+            get_arg = functools.partial(self._get_batch_image_arg, lease=lease)
+            results = self._run_batch('RunBatchImageToImage', get_arg, batch,
+                                      args, self._parse_batch_image_response)
+        if isinstance(results, dict):
+            results = [results]*len(batch)
+        return [(None, x) if isinstance(x, dict) else x for x in results]
+
+    def run_image_stream(self, frames, args:dict='', window: int=4, drop_frames: bool=False,
+                         encoding: str=utils.JSON_ENCODING):
+        """Runs a stream of frames, from any iterable such as a camera generator,
+        over a single bidirectional stream. Yields (sequence_id, results) as they
+        arrive, where sequence_id is the frame index within frames.
 
-    def run_text(self, text: str, args:dict=''):
+        At most window frames are in flight. When it is full the next frame waits
+        for a result, or is skipped if drop_frames is set, which keeps live sources
+        at their frame rate. Skipped frames have no results.
+        """
+        slots = threading.Semaphore(window)
+        # shared memory of each frame, given back once its result arrives
+        leases = {}
+
+        def requests():
+            for sequence_id, frame in enumerate(frames):
+                if not slots.acquire(blocking=not drop_frames):
+                    continue
+                stack = contextlib.ExitStack()
+                lease = stack.enter_context(self._shared_memory_lease())
+                leases[sequence_id] = stack
+                yield self._get_stream_arg(sequence_id, frame, args, encoding, lease)
+
+        pid, stub = self._acquire_pid()
+        responses = stub.RunImageStream(requests(), metadata=self.call_metadata)
+        try:
+            for response in responses:
+                leases.pop(response.sequence_id).close()
+                slots.release()
+                yield response.sequence_id, utils.decode_results(response.response)
+        finally:
+            responses.cancel()
+            self._release_pid(pid, None)
+            for stack in leases.values():
+                stack.close()
+
+    def run_text(self, text: str, args:dict='',
+                 encoding: str=utils.JSON_ENCODING):
         """Runs a text into the given model."""
         if not isinstance(text, str):
             return self._bad_input()
-        stub = self._get_stub()
-        run_arg = self._get_text_arg(text, args)
-        response = stub.RunText(run_arg)
-        return json.loads(response.data)
+        return self._call('RunText', self._get_text_arg(text, args, encoding))
 
-    def run_text_batch(self, texts: list[str], args:dict=''):
+    def run_text_batch(self, texts: list[str], args:dict='',
+                       encoding: str=utils.JSON_ENCODING):
         """Runs a batch of texts into the given model."""
         batch = self._form_batch(texts, InputType.TEXT)
         if batch is None:
             return self._bad_input()
-        stub = self._get_stub()
-        run_arg = self._get_batch_text_arg(batch, args)
-        response = stub.RunBatchText(run_arg)
-        return json.loads(response.data)
+        get_arg = functools.partial(self._get_batch_text_arg, encoding=encoding)
+        return self._run_batch('RunBatchText', get_arg, batch, args)
 
     def get_input_shape(self):
         """Get the input model shape, returns None if it doesn't have one."""
-        stub = self._get_stub()
-        response = stub.GetInputShape(
-                server_pb2.StringArg(data=self.model))
-        return json.loads(response.data)
+        return self._call('GetInputShape', server_pb2.StringArg(data=self.model))
 
     def health_check(self):
         """Checks all connections health status, returning a dict with the workers
-        pids that are still serving and the ones that are not.
+        that are still serving and the ones that are not. The ones that are not
+        stop getting requests, until they serve again.
+        """
+        request = health_pb2.HealthCheckRequest(service='TinyModelServer')
+        calls = {k: v.Check.future(request, timeout=HEALTH_CHECK_TIMEOUT_S)
+                 for k,v in list(self.health_stubs.items())}
+        res = {'serving': [], 'stopped_serving': []}
+        for pid, call in calls.items():
+            try:
+                serving = call.result().status == health_pb2.HealthCheckResponse.SERVING
+            except grpc.RpcError:
+                serving = False
+            res['serving' if serving else 'stopped_serving'].append(pid)
+
+        self._apply_health(res)
+        return res
+
+    def get_load(self):
+        """Gets the current load of every worker, returning a dict by Worker.
+        It also refreshes the load used by the load balancer.
+        """
+        res = {}
+        for pid, stub in list(self.stubs.items()):
+            response = stub.GetLoad(server_pb2.EmptyArgs())
+            res[pid] = json.loads(response.data)
+            with self.load_lock:
+                self._update_load(pid, res[pid])
+        return res
+
+    def get_stats(self):
+        """Gets the stats of the server: how each model was loaded on the worker
+        that answers, and the hits, misses and evictions of each cache, summed
+        over all the workers.
+        """
+        return self._call('GetStats', server_pb2.EmptyArgs(), lambda x: json.loads(x.data))
+
+    def profile(self, seconds: float=10, mode: str='sample', memory: bool=False,
+                all_workers: bool=False):
+        """Profiles a server worker, or all of them, while they keep serving. Returns
+        a summary dict, and the whole profile as collapsed stacks for flamegraph.pl
+        on 'sample' mode, or as a pstats dump on 'cprofile' mode."""
+        arg = server_pb2.StringArg(data=json.dumps(
+            {'seconds': seconds, 'mode': mode, 'memory': memory, 'all_workers': all_workers}))
+        return self._call('Profile', arg, lambda x: (json.loads(x.data), x.payload))
+
+    def reload_model(self):
+        """Reloads the model on every server worker without stopping the server,
+        returning the version each of them is serving now."""
+        return self._call('ReloadModel', server_pb2.StringArg(data=self.model))
+
+    def stop_server(self):
+        return self._call('StopServer', server_pb2.StringArg(data=self.model))
+
+
+class AsyncModelClient(_ModelClientBase):
+    """asyncio version of ModelClient, built on grpc.aio. It has the same API,
+    but every call must be awaited, so a single caller can keep many requests
+    in flight. Create it with:
+
+        model = await AsyncModelClient.create('example', 'localhost')
+    """
+    def __init__(self, model: str, ip: str, port: str='50000', timeout: int=60*5, *,
+                 config: ClientConfig=None, max_in_flight: int=16, **options):
+        # The connection requires a running event loop, and is done by connect()
+        super().__init__(model, ip, port, timeout, _client_config(config, options))
+        # limits the number of requests in flight on each worker channel
+        self.in_flight = collections.defaultdict(lambda: asyncio.Semaphore(max_in_flight))
+        self.refresh_task = None
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        client = cls(*args, **kwargs)
+        await client.connect()
+        return client
+
+    async def connect(self):
+        """Opens one channel per parallel server worker, just like ModelClient."""
+        await self._connect(self.timeout)
+        self.num_server_workers = len(self.stubs)
+
+        if self.shared_memory and len(self._server_ids()) == 1:
+            self.shm_pool = await self._negotiate_shared_memory()
+        self.size = await self.get_input_shape()
+        self.preprocessor = None if self.size is None else Preprocessor(self.size)
+
+    async def close(self):
+        for channel in list(self.channels.values()) + self.retired:
+            await channel.close()
+        for pool in (self.shm_pool, self.retired_shm_pool):
+            if pool is not None:
+                pool.close()
+
+    async def _negotiate_shared_memory(self):
+        """Returns a SharedMemoryPool if the server can read our shared memory."""
+        segment, arg = self._shared_memory_probe()
+        if segment is None:
+            return None
+        try:
+            response = await self._call('CheckSharedMemory', arg)
+        except grpc.RpcError: # older servers, without shared memory support
+            return None
+        finally:
+            segment.close()
+            segment.unlink()
+        return shm.SharedMemoryPool() if response['ok'] else None
+
+    async def __aenter__(self):
+        if not self.channels:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *_args):
+        await self.close()
+
+    async def _connect(self, timeout: int):
+        deadline = time.monotonic() + timeout
+        servers, addresses = await self._discover(timeout)
+        added, _ = self._apply_topology(servers, addresses)
+        await self._connect_workers(added, max(0, deadline-time.monotonic()))
+        if len(self.stubs) == 0:
+            raise ConnectionTimeout(self.hosts, self.port, timeout)
+
+    async def _discover(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        servers = {}
+        answered_at = None
+        addresses = pending = await asyncio.to_thread(self._resolve)
+        while True:
+            starting, failed = self._update_servers(servers, await self._get_topologies(pending))
+            if len(servers) > 0 and answered_at is None:
+                answered_at = time.monotonic()
+            if answered_at is not None and time.monotonic()-answered_at > TOPOLOGY_TIMEOUT_S:
+                failed = []
+            pending = starting + failed
+            if (len(servers) > 0 and len(pending) == 0) or time.monotonic() >= deadline:
+                return servers, addresses
+            await asyncio.sleep(TOPOLOGY_RETRY_S)
+            if len(servers) == 0:
+                addresses = pending = await asyncio.to_thread(self._resolve)
+
+    async def _get_topologies(self, addresses: list):
+        async def get_topology(address):
+            async with grpc.aio.insecure_channel(address,
+                                                 options=self._channel_options()) as channel:
+                response = await server_pb2_grpc.ServerStub(channel).GetTopology(
+                    server_pb2.EmptyArgs(), wait_for_ready=True, timeout=TOPOLOGY_TIMEOUT_S)
+                return json.loads(response.data)
+
+        results = await asyncio.gather(*[get_topology(x) for x in addresses],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, grpc.RpcError):
+                raise result
+        return dict(zip(addresses, results))
+
+    async def _connect_workers(self, workers: list, timeout: float):
+        deadline = time.monotonic() + timeout
+        unreachable = await self._open_channels(workers, min(timeout/2, WORKER_CONNECT_TIMEOUT_S))
+        await self._open_channels(self._on_shared_port(unreachable),
+                                  max(0, deadline-time.monotonic()))
+
+    async def _open_channels(self, workers: list, timeout: float):
+        for worker in workers:
+            self._add_worker(worker, grpc.aio.insecure_channel)
+        keys = [x['key'] for x in workers]
+        results = await asyncio.gather(
+            *[asyncio.wait_for(self.channels[key].channel_ready(), timeout) for key in keys],
+            return_exceptions=True)
+        unreachable = []
+        for worker, result in zip(workers, results):
+            if isinstance(result, asyncio.TimeoutError):
+                await self._remove_worker(worker['key']).close()
+                unreachable.append(worker)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                self._readmit(worker['key'])
+        return unreachable
+
+    def _remove_worker(self, key):
+        self.in_flight.pop(key, None)
+        return super()._remove_worker(key)
+
+    async def refresh(self):
+        """Same as ModelClient.refresh, but awaited."""
+        retired, self.retired = self.retired, []
+        for channel in retired:
+            await channel.close()
+        await self.health_check()
+        servers, addresses = await self._discover(0)
+        added, removed = self._apply_topology(servers, addresses)
+        self._check_shared_memory(added)
+        await self._connect_workers(added, TOPOLOGY_TIMEOUT_S)
+        for key in removed:
+            self.retired.append(self._remove_worker(key))
+
+    def _schedule_refresh(self):
+        if self.refresh_s is None or self.refreshing \
+                or time.monotonic()-self.last_refresh < self.refresh_s:
+            return
+        self.refreshing = True
+        self.refresh_task = asyncio.get_running_loop().create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except grpc.RpcError:
+            pass
+        finally:
+            self.last_refresh = time.monotonic()
+            self.refreshing = False
+
+    async def _call(self, method: str, run_arg, parse_response=None, retry: bool=True):
+        pid, stub = self._acquire_pid()
+        trailing_metadata, error = None, None
+        options = {'timeout': self._call_timeout(method), 'metadata': self.call_metadata}
+        try:
+            async with self.in_flight[pid]:
+                call = getattr(stub, method)(run_arg, **options)
+                response = await call
+            trailing_metadata = await call.trailing_metadata()
+        except grpc.RpcError as e:
+            trailing_metadata, error = e.trailing_metadata(), e
+        finally:
+            ejected = self._release_pid(pid, trailing_metadata, error)
+        if error is not None:
+            if not (ejected and retry):
+                raise error
+            return await self._call(method, run_arg, parse_response, retry=False)
+        if parse_response is None:
+            return self._parse_response(response)
+        # such as decoding the images of the response, off the event loop
+        return await asyncio.to_thread(parse_response, response)
+
+    def _image_arg(self, image: np.array, args:dict='', encoding: str='', lease=None):
+        """Preprocesses and encodes an image, to run on a thread instead of
+        blocking the event loop."""
+        return self._get_image_arg(self._preprocess_image(image), args, encoding, lease)
+
+    async def _run_batch(self, method: str, get_arg, batch: list, args:dict='',
+                         parse_response=None):
+        chunks = self._split_batch(batch)
+        run_args = await asyncio.to_thread(lambda: [get_arg(x, args) for x in chunks])
+        if len(chunks) == 1:
+            return await self._call(method, run_args[0], parse_response)
+
+        responses = await asyncio.gather(
+            *[self._call(method, x, parse_response) for x in run_args],
+            return_exceptions=True)
+        for response in responses:
+            if isinstance(response, BaseException) and not isinstance(response, grpc.RpcError):
+                raise response
+        return self._merge_chunks(chunks, responses)
+
+    async def run_image(self, image: np.array, args:dict='',
+                        encoding: str=utils.JSON_ENCODING):
+        """Runs an image into the given model. The image may be a numpy image, or
+        the bytes of a JPEG, PNG or WebP file that the server decodes."""
+        if self._is_bad_image(image):
+            return self._bad_input()
+        with self._shared_memory_lease() as lease:
+            arg = await asyncio.to_thread(self._image_arg, image, args, encoding, lease)
+            return await self._call('RunImage', arg)
+
+    async def run_image_batch(self, images: list[np.array], args:dict='',
+                              encoding: str=utils.JSON_ENCODING):
+        """Runs a batch of images into the given model. Just like run_image,
+        images may also be the bytes of image files."""
+        batch = await asyncio.to_thread(self._form_batch, images, InputType.IMAGE)
+        if batch is None:
+            return self._bad_input()
+        with self._shared_memory_lease() as lease:
+            get_arg = functools.partial(self._get_batch_image_arg, encoding=encoding, lease=lease)
+            return await self._run_batch('RunBatchImage', get_arg, batch, args)
+
+    async def run_image_to_image(self, image: np.array, args:dict=''):
+        """Runs an image into the given model, that returns another image. Returns
+        the resulting numpy image and its metadata, or None and an error dict.
+        """
+        if self._is_bad_image(image):
+            return None, self._bad_input()
+        with self._shared_memory_lease() as lease:
+            arg = await asyncio.to_thread(self._image_arg, image, args, lease=lease)
+            return await self._call('RunImageToImage', arg, self._parse_image_response)
+
+    async def run_image_to_image_batch(self, images: list[np.array], args:dict=''):
+        """Runs a batch of images into the given model, that returns other images.
+        Returns a list with a (numpy image, metadata) pair for each input.
+        """
+        batch = await asyncio.to_thread(self._form_batch, images, InputType.IMAGE)
+        if batch is None:
+            return []
+        with self._shared_memory_lease() as lease:
+            get_arg = functools.partial(self._get_batch_image_arg, lease=lease)
+            results = await self._run_batch('RunBatchImageToImage', get_arg,
+                                            batch, args, self._parse_batch_image_response)
+        if isinstance(results, dict):
+            results = [results]*len(batch)
+        return [(None, x) if isinstance(x, dict) else x for x in results]
+
+    async def run_image_stream(self, frames, args:dict='', window: int=4,
+                               drop_frames: bool=False, encoding: str=utils.JSON_ENCODING):
+        """Same as ModelClient.run_image_stream, but an async generator. frames
+        may be either an iterable or an async iterable."""
+        slots = asyncio.Semaphore(window)
+        leases = {}
+
+        async def frames_iterator():
+            if hasattr(frames, '__aiter__'):
+                async for frame in frames:
+                    yield frame
+            else:
+                for frame in frames:
+                    yield frame
+
+        async def requests():
+            sequence_id = -1
+            async for frame in frames_iterator():
+                sequence_id += 1
+                if drop_frames and slots.locked():
+                    continue
+                await slots.acquire()
+                stack = contextlib.ExitStack()
+                lease = stack.enter_context(self._shared_memory_lease())
+                leases[sequence_id] = stack
+                yield await asyncio.to_thread(
+                    self._get_stream_arg, sequence_id, frame, args, encoding, lease)
+
+        pid, stub = self._acquire_pid()
+        call = stub.RunImageStream(requests(), metadata=self.call_metadata)
+        try:
+            async for response in call:
+                leases.pop(response.sequence_id).close()
+                slots.release()
+                yield response.sequence_id, utils.decode_results(response.response)
+        finally:
+            call.cancel()
+            self._release_pid(pid, None)
+            for stack in leases.values():
+                stack.close()
+
+    async def run_text(self, text: str, args:dict='',
+                       encoding: str=utils.JSON_ENCODING):
+        """Runs a text into the given model."""
+        if not isinstance(text, str):
+            return self._bad_input()
+        return await self._call('RunText', self._get_text_arg(text, args, encoding))
+
+    async def run_text_batch(self, texts: list[str], args:dict='',
+                             encoding: str=utils.JSON_ENCODING):
+        """Runs a batch of texts into the given model."""
+        batch = self._form_batch(texts, InputType.TEXT)
+        if batch is None:
+            return self._bad_input()
+        get_arg = functools.partial(self._get_batch_text_arg, encoding=encoding)
+        return await self._run_batch('RunBatchText', get_arg, batch, args)
+
+    async def get_input_shape(self):
+        """Get the input model shape, returns None if it doesn't have one."""
+        return await self._call('GetInputShape', server_pb2.StringArg(data=self.model))
+
+    async def health_check(self):
+        """Checks all connections health status, returning a dict with the workers
+        that are still serving and the ones that are not, just like ModelClient.
         """
         request = health_pb2.HealthCheckRequest(service='TinyModelServer')
+        pids = list(self.health_stubs.keys())
+        responses = await asyncio.gather(
+            *[self.health_stubs[pid].Check(request, timeout=HEALTH_CHECK_TIMEOUT_S)
+              for pid in pids], return_exceptions=True)
         res = {'serving': [], 'stopped_serving': []}
-        for pid in self.health_stubs:
-            resp = self.health_stubs[pid].Check(request)
-            if resp.status == health_pb2.HealthCheckResponse.SERVING:
+        for pid, resp in zip(pids, responses):
+            if isinstance(resp, BaseException) and not isinstance(resp, grpc.RpcError):
+                raise resp
+            if not isinstance(resp, grpc.RpcError) \
+                    and resp.status == health_pb2.HealthCheckResponse.SERVING:
                 res['serving'].append(pid)
             else:
                 res['stopped_serving'].append(pid)
 
+        self._apply_health(res)
         return res
 
-    def stop_server(self):
-        stub = self._get_stub()
-        response = stub.StopServer(server_pb2.StringArg(data=self.model))
-        return json.loads(response.data)
+    async def get_load(self):
+        """Gets the current load of every worker, returning a dict by Worker.
+        It also refreshes the load used by the load balancer.
+        """
+        stubs = list(self.stubs.items())
+        pids = [pid for pid, _ in stubs]
+        responses = await asyncio.gather(
+            *[stub.GetLoad(server_pb2.EmptyArgs()) for _, stub in stubs])
+        res = {}
+        for pid, response in zip(pids, responses):
+            res[pid] = json.loads(response.data)
+            with self.load_lock:
+                self._update_load(pid, res[pid])
+        return res
+
+    async def get_stats(self):
+        return await self._call('GetStats', server_pb2.EmptyArgs(), lambda x: json.loads(x.data))
+
+    async def profile(self, seconds: float=10, mode: str='sample', memory: bool=False,
+                      all_workers: bool=False):
+        arg = server_pb2.StringArg(data=json.dumps(
+            {'seconds': seconds, 'mode': mode, 'memory': memory, 'all_workers': all_workers}))
+        return await self._call('Profile', arg, lambda x: (json.loads(x.data), x.payload))
+
+    async def reload_model(self):
+        return await self._call('ReloadModel', server_pb2.StringArg(data=self.model))
+
+    async def stop_server(self):
+        return await self._call('StopServer', server_pb2.StringArg(data=self.model))
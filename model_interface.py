@@ -3,11 +3,51 @@ import abc
 
 class ModelInterface(abc.ABC):
 
+    @classmethod
+    def is_fork_safe(cls):
+        """ Returns False if the model can't be created before the workers are
+            forked, when PRELOAD_MODELS is set. For instance, models that start
+            threads or initialize CUDA on __init__. Those are loaded by
+            every worker instead.
+        """
+        return True
+
+
     def get_input_shape(self):
         """ Returns numpy shape """
         return None
 
 
+    def get_batch_config(self):
+        """ Returns None to run every single request on its own, or a dict
+            with 'max_batch_size' and 'max_wait_ms' to let the server merge
+            concurrent single requests into one run_batch call.
+        """
+        return None
+
+
+    def get_cache_config(self):
+        """ Returns None to run every request, or a dict with the ResultCache
+            options ('max_entries', 'max_mb' and 'ttl_s') to cache the results
+            of repeated inputs. Only for deterministic models.
+        """
+        return None
+
+
+    def get_max_concurrency(self):
+        """ Returns how many threads of a worker may call run/run_batch at the
+            same time. Keep the default of 1 unless the model is thread-safe.
+        """
+        return 1
+
+
+    def decodes_images(self):
+        """ Returns True to receive images sent as files (JPEG, PNG or WebP) as
+            their encoded bytes, instead of decoded numpy images.
+        """
+        return False
+
+
     @abc.abstractmethod
     def run(self, data, args):
         """ Returns a response dict """
@@ -15,7 +55,8 @@ class ModelInterface(abc.ABC):
 
     def run_batch(self, data, args):
         """ Same interface as run, however the images batch is encoded on
-            a single numpy image. If the model does not provide a batch option
-            just call it once for every input data.
+            a single numpy array when all the images have the same shape, or
+            a list of them otherwise. If the model does not provide a batch
+            option just call it once for every input data.
         """
         return [self.run(x, args) for x in data]
@@ -0,0 +1,34 @@
+import numpy as np
+
+from model_interface import ModelInterface
+
+
+class Model(ModelInterface):
+    """ CPU-bound synthetic model for the benchmarks. Projects the mean color
+        of the image with a few matrix multiplications, like a small dense
+        network. Pass {'iterations': n} to make it slower.
+    """
+
+    def __init__(self):
+        rng = np.random.default_rng(0)
+        self.size = 512
+        self.weights = rng.standard_normal((self.size, self.size), dtype=np.float32) / self.size
+
+    def get_input_shape(self):
+        return None
+
+    def get_max_concurrency(self):
+        """ NumPy releases the GIL on matrix multiplications """
+        return 4
+
+    def run(self, data, args):
+        return self.run_batch([data], args)[0]
+
+    def run_batch(self, data, args):
+        features = np.zeros((len(data), self.size), dtype=np.float32)
+        for i, im in enumerate(data):
+            channels = im.reshape(-1, im.shape[2] if im.ndim == 3 else 1).mean(axis=0)
+            features[i, :len(channels)] = channels
+        for _ in range(int(args.get('iterations', 8))):
+            features = np.tanh(features @ self.weights)
+        return [x[:4].tolist() for x in features]
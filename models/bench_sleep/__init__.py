@@ -0,0 +1,20 @@
+import time
+
+from model_interface import ModelInterface
+
+
+class Model(ModelInterface):
+    """ Synthetic model for the benchmarks that only waits, like a model
+        running on a GPU or a remote service, so the benchmarks measure the
+        server overhead. Pass {'ms': n} to change how long it waits.
+    """
+
+    def get_input_shape(self):
+        return None
+
+    def get_max_concurrency(self):
+        return 16
+
+    def run(self, data, args):
+        time.sleep(float(args.get('ms', 10)) / 1000.)
+        return {'size': len(data)}
@@ -0,0 +1,21 @@
+import numpy as np
+
+from model_interface import ModelInterface
+
+
+class Model(ModelInterface):
+
+    def __init__(self):
+        """ Here you may load an instance of your model """
+        self.model = 'load my model here'
+
+    def get_input_shape(self):
+        """ Returns just like numpy shape """
+        return None
+
+    def run(self, data, args):
+        """ Returns a segmentation mask with the input height and width,
+            along with its metadata
+        """
+        mask = np.zeros(data.shape[0:2], dtype=np.uint8)
+        return mask, {'classes': ['background']}
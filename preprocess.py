@@ -0,0 +1,120 @@
+import collections
+import functools
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+_mode_by_channels = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+
+@functools.cache
+def _get_executor():
+    # created on first use, and shared by all the clients of the process
+    return ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def _timed(seconds: dict, stage: str, function, *args):
+    begin = time.perf_counter()
+    result = function(*args)
+    seconds[stage] = seconds.get(stage, 0.) + time.perf_counter() - begin
+    return result
+
+
+class Preprocessor:
+    """Resizes the images and converts their colors to the input shape of a model
+    on the client, so no unnecessary data is sent to the server. Images taller
+    than the model are shrunk to its height, without exceeding its width, and
+    gray, RGB and RGBA images are converted to its channels. The images of a
+    batch are processed in parallel, since Pillow releases the GIL.
+
+    Only uint8 images are changed, other arrays and image files are sent as they are.
+    """
+
+    def __init__(self, input_shape):
+        self.height = input_shape[0]
+        self.width = input_shape[1]
+        self.channels = 1 if len(input_shape) == 2 else input_shape[2]
+        self.lock = threading.Lock()
+        self.images = 0
+        self.batches = 0
+        # stage -> seconds, summed over all the images
+        self.seconds = collections.defaultdict(float)
+
+    def output_shape(self, shape: tuple):
+        """Shape of an image of the given shape once preprocessed."""
+        height, width = shape[0], shape[1]
+        if self.height is not None and height > self.height:
+            width = math.ceil(self.height/height*width)
+            if self.width is not None:
+                width = min(self.width, width)
+            height = self.height
+        channels = 1 if len(shape) == 2 else shape[2]
+        if channels in _mode_by_channels and self.channels in _mode_by_channels:
+            channels = self.channels
+        return (height, width) if channels == 1 else (height, width, channels)
+
+    def _needs_work(self, image):
+        return isinstance(image, np.ndarray) and image.dtype == np.uint8 and image.ndim in (2, 3) \
+            and self.output_shape(image.shape) != image.shape
+
+    def _blank(self):
+        """Replaces empty images, keeping their position on the batch."""
+        return np.zeros(self.output_shape((self.height or 1, self.width or 1, 3)), dtype=np.uint8)
+
+    def run(self, images: list):
+        """Preprocesses a list of numpy images, or bytes of image files."""
+        begin = time.perf_counter()
+        images = [self._blank() if isinstance(im, np.ndarray) and min(im.shape) == 0 else im
+                  for im in images]
+        todo = [i for i, im in enumerate(images) if self._needs_work(im)]
+        if len(todo) > 1:
+            results = list(_get_executor().map(self._process, [images[i] for i in todo]))
+        else:
+            results = [self._process(images[i]) for i in todo]
+
+        with self.lock:
+            for i, (image, seconds) in zip(todo, results):
+                images[i] = image
+                for stage, stage_seconds in seconds.items():
+                    self.seconds[stage] += stage_seconds
+            self.images += len(images)
+            self.batches += 1
+            self.seconds['total'] += time.perf_counter() - begin
+        return images
+
+    def _process(self, image):
+        """Resizes and converts a single image, returning it and the seconds of each stage."""
+        seconds = {}
+        if image.ndim == 3 and image.shape[2] == 1:
+            image = image[:, :, 0]
+        shape = self.output_shape(image.shape)
+        if shape == image.shape:
+            return image, seconds
+
+        pil_image = Image.fromarray(image)
+        mode = _mode_by_channels.get(1 if len(shape) == 2 else shape[2], pil_image.mode)
+        size = (shape[1], shape[0])
+        # the fewer channels, the less to resize
+        if len(mode) < len(pil_image.mode):
+            pil_image = _timed(seconds, 'convert', pil_image.convert, mode)
+        if pil_image.size != size:
+            pil_image = _timed(seconds, 'resize', pil_image.resize, size, Image.BICUBIC)
+        if pil_image.mode != mode:
+            pil_image = _timed(seconds, 'convert', pil_image.convert, mode)
+        return np.asarray(pil_image), seconds
+
+    def stats(self):
+        """Images and batches preprocessed, and the seconds spent on each stage:
+        resize, convert and the total time of the calls, including waiting for
+        the threads."""
+        with self.lock:
+            return {
+                'images': self.images,
+                'batches': self.batches,
+                'seconds': dict(self.seconds),
+            }
@@ -0,0 +1,224 @@
+import collections
+import contextlib
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+SAMPLE_MODE = 'sample'
+CPROFILE_MODE = 'cprofile'
+PROFILE_MODES = (SAMPLE_MODE, CPROFILE_MODE)
+
+MODELS_PATH = os.path.abspath('./models/')
+# Python frames where a sampled thread is only waiting for work
+_IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('connection.py', '_recv'),
+}
+
+
+def _is_model_code(filename: str):
+    return os.path.abspath(filename).startswith(MODELS_PATH)
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread of the process, while the
+    worker keeps serving its requests. It costs nothing to the other threads,
+    besides sharing the GIL with the sampling one.
+    """
+
+    def __init__(self, interval_s: float=0.005):
+        self.interval_s = interval_s
+        # collapsed stack -> number of samples
+        self.stacks = collections.Counter()
+        self.model_samples = 0
+        self.server_samples = 0
+        self.idle_samples = 0
+
+    def run(self, seconds: float):
+        thread_names = {}
+        deadline = time.monotonic() + seconds
+        own_thread = threading.get_ident()
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id != own_thread:
+                    if thread_id not in thread_names:
+                        thread_names = {x.ident: x.name for x in threading.enumerate()}
+                    self._sample(thread_names.get(thread_id, str(thread_id)), frame)
+            time.sleep(self.interval_s)
+
+    def _sample(self, thread_name: str, frame):
+        leaf = frame.f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+            self.idle_samples += 1
+            return
+        stack = []
+        in_model = False
+        while frame is not None:
+            stack.append(_frame_name(frame.f_code))
+            in_model = in_model or _is_model_code(frame.f_code.co_filename)
+            frame = frame.f_back
+        stack.append(thread_name)
+        self.stacks[';'.join(reversed(stack))] += 1
+        if in_model:
+            self.model_samples += 1
+        else:
+            self.server_samples += 1
+
+    def result(self):
+        return {
+            'mode': SAMPLE_MODE,
+            'interval_s': self.interval_s,
+            'stacks': dict(self.stacks),
+            'model_samples': self.model_samples,
+            'server_samples': self.server_samples,
+            'idle_samples': self.idle_samples,
+        }
+
+
+class RequestProfiler:
+    """Runs cProfile on the threads that handle requests while it is active,
+    merging the stats of all the requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+        self.active = False
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Profiles the code within this context, if active."""
+        if not self.active:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError: # another profiler already runs on this thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def run(self, seconds: float):
+        with self.lock:
+            self.stats = None
+        self.active = True
+        try:
+            time.sleep(seconds)
+        finally:
+            self.active = False
+
+    def result(self):
+        with self.lock:
+            stats = {} if self.stats is None else self.stats.stats
+            return {'mode': CPROFILE_MODE, 'pstats': marshal.dumps(stats)}
+
+
+def run_profile(seconds: float, mode: str=SAMPLE_MODE, memory: bool=False, top: int=20,
+                request_profiler: RequestProfiler=None):
+    """Profiles this process for some seconds, returning what a profiler found.
+    With memory, it also returns the lines that allocated the most memory in
+    the meantime, according to tracemalloc."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'Unknown profile mode {mode}, expected one of {PROFILE_MODES}')
+
+    started_tracing = False
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+    begin = tracemalloc.take_snapshot() if memory else None
+    try:
+        if mode == SAMPLE_MODE:
+            profiler = SamplingProfiler()
+        else:
+            profiler = request_profiler
+        profiler.run(seconds)
+        result = profiler.result()
+        if memory:
+            # without the memory used by tracemalloc itself
+            ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+            diff = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(
+                begin.filter_traces(ignore), 'lineno')
+            result['memory'] = [
+                {'where': f'{os.path.basename(x.traceback[0].filename)}:{x.traceback[0].lineno}',
+                 'size_diff_kb': x.size_diff/1024,
+                 'count_diff': x.count_diff}
+                for x in diff[:top]]
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    return {'pid': os.getpid(), **result}
+
+
+def _stats_from_bytes(data: bytes):
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(data)  # pylint: disable=attribute-defined-outside-init
+    stats.get_top_level_stats()
+    return stats
+
+
+def merge_profiles(results: list, top: int=20):
+    """Merges the profiles of one or many workers. Returns a JSON serializable
+    summary, with the functions that took the most time, and the whole profile:
+    the stacks in the collapsed format of flamegraph.pl, or a pstats dump."""
+    mode = results[0]['mode']
+    summary = {
+        'mode': mode,
+        'pids': [x['pid'] for x in results],
+        'memory': {x['pid']: x['memory'] for x in results if 'memory' in x},
+    }
+
+    if mode == SAMPLE_MODE:
+        stacks = collections.Counter()
+        for result in results:
+            stacks.update(result['stacks'])
+        interval_s = results[0]['interval_s']
+        cumulative = collections.Counter()
+        own = collections.Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')[1:] # without the thread name
+            for frame in set(frames):
+                cumulative[frame] += count
+            own[frames[-1]] += count
+        summary['model_s'] = sum(x['model_samples'] for x in results)*interval_s
+        summary['server_s'] = sum(x['server_samples'] for x in results)*interval_s
+        summary['idle_s'] = sum(x['idle_samples'] for x in results)*interval_s
+        summary['functions'] = [
+            {'function': frame, 'cumulative_s': count*interval_s, 'self_s': own[frame]*interval_s}
+            for frame, count in cumulative.most_common(top)]
+        payload = ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+        return summary, payload.encode()
+
+    stats = pstats.Stats()
+    for result in results:
+        stats.add(_stats_from_bytes(result['pstats']))
+    functions = []
+    model_s = 0.
+    for (filename, line, name), (_, _, own_s, cumulative_s, _) in stats.stats.items():
+        is_model = _is_model_code(filename)
+        if is_model:
+            model_s += own_s
+        functions.append({'function': f'{name} ({os.path.basename(filename)}:{line})',
+                          'cumulative_s': cumulative_s, 'self_s': own_s, 'model': is_model})
+    summary['model_s'] = model_s
+    summary['server_s'] = stats.total_tt - model_s
+    summary['functions'] = sorted(functions, key=lambda x: -x['cumulative_s'])[:top]
+    return summary, marshal.dumps(stats.stats)
@@ -1,119 +1,448 @@
+import argparse
+import collections
 import contextlib
+import gc
+import hashlib
+import http.server
 import logging
 import multiprocessing
-from multiprocessing import Pool, Lock
 import importlib
 import json
+import signal
 import socket
+import queue
 import sys
 import os
+import threading
+import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
 
 import grpc
+import numpy as np
 from grpc_health.v1.health import HealthServicer
 from grpc_health.v1 import health_pb2, health_pb2_grpc
 
+import shm
 import utils
+from admission import AdmissionController, PrioritySemaphore, Rejected
+from batching import BatchScheduler, Expired
+from cache import ResultCache, MISS
+from control import ControlChannel
+from load import LoadTracker, LOAD_METADATA_KEY
+from metrics import Metrics, merge_snapshots, to_prometheus
+from profiler import RequestProfiler, run_profile, merge_profiles
+from supervisor import Supervisor, SupervisorSettings, resident_memory_mb
 import server_pb2
 import server_pb2_grpc
 
 LOGGER = logging.getLogger(__name__)
 NUM_CPUS = multiprocessing.cpu_count()
-NUM_PARALLEL_WORKERS = NUM_CPUS//2
-PORT_NUMBER = 50000
+NUM_PARALLEL_WORKERS = int(os.environ.get('NUM_PARALLEL_WORKERS', max(1, NUM_CPUS//2)))
+# The workers are scaled between these numbers, as their requests queue up or
+# they become idle. Zero means NUM_PARALLEL_WORKERS
+MIN_WORKERS = int(os.environ.get('MIN_WORKERS', 0))
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 0))
+# A worker is replaced once it served this many requests, or its memory grows
+# over this many MB, so leaks don't build up. Zero disables them
+WORKER_MAX_REQUESTS = int(os.environ.get('WORKER_MAX_REQUESTS', 0))
+WORKER_MAX_RSS_MB = float(os.environ.get('WORKER_MAX_RSS_MB', 0))
+# Requests are rejected with RESOURCE_EXHAUSTED while a worker has this many
+# in flight, or a model has this many waiting for it. Zero is unbounded
+MAX_IN_FLIGHT_PER_WORKER = int(os.environ.get('MAX_IN_FLIGHT_PER_WORKER', 0))
+MAX_QUEUED_PER_MODEL = int(os.environ.get('MAX_QUEUED_PER_MODEL', 0))
+# How long a stopping worker waits for its requests in flight
+WORKER_DRAIN_TIMEOUT_S = 30
+# Number of gRPC threads of each worker process
+NUM_THREADS_PER_WORKER = int(os.environ.get('NUM_THREADS_PER_WORKER', 1))
+# Frames of a stream that may be decoded ahead of the model
+STREAM_DECODE_QUEUE_SIZE = 2
+# Loads the models once in the parent process, before forking the workers,
+# so they share the memory of the model weights
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
+# Number of workers of each model, as a JSON dict such as '{"detector": 4}'.
+# The models that aren't listed are loaded by every worker
+MODEL_PLACEMENT = json.loads(os.environ.get('MODEL_PLACEMENT', '{}'))
+# Loads each model on its first request instead of on startup
+LAZY_LOAD_MODELS = os.environ.get('LAZY_LOAD_MODELS', '0') == '1'
+# Lazily loaded models are unloaded, least recently used first, while the models
+# of a worker take more memory than this, and after being idle for this long.
+# Zero disables them.
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 0))
+MODEL_IDLE_TIMEOUT_S = float(os.environ.get('MODEL_IDLE_TIMEOUT_S', 0))
+# How long ReloadModel waits for every worker to load the new version, and
+# then for the requests running on the old version to finish
+RELOAD_TIMEOUT_S = 600
+RELOAD_DRAIN_TIMEOUT_S = 60
+# How long GetMetrics waits for the metrics of every worker
+METRICS_TIMEOUT_S = 5
+# How long GetTopology waits for the ready workers to tell their port and
+# models, well under the TOPOLOGY_TIMEOUT_S of the clients, so they get the
+# workers that answered instead of timing out
+TOPOLOGY_TIMEOUT_S = 0.5
+# Besides the shared port, each worker listens on its own port, so the clients
+# can open exactly one channel per worker. The worker of slot i gets this port
+# plus i, the same across restarts so it may be published. Zero means the
+# port after the shared one
+WORKER_BASE_PORT = int(os.environ.get('WORKER_BASE_PORT', 0))
+# Longest Profile allowed, and how much longer than that the workers may take to answer
+MAX_PROFILE_S = 300
+PROFILE_TIMEOUT_MARGIN_S = 30
+# Port of the HTTP endpoint with the metrics in Prometheus format, 0 disables it
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+PORT_NUMBER = int(os.environ.get('PORT_NUMBER', 50000))
 SERVICE = 'TinyModelServer'
+# Set before forking the workers, so the clients tell apart the servers they
+# reach on many addresses
+SERVER_ID = uuid.uuid4().hex
+# Told to the clients by GetTopology, so they only send what the server reads:
+# older servers ignore the fields they don't know, such as BatchImageArgs.tensor
+SERVER_FEATURES = ['batch_tensor']
 
 multiprocessing.set_start_method('fork')
-# Queue that informs when all the workers must shutdown
-shutdown_queue = multiprocessing.Queue()
+# Models loaded by preload_models, inherited by the forked workers
+_preloaded_models = {}
+# Created by main before forking the workers, which inherit them, so they're
+# module state rather than constants
+_control_channel = None  # pylint: disable=invalid-name
+_supervisor = None  # pylint: disable=invalid-name
 
 
 
 class ServerServicer(server_pb2_grpc.ServerServicer):
 
-    def __init__(self):
+    def __init__(self, models: list=None, control: ControlChannel=None):
+        """Serves the given models, or all of them. The control channel reaches
+        the other workers of the server, if any."""
         self.models = {}
-        for model in self._list_models():
-            self._init_model(model)
+        self.models_lock = threading.Lock()
+        # notified when a request stops using a model
+        self.models_released = threading.Condition(self.models_lock)
+        self.control = control
+        self.control_commands = {
+            'reload': self._reload_model,
+            'metrics': self.metrics_snapshot,
+            'profile': self._profile,
+            'load': self._worker_load,
+            'topology': self._worker_topology,
+            'cache_stats': self._cache_stats,
+        }
+        self.metrics = Metrics()
+        self.request_profiler = RequestProfiler()
+        # a single profile at a time
+        self.profile_lock = threading.Lock()
+        self.loading_locks = {}
+        self.model_stats = collections.defaultdict(
+            lambda: {'loads': 0, 'evictions': 0, 'load_ms': None, 'memory_mb': 0.})
+        self.load = LoadTracker()
+        self.admission = AdmissionController(
+            MAX_IN_FLIGHT_PER_WORKER, MAX_QUEUED_PER_MODEL, self._count_rejected)
+        # the thread pool of the gRPC server, its own port, and whether it
+        # takes requests, set by _run_server
+        self.executor = None
+        self.port = None
+        self.serving = False
+        self.available = self._list_models() if models is None else list(models)
+        for model in self.available:
+            # preloaded models are shared with the other workers, so they are
+            # always set up and never unloaded
+            if not LAZY_LOAD_MODELS or model in _preloaded_models:
+                self._init_model(model, _preloaded_models.get(model))
+        if LAZY_LOAD_MODELS and MODEL_IDLE_TIMEOUT_S > 0:
+            threading.Thread(target=self._evict_idle_models, daemon=True).start()
 
         LOGGER.info('Tiny Model Server started!')
 
-    def RunText(self, request, _context):  # pylint: disable=invalid-name
-        results = self._run_text_model(request)
+    def RunText(self, request, context):  # pylint: disable=invalid-name
+        with self._metered('RunText', request):
+            with self._admitted(request.model, context), self.load.track():
+                results = self._run_text_model(request)
 
-        return server_pb2.Response(
-                data=json.dumps(results))
+            return self._response(results, context, request.encoding)
+
+    def RunBatchText(self, request, context):  # pylint: disable=invalid-name
+        with self._metered('RunBatchText', request, len(request.texts)):
+            with self._admitted(request.model, context, len(request.texts)), self.load.track():
+                results = self._run_text_batch_model(request)
+
+            return self._response(results, context, request.encoding)
+
+    def RunImage(self, request, context):  # pylint: disable=invalid-name
+        with self._metered('RunImage', request):
+            with self._admitted(request.model, context), self.load.track():
+                try:
+                    results = self._run_image_model(request)
+                except Rejected:
+                    raise
+                except BaseException as e:
+                    results = {'error': str(e)}
+
+            return self._response(results, context, request.encoding)
+
+    def RunBatchImage(self, request, context):  # pylint: disable=invalid-name
+        batch_size = self._image_batch_size(request)
+        with self._metered('RunBatchImage', request, batch_size):
+            with self._admitted(request.model, context, batch_size), self.load.track():
+                try:
+                    results = self._run_image_batch_model(request)
+                except Rejected:
+                    raise
+                except BaseException as e:
+                    LOGGER.error(e, exc_info=True)
+                    results = {'error': str(e)}
+
+            return self._response(results, context, request.encoding)
+
+    def RunImageToImage(self, request, context):  # pylint: disable=invalid-name
+        with self._metered('RunImageToImage', request) as metrics:
+            with self._admitted(request.model, context), self.load.track():
+                try:
+                    results = self._run_image_model(request)
+                    image, metadata = self._split_image_result(results)
+                    with self.metrics.stage('encode'):
+                        response = server_pb2.ImageResponse(
+                                data=json.dumps(metadata),
+                                image=utils.numpy_to_proto(image))
+                except Rejected:
+                    raise
+                except BaseException as e:
+                    LOGGER.error(e, exc_info=True)
+                    metrics.error = True
+                    response = server_pb2.ImageResponse(
+                            data=json.dumps({'error': str(e)}))
+
+            self._report_load(context)
+            metrics.response_bytes = response.ByteSize()
+            return response
 
-    def RunBatchText(self, request, _context):  # pylint: disable=invalid-name
-        results = self._run_text_batch_model(request)
+    def RunBatchImageToImage(self, request, context):  # pylint: disable=invalid-name
+        batch_size = self._image_batch_size(request)
+        with self._metered('RunBatchImageToImage', request, batch_size) as metrics:
+            with self._admitted(request.model, context, batch_size), self.load.track():
+                try:
+                    results = self._run_image_batch_model(request)
+                    if isinstance(results, dict):
+                        raise RuntimeError(results.get('error', 'Invalid model results'))
+                    images, metadata = zip(*[self._split_image_result(x) for x in results])
+                    with self.metrics.stage('encode'):
+                        response = server_pb2.BatchImageResponse(
+                                data=json.dumps(metadata),
+                                images=utils.numpy_list_to_proto(images))
+                except Rejected:
+                    raise
+                except BaseException as e:
+                    LOGGER.error(e, exc_info=True)
+                    metrics.error = True
+                    response = server_pb2.BatchImageResponse(
+                            data=json.dumps({'error': str(e)}))
 
+            self._report_load(context)
+            metrics.response_bytes = response.ByteSize()
+            return response
+
+    def CheckSharedMemory(self, request, _context):  # pylint: disable=invalid-name
+        """Used by the clients to check that they share memory with the server,
+        reading a random token they've written to a segment."""
+        segment = json.loads(request.data)
+        ok = shm.check_segment(segment['name'], bytes.fromhex(segment['token']))
         return server_pb2.Response(
-                data=json.dumps(results))
+                data=json.dumps({'ok': ok}))
+
+    def RunImageStream(self, request_iterator, context):  # pylint: disable=invalid-name
+        """Runs a stream of frames, answering each one with its sequence id. The
+        frames are read and decoded on another thread, while the model runs on
+        the previous ones."""
+        frames = queue.Queue(maxsize=STREAM_DECODE_QUEUE_SIZE)
+        # set once the responses stop, so the reader doesn't wait for room forever
+        stopped = threading.Event()
+
+        def put(frame):
+            while not stopped.is_set():
+                try:
+                    frames.put(frame, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
 
-    def RunImage(self, request, _context):  # pylint: disable=invalid-name
+        def read_frames():
+            try:
+                for request in request_iterator:
+                    begin = time.perf_counter()
+                    image = self._decode_frame(request)
+                    if not put((request, image, time.perf_counter()-begin)):
+                        return
+            except BaseException as e:  # pylint: disable=broad-except
+                if context.is_active():
+                    LOGGER.error(e, exc_info=True)
+            finally:
+                put(None)
+
+        threading.Thread(target=read_frames, daemon=True).start()
         try:
-            results = self._run_image_model(request)
-            return server_pb2.Response(
-                    data=json.dumps(results)
-                )
-        except BaseException as e:
-            return server_pb2.Response(
-                    data=json.dumps({'error': str(e)})
-                )
+            yield from self._stream_responses(frames, context)
+        finally:
+            stopped.set()
+
+    def _stream_responses(self, frames, context):
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            request, image, decode_seconds = frame
+            if not context.is_active(): # no one is waiting for the rest of the frames
+                break
+            with self._metered('RunImageStream', request):
+                self.metrics.add_stage('decode', decode_seconds)
+                with self.load.track():
+                    try:
+                        if isinstance(image, BaseException):
+                            raise image
+                        args = {} if len(request.args)==0 else json.loads(request.args)
+                        with self._loaded(request.model) as entry:
+                            if entry is None:
+                                raise ValueError('Unitialized model')
+                            results = self._run_single(entry, image, args)
+                    except BaseException as e:
+                        results = {'error': str(e)}
+
+                response = self._encode_results(results, request.encoding)
+            yield server_pb2.StreamResponse(
+                    sequence_id=request.sequence_id,
+                    response=response)
 
-    def RunBatchImage(self, request, _context):  # pylint: disable=invalid-name
+    def Profile(self, request, _context):  # pylint: disable=invalid-name
+        """Profiles this worker, or all of them, for some seconds while they keep
+        serving requests. Takes a JSON dict with the 'seconds', the 'mode'
+        ('sample' or 'cprofile'), 'memory' to also trace the allocations,
+        'top' and 'all_workers'. Returns a summary on data, and the whole
+        profile on payload: collapsed stacks or a pstats dump."""
+        options = {} if len(request.data)==0 else json.loads(request.data)
+        all_workers = options.pop('all_workers', False)
+        top = options.get('top', 20)
         try:
-            results = self._run_image_batch_model(request)
-            return server_pb2.Response(
-                    data=json.dumps(results)
-                )
+            seconds = float(options.get('seconds', 10))
+            if not 0 < seconds <= MAX_PROFILE_S:
+                raise ValueError(f'Profile seconds must be within 0 and {MAX_PROFILE_S}')
+            if all_workers and self.control is not None:
+                results = self.control.broadcast(
+                    'profile', options, seconds+PROFILE_TIMEOUT_MARGIN_S)
+                results = [x for x in results if x is not None]
+            else:
+                results = [self._profile(**options)]
+            errors = [x['error'] for x in results if 'error' in x]
+            if len(errors) > 0:
+                raise RuntimeError(errors[0])
+            summary, payload = merge_profiles(results, top)
         except BaseException as e:
             LOGGER.error(e, exc_info=True)
-            return server_pb2.Response(
-                    data=json.dumps({'error': str(e)})
-                )
+            return server_pb2.Response(data=json.dumps({'error': str(e)}))
+
+        return server_pb2.Response(
+                data=json.dumps(summary),
+                payload=payload)
+
+    def GetMetrics(self, request, _context):  # pylint: disable=invalid-name
+        """Metrics of all the workers, as JSON, or in the Prometheus text format
+        when called with 'prometheus'."""
+        snapshot = gather_metrics(self.control, self.metrics_snapshot)
+        if request.data == 'prometheus':
+            return server_pb2.Response(data=to_prometheus(snapshot))
+        return server_pb2.Response(
+                data=json.dumps(snapshot))
+
+    def GetStats(self, _request, _context):  # pylint: disable=invalid-name
+        """Stats of the models of this worker, with the caches of all the workers."""
+        stats = self._stats()
+        stats['cache'] = gather_cache_stats(self.control, self._cache_stats)
+        return server_pb2.Response(
+                data=json.dumps(stats))
+
+    def GetLoad(self, _request, _context):  # pylint: disable=invalid-name
+        return server_pb2.Response(
+                data=json.dumps(self._load_snapshot()))
 
     def ListModels(self, _request, _context):  # pylint: disable=invalid-name
         return server_pb2.Response(
                 data=json.dumps(self._list_models()))
 
-    def ReloadModel(self, request, context):  # pylint: disable=invalid-name,unused-argument
-        model = request.data
-        ok = self._init_model(model)
+    def ReloadModel(self, request, _context):  # pylint: disable=invalid-name
+        """Reloads the model on every worker. Each one keeps serving the current
+        version until the new one is loaded, and reports how it went."""
+        model = request.data.lower()
+        if self.control is None:
+            workers = [self._reload_model(model)]
+        else:
+            workers = self.control.broadcast('reload', {'model': model}, RELOAD_TIMEOUT_S)
+            workers = [x or {'status': 'timeout'} for x in workers]
+        ok = all(x.get('status') in ('reloaded', 'not_loaded', 'not_served') for x in workers)
         return server_pb2.Response(
-                data=json.dumps({'ok': ok}))
+                data=json.dumps({
+                    'ok': ok,
+                    'version': _model_version(model),
+                    'workers': workers,
+                }))
 
     def GetInputShape(self, request, _context):  # pylint: disable=invalid-name
         model = request.data
-        if model not in self._list_models():
-            response = {'error': 'Unitialized model'}
-            return server_pb2.Response(
-                data=json.dumps(response))
+        with self._loaded(model) as entry:
+            if entry is None:
+                response = {'error': 'Unitialized model'}
+                return server_pb2.Response(
+                    data=json.dumps(response))
 
-        try:
-            response = self.models[model]['object'].get_input_shape()
-        except BaseException as e:
-            LOGGER.error('Exception: %s', e, exc_info=True)
-            response = {'error': str(e)}
+            try:
+                response = entry['object'].get_input_shape()
+            except BaseException as e:
+                LOGGER.error('Exception: %s', e, exc_info=True)
+                response = {'error': str(e)}
 
         return server_pb2.Response(
                 data=json.dumps(response))
 
     def GetPID(self, _request, _context):  # pylint: disable=invalid-name
+        # the models loaded by this worker, so the clients only send it those
+        return server_pb2.Response(
+                data=json.dumps(
+                    {'pid': os.getpid(), 'models': sorted(self.available)}
+                ))
+
+    def GetNumParallelWorkers(self, request, _context):  # pylint: disable=invalid-name
+        if _supervisor is None:
+            num_slots, always_on = NUM_PARALLEL_WORKERS, NUM_PARALLEL_WORKERS
+            slots = range(NUM_PARALLEL_WORKERS)
+        else:
+            num_slots, always_on = _supervisor.max_workers, _supervisor.min_workers
+            slots = _supervisor.active_slots()
+        placement = model_placement(self._list_models(), num_slots, MODEL_PLACEMENT, always_on)
+        model_workers = sum(request.data in placement[i] for i in slots)
         return server_pb2.Response(
                 data=json.dumps(
-                    {'pid': os.getpid()}
+                    {'num_workers': len(slots),
+                     'model_workers': model_workers}
                 ))
 
-    def GetNumParallelWorkers(self, _request, _context):  # pylint: disable=invalid-name
+    def GetTopology(self, _request, _context):  # pylint: disable=invalid-name
+        """Every worker of the server, with its own port, models and whether
+        it's ready, so the clients connect to each one directly."""
+        if self.control is None:
+            workers = [self._worker_topology()]
+        else:
+            # the workers still loading their models can't answer yet
+            workers = self.control.broadcast('topology', {}, TOPOLOGY_TIMEOUT_S, ready_only=True)
+            workers = [x for x in workers if x is not None and 'error' not in x]
+        num_workers = len(workers) if _supervisor is None else len(_supervisor.active_slots())
         return server_pb2.Response(
                 data=json.dumps(
-                    {'num_workers': NUM_PARALLEL_WORKERS}
+                    {'server_id': SERVER_ID,
+                     'features': SERVER_FEATURES,
+                     'num_workers': num_workers,
+                     'workers': workers}
                 ))
 
     def StopServer(self, _request, _context):
-        for _ in range(NUM_PARALLEL_WORKERS):
-            shutdown_queue.put(1)
+        if self.control is not None:
+            self.control.request_stop()
         LOGGER.info('Shuting down server...')
         return server_pb2.Response(
                 data=json.dumps(
@@ -121,105 +450,713 @@ class ServerServicer(server_pb2_grpc.ServerServicer):
                 ))
 
     def _run_image_model(self, request):
-        image = utils.proto_to_numpy(request.image)
-        model = request.model
-        if model not in self.models:
-            return image, {'error': 'Unitialized model'}
+        with self._loaded(request.model) as entry:
+            if entry is None:
+                return {'error': 'Unitialized model'}
 
-        args = {} if len(request.args)==0 else json.loads(request.args)
-        # Make sure we don't run the same model at the same time
-        # on different threads
-        with self.models[model]['lock']:
-            results = self.models[model]['object'].run(image, args)
-
-        return results
+            args = {} if len(request.args)==0 else json.loads(request.args)
+            return self._run_cached(
+                entry, args, self._image_cache_inputs(request.image),
+                lambda: self._run_single(
+                    entry, self._decode_images(entry, [request.image])[0], args))
 
     def _run_image_batch_model(self, request):
-        images = utils.proto_to_numpy_list(request.images)
-        model = request.model
-        if model not in self.models:
-            return images, {'error': 'Unitialized model'}
-
-        args = {} if len(request.args)==0 else json.loads(request.args)
-        # Make sure we don't run the same model at the same time
-        # on different threads
-        with self.models[model]['lock']:
-            results = self.models[model]['object'].run_batch(images, args)
-        return results
+        with self._loaded(request.model) as entry:
+            if entry is None:
+                return {'error': 'Unitialized model'}
 
-    def _run_text_model(self, request):
-        model = request.model
-        if model not in self.models:
-            return request.text, {'error': 'Unitialized model'}
+            args = {} if len(request.args)==0 else json.loads(request.args)
+            if request.HasField('tensor'):
+                # a view of the request buffer, either an array or a list of them
+                with self.metrics.stage('decode'):
+                    images = utils.batch_proto_to_numpy(request.tensor)
+                return self._run_batch(entry, images, args, lambda x: x, lambda x: (x,))
+            return self._run_batch(entry, request.images, args,
+                                   lambda x: self._decode_images(entry, x),
+                                   self._image_cache_inputs)
 
-        args = {} if len(request.args)==0 else json.loads(request.args)
-        # Make sure we don't run the same model at the same time
-        # on different threads
-        with self.models[model]['lock']:
-            results = self.models[model]['object'].run(request.text, args)
+    @staticmethod
+    def _image_batch_size(request):
+        if request.HasField('tensor'):
+            return utils.batch_proto_len(request.tensor)
+        return len(request.images)
 
-        return results
+    def _decode_images(self, entry, images):
+        """Decodes the images into numpy, unless they are image files and the
+        model wants to decode them by itself."""
+        with self.metrics.stage('decode'):
+            if entry['object'].decodes_images():
+                return [im.data if im.encoding in utils.IMAGE_FILE_ENCODINGS
+                        else utils.proto_to_numpy(im) for im in images]
+            return utils.proto_to_numpy_list(images)
+
+    def _decode_frame(self, request):
+        """Decodes a stream frame, returning the exception instead of raising it."""
+        try:
+            with self._loaded(request.model) as entry:
+                if entry is None:
+                    raise ValueError('Unitialized model')
+                return self._decode_images(entry, [request.image])[0]
+        except BaseException as e:  # pylint: disable=broad-except
+            return e
+
+    def _run_text_model(self, request):
+        with self._loaded(request.model) as entry:
+            if entry is None:
+                return {'error': 'Unitialized model'}
+
+            args = {} if len(request.args)==0 else json.loads(request.args)
+            return self._run_cached(
+                entry, args, (request.text,),
+                lambda: self._run_single(entry, request.text, args))
 
     def _run_text_batch_model(self, request):
-        model = request.model
-        if model not in self.models:
-            return request.texts, {'error': 'Unitialized model'}
-
-        args = {} if len(request.args)==0 else json.loads(request.args)
-        # Make sure we don't run the same model at the same time
-        # on different threads
-        with self.models[model]['lock']:
-            results = self.models[model]['object'].run_batch(request.texts, args)
+        with self._loaded(request.model) as entry:
+            if entry is None:
+                return {'error': 'Unitialized model'}
+
+            args = {} if len(request.args)==0 else json.loads(request.args)
+            return self._run_batch(entry, request.texts, args,
+                                   lambda x: x,
+                                   lambda x: (x,))
+
+    def _response(self, results, context, encoding):
+        self._report_load(context)
+        return self._encode_results(results, encoding)
+
+    def _encode_results(self, results, encoding):
+        with self.metrics.stage('encode'):
+            response = utils.encode_results(results, encoding)
+        metrics = self.metrics.current()
+        if metrics is not None:
+            metrics.error = metrics.error or (isinstance(results, dict) and 'error' in results)
+            metrics.response_bytes = response.ByteSize()
+        return response
+
+    @contextlib.contextmanager
+    def _metered(self, rpc, request, batch_size=None):
+        """Measures the request within this context."""
+        # unknown models are counted together, so they don't add labels
+        model = request.model if request.model in self.available else 'unknown'
+        with self.metrics.request(rpc, model) as metrics, self.request_profiler.profile():
+            metrics.request_bytes = request.ByteSize()
+            metrics.batch_size = batch_size
+            yield metrics
+
+    def metrics_snapshot(self):
+        return self.metrics.snapshot()
+
+    def _profile(self, seconds: float=10, mode: str='sample', memory: bool=False, top: int=20):
+        if not self.profile_lock.acquire(blocking=False):
+            return {'pid': os.getpid(), 'error': 'Already profiling this worker'}
+        try:
+            return run_profile(float(seconds), mode, memory, top, self.request_profiler)
+        finally:
+            self.profile_lock.release()
+
+    def _report_load(self, context):
+        # Every worker reports its load along with the results, so the
+        # clients may send their next requests to the less loaded ones
+        context.set_trailing_metadata(
+            ((LOAD_METADATA_KEY, json.dumps(self._load_snapshot())),))
+
+    def _split_image_result(self, results):
+        """Image to image models return either an image, or an image and its
+        JSON serializable metadata."""
+        if isinstance(results, dict) and 'error' in results:
+            raise RuntimeError(results['error'])
+        if isinstance(results, (tuple, list)) and len(results) == 2:
+            image, metadata = results
+        else:
+            image, metadata = results, None
+        if not isinstance(image, np.ndarray):
+            raise TypeError(f'Expected a numpy image as result, got {type(image)}')
+        return image, metadata
+
+    def _stats(self):
+        with self.models_lock:
+            models = dict(self.models)
+            loading = {k: {**v, 'loaded': k in models} for k,v in self.model_stats.items()}
+        return {
+            'pid': os.getpid(),
+            'models': loading,
+        }
+
+    def _cache_stats(self):
+        with self.models_lock:
+            models = dict(self.models)
+        return {k: m['cache'].stats() for k,m in models.items() if m['cache'] is not None}
+
+    def _worker_load(self):
+        """Load of this worker, for the supervisor to scale and recycle the workers."""
+        threads = NUM_THREADS_PER_WORKER
+        if self.executor is not None:
+            threads = self.executor._max_workers  # pylint: disable=protected-access
+        return {**self._load_snapshot(), 'requests': self.load.requests,
+                'waiting': self._waiting_for_thread(), 'threads': threads}
+
+    def _waiting_for_thread(self):
+        """Requests that gRPC accepted, but that wait for a free thread."""
+        if self.executor is None:
+            return 0
+        return self.executor._work_queue.qsize()  # pylint: disable=protected-access
+
+    def _worker_topology(self):
+        return {'pid': os.getpid(), 'port': self.port, 'models': sorted(self.available),
+                'ready': self.serving and self.port is not None}
+
+    def _load_snapshot(self):
+        with self.models_lock:
+            models = dict(self.models)
+        # requests waiting to be merged by dynamic batching
+        batching = {k: m['scheduler'].queue.qsize() for k,m in models.items()
+                    if m['scheduler'] is not None}
+        return self.load.snapshot(batching)
+
+    @contextlib.contextmanager
+    def _loaded(self, model):
+        """Yields the current version of the model, keeping it loaded within
+        this context, and loading it first when LAZY_LOAD_MODELS is set. Yields
+        None if this worker doesn't serve it."""
+        entry = self._acquire_model(model)
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                with self.models_lock:
+                    entry['in_use'] -= 1
+                    entry['last_used'] = time.monotonic()
+                    self.models_released.notify_all()
+
+    def _acquire_model(self, model):
+        with self.models_lock:
+            entry = self.models.get(model)
+            if entry is not None:
+                entry['in_use'] += 1
+                return entry
+            if not LAZY_LOAD_MODELS or model not in self.available:
+                return None
+
+        # other requests for the same model wait for the first one to load it
+        with self._loading_lock(model):
+            with self.models_lock:
+                entry = self.models.get(model)
+                if entry is not None:
+                    entry['in_use'] += 1
+                    return entry
+            # makes room for the model, as big as it was the last time it was loaded
+            self._evict_models(self.model_stats[model]['memory_mb'])
+            if not self._init_model(model):
+                return None
+            with self.models_lock:
+                entry = self.models[model]
+                entry['in_use'] += 1
+        self._evict_models()
+        return entry
+
+    def _evict_models(self, reserved_mb: float=0.):
+        """Unloads the least recently used models that aren't running, while the
+        models take more memory than MODEL_MEMORY_BUDGET_MB, and the ones idle
+        for longer than MODEL_IDLE_TIMEOUT_S."""
+        if not LAZY_LOAD_MODELS:
+            return
+        evicted = []
+        with self.models_lock:
+            now = time.monotonic()
+            memory_mb = reserved_mb + sum(m['memory_mb'] for m in self.models.values())
+            idle = sorted(
+                [(k, m) for k,m in self.models.items() if m['in_use'] == 0 and not m['pinned']
+                 and not (k in self.loading_locks and self.loading_locks[k].locked())],
+                key=lambda x: x[1]['last_used'])
+            for model, entry in idle:
+                over_budget = 0 < MODEL_MEMORY_BUDGET_MB < memory_mb
+                expired = 0 < MODEL_IDLE_TIMEOUT_S < now-entry['last_used']
+                if not (over_budget or expired):
+                    continue
+                del self.models[model]
+                memory_mb -= entry['memory_mb']
+                self.model_stats[model]['evictions'] += 1
+                evicted.append((model, entry))
+
+        if len(evicted) == 0:
+            return
+        for model, entry in evicted:
+            self._close_model(entry)
+            LOGGER.info('Unloaded model %s', model)
+        # frees the models that have reference cycles
+        evicted = entry = None
+        gc.collect()
+
+    def _loading_lock(self, model):
+        """Lock held while loading or reloading the model."""
+        with self.models_lock:
+            return self.loading_locks.setdefault(model, threading.Lock())
+
+    def _close_model(self, entry):
+        if entry['scheduler'] is not None:
+            entry['scheduler'].close()
+
+    @contextlib.contextmanager
+    def _admitted(self, model, context, batch_size=None):
+        """Admits the request within this context, see AdmissionController. A
+        rejected request is aborted with its status, reporting the worker load
+        so the clients send their next requests elsewhere."""
+        with self.models_lock:
+            entry = self.models.get(model)
+        queued = self.load.queued.get(model, 0)
+        concurrency = 1
+        if entry is not None:
+            concurrency = entry['max_concurrency']
+            if entry['scheduler'] is not None:
+                queued += entry['scheduler'].queue.qsize()
+                concurrency *= entry['scheduler'].max_batch_size
+        # the requests waiting for a thread are in flight too
+        in_flight = self.load.in_flight + self._waiting_for_thread()
+        try:
+            with self.admission.request(context, model, in_flight, queued, concurrency,
+                                        batch_size=batch_size):
+                yield
+        except Rejected as e:
+            self._report_load(context)
+            context.abort(e.code, e.details)
+
+    def _count_rejected(self, model, code):
+        metrics = self.metrics.current()
+        self.metrics.inc('tms_rejected_total', {
+            'model': model if model in self.available else 'unknown',
+            'rpc': '' if metrics is None else metrics.rpc,
+            'code': code.name})
+
+    def _run_control_command(self, command: str, args: dict):
+        """Runs a command sent by another worker through the control channel."""
+        return self.control_commands[command](**args)
+
+    def _reload_model(self, model: str):
+        """Loads a new version of the model while the current one keeps serving,
+        swaps them, and frees the old one once its requests have finished."""
+        status = {'pid': os.getpid()}
+        if model not in self.available:
+            return {**status, 'status': 'not_served'}
+
+        with self._loading_lock(model):
+            if LAZY_LOAD_MODELS and model not in self.models:
+                # the new version is imported on its next request
+                return {**status, 'status': 'not_loaded', 'version': _model_version(model)}
+            entry = self._create_model(model)
+            if entry is None:
+                with self.models_lock:
+                    old = self.models.get(model)
+                return {**status, 'status': 'failed',
+                        'version': None if old is None else old['version']}
+            with self.models_lock:
+                old = self.models.get(model)
+                self.models[model] = entry
+
+        drained = True
+        if old is not None:
+            with self.models_released:
+                drained = self.models_released.wait_for(
+                    lambda: old['in_use'] == 0, timeout=RELOAD_DRAIN_TIMEOUT_S)
+            self._close_model(old)
+            old = None
+            gc.collect()
+        LOGGER.info('Reloaded model %s, version %s', model, entry['version'])
+        return {**status, 'status': 'reloaded', 'version': entry['version'], 'drained': drained}
+
+    def _evict_idle_models(self):
+        while True:
+            time.sleep(min(MODEL_IDLE_TIMEOUT_S, 60))
+            self._evict_models()
+
+    @contextlib.contextmanager
+    def _model_slot(self, entry, batch_size=None):
+        """Waits for the model to be available for this thread, ahead of the
+        requests with a lower priority, and until the request deadline. The
+        batch_size of run_batch calls, None for run."""
+        # Limits how many threads may run the same model at the same time
+        semaphore = entry['semaphore']
+        request = self.admission.current()
+        with self.load.waiting(entry['name']), self.metrics.stage('wait'):
+            if request is None:
+                semaphore.acquire()
+            elif not semaphore.acquire(timeout=request.remaining(), priority=request.priority):
+                request.reject(grpc.StatusCode.DEADLINE_EXCEEDED,
+                               f'Deadline exceeded waiting for {entry["name"]}')
+        try:
+            if request is not None:
+                # the client may have given up while this request waited
+                request.check(self.admission.estimate(entry['name'], batch_size=batch_size))
+            with self.metrics.stage('run'):
+                begin = time.perf_counter()
+                yield entry['object']
+                self.admission.observe(entry['name'], time.perf_counter()-begin, batch_size)
+        finally:
+            semaphore.release()
+
+    def _run_single(self, entry, data, args):
+        scheduler = entry['scheduler']
+        if scheduler is not None:
+            timing = {}
+            request = self.admission.current()
+            try:
+                return scheduler.run(data, args, timing,
+                                     None if request is None else request.deadline)
+            except Expired:
+                request.reject(grpc.StatusCode.DEADLINE_EXCEEDED,
+                               f'Deadline exceeded waiting for {entry["name"]}')
+            finally:
+                for stage, seconds in timing.items():
+                    self.metrics.add_stage(stage, seconds)
+                if 'run' in timing:
+                    self.admission.observe(entry['name'], timing['run'])
+
+        with self._model_slot(entry) as obj:
+            return obj.run(data, args)
+
+    def _image_cache_inputs(self, image):
+        """What identifies an image on the results cache, without decoding it."""
+        if image.shm_name: # zero copy view of the pixels
+            return (utils.proto_to_numpy(image),)
+        return (f'{image.height}x{image.width}x{image.channels}{list(image.shape)}'
+                f'{image.dtype}{image.encoding}', image.data)
+
+    def _run_cached(self, entry, args, inputs, compute):
+        """Returns the cached results of the model for those inputs, or computes them."""
+        cache = entry['cache']
+        if cache is None:
+            return compute()
+        key = cache.key(entry['name'], args, *inputs)
+        # the requests waiting for a rejected one run the model themselves
+        return cache.get_or_compute(key, compute, retry_on=(Rejected,))
+
+    def _run_batch(self, entry, inputs, args, decode, cache_inputs):
+        """Runs a batch on the model, only for the inputs that aren't cached."""
+        cache = entry['cache']
+        if cache is None:
+            data = decode(inputs)
+            with self._model_slot(entry, len(inputs)) as obj:
+                return obj.run_batch(data, args)
+
+        keys = [cache.key(entry['name'], args, *cache_inputs(x)) for x in inputs]
+        results = [cache.get(key) for key in keys]
+        missing = [i for i, x in enumerate(results) if x is MISS]
+        if len(missing) > 0:
+            if len(missing) == len(inputs):
+                # keeps the batch as it is when nothing was cached
+                data = decode(inputs)
+            elif isinstance(inputs, np.ndarray):
+                # the misses of a batch tensor are still a single array
+                data = decode(inputs[missing])
+            else:
+                data = decode([inputs[i] for i in missing])
+            with self._model_slot(entry, len(missing)) as obj:
+                computed = obj.run_batch(data, args)
+            if not isinstance(computed, list) or len(computed) != len(missing):
+                # nothing is cached when the results don't match the inputs
+                if not (isinstance(computed, dict) and 'error' in computed):
+                    computed = {'error': f'Model {entry["name"]} returned '
+                                         f'{type(computed).__name__} results '
+                                         f'for a batch of {len(missing)}'}
+                return [computed]*len(inputs)
+            for i, result in zip(missing, computed):
+                results[i] = result
+                cache.put(keys[i], result)
         return results
 
+    def has_batching(self):
+        with self.models_lock:
+            return any(m['scheduler'] is not None for m in self.models.values())
+
+    def max_concurrency(self):
+        """Number of threads needed to keep every model busy at the same time,
+        including the callers waiting to be merged by dynamic batching.
+        """
+        total = 0
+        with self.models_lock:
+            models = list(self.models.values())
+        for m in models:
+            if m['scheduler'] is not None:
+                total += m['scheduler'].max_batch_size*m['max_concurrency']
+            else:
+                total += m['max_concurrency']
+        return total
+
     def _list_models(self):
         return os.listdir('./models/')
 
-    def _init_model(self, model):
+    def _init_model(self, model, obj=None):
+        """Loads the model, or uses the given object already loaded by
+        preload_models, and sets up how its requests are run."""
         model = model.lower()
-        if model not in self._list_models():
+        entry = self._create_model(model, obj)
+        if entry is None:
             return False
-        # TODO: check this import path
-        # model_path = 'tiny_model_server.models.'+model
-        model_path = f'models.{model}'
-        model_import = __import__(model_path, globals(), locals(), ['object'])
-        importlib.reload(model_import)
+        with self.models_lock:
+            self.models[model] = entry
+        return True
+
+    def _create_model(self, model, obj=None):
+        """Returns the entry of self.models of a new instance of the model,
+        or None if it couldn't be loaded."""
+        if model not in self._list_models():
+            return None
+        pinned = obj is not None
+        version = _model_version(model)
+        begin = time.perf_counter()
+        memory_mb = resident_memory_mb()
+        if obj is None:
+            obj = _load_model(model)
+        if obj is None:
+            return None
+        stats = self.model_stats[model]
+        stats['loads'] += 1
+        stats['load_ms'] = (time.perf_counter()-begin)*1000
+        stats['memory_mb'] = max(0., resident_memory_mb()-memory_mb)
+        LOGGER.info('Loaded model %s in %.0fms', model, stats['load_ms'])
+        # A semaphore instead of a mutex, so models that are thread-safe
+        # may serve many requests at once
+        max_concurrency = max(1, obj.get_max_concurrency())
+        semaphore = PrioritySemaphore(max_concurrency)
+        scheduler = None
+        batch_config = obj.get_batch_config()
+        if batch_config is not None:
+            scheduler = BatchScheduler(
+                obj, semaphore,
+                max_batch_size=batch_config.get('max_batch_size', 8),
+                max_wait_ms=batch_config.get('max_wait_ms', 5),
+                num_threads=max_concurrency,
+                on_batch=lambda size: self.metrics.observe(
+                    'tms_batch_size', {'model': model, 'rpc': 'dynamic_batching'}, size))
+        cache = None
+        cache_config = obj.get_cache_config()
+        if cache_config is not None:
+            cache = ResultCache(**cache_config)
+        return {
+                'name': model,
+                'version': version,
+                'object': obj,
+                'cache': cache,
+                'semaphore': semaphore,
+                'max_concurrency': max_concurrency,
+                'scheduler': scheduler,
+                # requests using the model, that may only be unloaded when idle
+                'in_use': 0,
+                'last_used': time.monotonic(),
+                'memory_mb': stats['memory_mb'],
+                'pinned': pinned,
+            }
+
+def gather_metrics(control: ControlChannel, local_snapshot):
+    """Merges the metrics of every worker reached by the control channel, or
+    only the local ones when there is no channel."""
+    if control is None:
+        return merge_snapshots([local_snapshot()])
+    snapshots = control.broadcast('metrics', {}, METRICS_TIMEOUT_S)
+    return merge_snapshots([x for x in snapshots if x is not None and 'error' not in x])
+
+
+def gather_cache_stats(control: ControlChannel, local_stats):
+    """Sums the cache stats of every worker reached by the control channel,
+    by model, or returns only the local ones when there is no channel."""
+    if control is None:
+        return local_stats()
+    merged = {}
+    for workers in control.broadcast('cache_stats', {}, METRICS_TIMEOUT_S):
+        if workers is None or 'error' in workers:
+            continue
+        for model, stats in workers.items():
+            total = merged.setdefault(model, dict.fromkeys(stats, 0))
+            for key, value in stats.items():
+                total[key] += value
+    return merged
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the metrics of all the workers on /metrics, for Prometheus."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = to_prometheus(gather_metrics(_control_channel, None)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):  # pylint: disable=arguments-differ
+        pass
+
+
+def _serve_metrics(port):
+    server = http.server.ThreadingHTTPServer(('', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    LOGGER.info('Serving metrics on port %d', port)
+
+
+def _model_version(model):
+    """Identifies the files of the model by their names, sizes and modification
+    times, which is the same for every worker and cheap even for big weights."""
+    digest = hashlib.blake2b(digest_size=6)
+    folder = os.path.join('./models/', model)
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(x for x in dirs if x != '__pycache__')
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(
+                f'{os.path.relpath(path, folder)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+def _import_model(model):
+    # TODO: check this import path
+    # model_path = 'tiny_model_server.models.'+model
+    model_path = f'models.{model}'
+    model_import = __import__(model_path, globals(), locals(), ['object'])
+    importlib.reload(model_import)
+    return model_import
 
+
+def _load_model(model):
+    """Imports and creates the model, returning None if it fails."""
+    try:
+        return _import_model(model).Model()
+    except BaseException as e:
+        LOGGER.error(str(e), exc_info=True)
+        return None
+
+
+def model_placement(models: list, num_workers: int, placement: dict, always_on: int=None):
+    """Returns the list of models each worker loads. A model in placement goes
+    to that many workers, the ones with fewer models so far, and the others go
+    to every worker. The first always_on workers are never scaled down, so
+    every placed model has one of them."""
+    always_on = num_workers if always_on is None else max(1, min(always_on, num_workers))
+    workers = [[] for _ in range(num_workers)]
+    for model in placement:
+        if model not in models or placement[model] < 1:
+            continue
+        first = min(range(always_on), key=lambda i: len(workers[i]))
+        others = sorted((i for i in range(num_workers) if i != first),
+                        key=lambda i: len(workers[i]))
+        for i in sorted([first] + others[:placement[model]-1]):
+            workers[i].append(model)
+    for model in models:
+        if model not in placement:
+            for worker in workers:
+                worker.append(model)
+    return workers
+
+
+def preload_models(models: list=None):
+    """Loads the fork-safe models in this process, so the workers forked
+    afterwards share their weights copy-on-write instead of loading them again."""
+    for model in (os.listdir('./models/') if models is None else models):
+        model = model.lower()
         try:
-            obj = model_import.Model()
+            model_class = _import_model(model).Model
         except BaseException as e:
             LOGGER.error(str(e), exc_info=True)
-            return False
-        self.models[model] = {
-                'object': obj,
-                'lock': Lock(),
-            }
-        return True
+            continue
+        if not model_class.is_fork_safe():
+            LOGGER.info('Model %s is not fork-safe, each worker will load it.', model)
+            continue
+        obj = _load_model(model)
+        if obj is not None:
+            _preloaded_models[model] = obj
+    return _preloaded_models
 
-def _run_server(bind_address):
-    """Starts a server in a subprocess."""
-    LOGGER.info('Starting new server.')
-    options = (('grpc.so_reuseport', 1),
-               ('grpc.max_receive_message_length', int(1e9)))
 
+def _run_server(bind_address, models, worker_port):
+    """Runs a server in a worker process, loading the given models, until it
+    gets a SIGTERM or the supervisor exits. Then it stops taking requests and
+    waits for the ones in flight. The worker also listens on worker_port,
+    shared with the worker replacing it while it drains, or on a random port
+    if it's 0."""
+    LOGGER.info('Starting new server.')
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
     health = HealthServicer()
     health.set(SERVICE, health_pb2.HealthCheckResponse.NOT_SERVING)
 
+    servicer = ServerServicer(models, _control_channel)
+    _control_channel.listen(servicer._run_control_command, on_close=stopping.set)  # pylint: disable=protected-access
+    server = _create_server(servicer, health, bind_address)
+    try:
+        servicer.port = server.add_insecure_port(f'[::]:{worker_port}')
+    except RuntimeError:
+        # the clients reach this worker on the shared port instead
+        LOGGER.warning('Port %d is taken, the worker listens on a random one.', worker_port)
+        servicer.port = server.add_insecure_port('[::]:0')
+    server.start()
+
+    health.set(SERVICE, health_pb2.HealthCheckResponse.SERVING)
+    servicer.serving = True
+    _control_channel.ready_to_serve()
+    stopping.wait()
+    LOGGER.info('Stopping server, waiting for the requests in flight.')
+    servicer.serving = False
+    health.set(SERVICE, health_pb2.HealthCheckResponse.NOT_SERVING)
+    server.stop(WORKER_DRAIN_TIMEOUT_S).wait()
+
+
+def _create_server(servicer, health, bind_address):
+    """gRPC server of a worker, with its thread pool on servicer.executor."""
+    options = (('grpc.so_reuseport', 1),
+               ('grpc.max_receive_message_length', int(1e9)))
+    # Dynamic batching only merges requests that are waiting at the same time,
+    # so we may need more threads than configured to fill up the batches
+    num_threads = NUM_THREADS_PER_WORKER
+    if servicer.has_batching():
+        num_threads = max(num_threads, servicer.max_concurrency())
+    # Likewise, the requests admitted wait for their model on a thread, where
+    # admission control counts them and runs the interactive ones first
+    if MAX_IN_FLIGHT_PER_WORKER > 0:
+        num_threads = max(num_threads, MAX_IN_FLIGHT_PER_WORKER)
+    # Plus one, so the worker keeps serving while Profile blocks a thread
+    servicer.executor = ThreadPoolExecutor(max_workers=num_threads+1,)
     server = grpc.server(
-        ThreadPoolExecutor(max_workers=1,),
+        servicer.executor,
         options=options)
-    server_pb2_grpc.add_ServerServicer_to_server(ServerServicer(), server)
+    server_pb2_grpc.add_ServerServicer_to_server(servicer, server)
     health_pb2_grpc.add_HealthServicer_to_server(health, server)
     server.add_insecure_port(bind_address)
-    server.start()
+    return server
 
-    health.set(SERVICE, health_pb2.HealthCheckResponse.SERVING)
-    shutdown_queue.get()
+
+def _port_is_free(port_number):
+    """Whether nothing listens on the port. Binding with SO_REUSEPORT, as the
+    workers do, would succeed on a port taken by another server instead."""
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    # the connections of a previous server waiting to close don't count
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind(('', port_number))
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+def _worker_ports(first_port, num_slots):
+    """The port of each worker slot, or 0 for a random one if it's taken."""
+    ports = list(range(first_port, first_port+num_slots))
+    for i, port in enumerate(ports):
+        if not _port_is_free(port):
+            LOGGER.warning('Port %d is taken, worker %d listens on a random one.', port, i)
+            ports[i] = 0
+    return ports
 
 
 @contextlib.contextmanager
 def _reserve_port(port_number):
     """Find and reserve a port for all subprocesses to use."""
+    if port_number != 0 and not _port_is_free(port_number):
+        raise RuntimeError(f'Port {port_number} is taken.')
     sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     if sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT) == 0:
@@ -231,18 +1168,62 @@ def _reserve_port(port_number):
         sock.close()
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the Tiny Model Server.')
+    parser.add_argument('--port', type=int, default=PORT_NUMBER,
+                        help='defaults to $PORT_NUMBER, or 50000')
+    parser.add_argument('--worker-port', type=int, default=WORKER_BASE_PORT,
+                        help='port of the first worker, the others follow it, '
+                             'defaults to $WORKER_BASE_PORT, or --port plus one')
+    parser.add_argument('--workers', type=int, default=NUM_PARALLEL_WORKERS,
+                        help='workers on startup, defaults to $NUM_PARALLEL_WORKERS, '
+                             'or half of the CPUs')
+    parser.add_argument('--min-workers', type=int, default=MIN_WORKERS,
+                        help='defaults to $MIN_WORKERS, or the workers on startup')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS,
+                        help='defaults to $MAX_WORKERS, or the workers on startup')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global _control_channel, _supervisor, NUM_PARALLEL_WORKERS, PORT_NUMBER  # pylint: disable=global-statement
+    args = parse_args(argv)
+    NUM_PARALLEL_WORKERS, PORT_NUMBER = args.workers, args.port
+    max_workers = args.max_workers or max(NUM_PARALLEL_WORKERS, args.min_workers)
+    min_workers = args.min_workers or min(NUM_PARALLEL_WORKERS, max_workers)
+    _control_channel = ControlChannel()
     with _reserve_port(PORT_NUMBER) as port:
         bind_address = f'[::]:{port}'
+        worker_ports = _worker_ports(args.worker_port or port+1, max_workers)
         LOGGER.info('Binding to %s', bind_address)
+        # one list of models per slot, so a restarted worker loads the same ones
+        placement = model_placement(os.listdir('./models/'), max_workers, MODEL_PLACEMENT,
+                                    min_workers)
+        if PRELOAD_MODELS:
+            preload_models(sorted(set().union(*placement)))
+            # Moves the loaded objects out of the garbage collector, otherwise
+            # its passes would write to their pages and copy them on every worker
+            gc.collect()
+            gc.freeze()
+        _supervisor = Supervisor(
+            lambda slot: _run_server(bind_address, placement[slot], worker_ports[slot]),
+            _control_channel,
+            NUM_PARALLEL_WORKERS,
+            SupervisorSettings(min_workers, max_workers, max_requests=WORKER_MAX_REQUESTS,
+                               max_rss_mb=WORKER_MAX_RSS_MB,
+                               stop_timeout_s=WORKER_DRAIN_TIMEOUT_S+5))
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: _supervisor.stop())
         sys.stdout.flush()
-        with Pool(processes=NUM_PARALLEL_WORKERS) as pool:
-            pool.starmap(_run_server, [(bind_address,) for _ in range(NUM_PARALLEL_WORKERS)])
+        if METRICS_PORT > 0:
+            _serve_metrics(METRICS_PORT)
+        _supervisor.run()
 
 if __name__ == '__main__':
     handler = logging.StreamHandler(sys.stdout)
     formatter = logging.Formatter('[PID %(process)d] %(message)s')
     handler.setFormatter(formatter)
-    LOGGER.addHandler(handler)
-    LOGGER.setLevel(logging.INFO)
+    for logger in (LOGGER, logging.getLogger('supervisor')):
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
     main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: server.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'server.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0cserver.proto\x12\x06server\"\x0b\n\tEmptyArgs\"G\n\x08TextArgs\x12\x0c\n\x04text\x18\x01 \x01(\t\x12\r\n\x05model\x18\x02 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x03 \x01(\t\x12\x10\n\x08\x65ncoding\x18\x04 \x01(\t\"]\n\tImageArgs\x12!\n\x05image\x18\x01 \x01(\x0b\x32\x12.server.NumpyImage\x12\r\n\x05model\x18\x02 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x03 \x01(\t\x12\x10\n\x08\x65ncoding\x18\x04 \x01(\t\"M\n\rBatchTextArgs\x12\r\n\x05texts\x18\x01 \x03(\t\x12\r\n\x05model\x18\x02 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x03 \x01(\t\x12\x10\n\x08\x65ncoding\x18\x04 \x01(\t\"\x88\x01\n\x0e\x42\x61tchImageArgs\x12\"\n\x06images\x18\x01 \x03(\x0b\x32\x12.server.NumpyImage\x12\r\n\x05model\x18\x02 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x03 \x01(\t\x12\x10\n\x08\x65ncoding\x18\x04 \x01(\t\x12#\n\x06tensor\x18\x05 \x01(\x0b\x32\x13.server.BatchTensor\"x\n\x0fStreamImageArgs\x12\x13\n\x0bsequence_id\x18\x01 \x01(\x03\x12!\n\x05image\x18\x02 \x01(\x0b\x32\x12.server.NumpyImage\x12\r\n\x05model\x18\x03 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x04 \x01(\t\x12\x10\n\x08\x65ncoding\x18\x05 \x01(\t\"\xa1\x01\n\nNumpyImage\x12\x0e\n\x06height\x18\x01 \x01(\x05\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x03 \x01(\x05\x12\x0c\n\x04\x64\x61ta\x18\x04 \x01(\x0c\x12\r\n\x05\x64type\x18\x05 \x01(\t\x12\x10\n\x08shm_name\x18\x06 \x01(\t\x12\x12\n\nshm_offset\x18\x07 \x01(\x03\x12\x10\n\x08\x65ncoding\x18\x08 \x01(\t\x12\r\n\x05shape\x18\t \x03(\x03\"\x83\x01\n\x0b\x42\x61tchTensor\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x12\r\n\x05\x64type\x18\x02 \x01(\t\x12\r\n\x05shape\x18\x03 \x03(\x03\x12\"\n\x0bitem_shapes\x18\x04 \x03(\x0b\x32\r.server.Shape\x12\x10\n\x08shm_name\x18\x05 \x01(\t\x12\x12\n\nshm_offset\x18\x06 \x01(\x03\"\x19\n\tStringArg\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\t\";\n\x08Response\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\t\x12\x0f\n\x07payload\x18\x02 \x01(\x0c\x12\x10\n\x08\x65ncoding\x18\x03 \x01(\t\"I\n\x0eStreamResponse\x12\x13\n\x0bsequence_id\x18\x01 \x01(\x03\x12\"\n\x08response\x18\x02 \x01(\x0b\x32\x10.server.Response\"@\n\rImageResponse\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\t\x12!\n\x05image\x18\x02 \x01(\x0b\x32\x12.server.NumpyImage\"F\n\x12\x42\x61tchImageResponse\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\t\x12\"\n\x06images\x18\x02 \x03(\x0b\x32\x12.server.NumpyImage\"F\n\x05Shape\x12\x0e\n\x06height\x18\x01 \x01(\x05\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x10\n\x08\x63hannels\x18\x03 \x01(\x05\x12\x0c\n\x04\x64ims\x18\x04 \x03(\x03\x32\xc1\x08\n\x06Server\x12/\n\x07RunText\x12\x10.server.TextArgs\x1a\x10.server.Response\"\x00\x12\x31\n\x08RunImage\x12\x11.server.ImageArgs\x1a\x10.server.Response\"\x00\x12\x39\n\x0cRunBatchText\x12\x15.server.BatchTextArgs\x1a\x10.server.Response\"\x00\x12;\n\rRunBatchImage\x12\x16.server.BatchImageArgs\x1a\x10.server.Response\"\x00\x12=\n\x0fRunImageToImage\x12\x11.server.ImageArgs\x1a\x15.server.ImageResponse\"\x00\x12L\n\x14RunBatchImageToImage\x12\x16.server.BatchImageArgs\x1a\x1a.server.BatchImageResponse\"\x00\x12G\n\x0eRunImageStream\x12\x17.server.StreamImageArgs\x1a\x16.server.StreamResponse\"\x00(\x01\x30\x01\x12\x33\n\nListModels\x12\x11.server.EmptyArgs\x1a\x10.server.Response\"\x00\x12\x36\n\rGetInputShape\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12/\n\x06GetPID\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12>\n\x15GetNumParallelWorkers\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12\x34\n\x0bGetTopology\x12\x11.server.EmptyArgs\x1a\x10.server.Response\"\x00\x12\x34\n\x0bReloadModel\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12\x33\n\nStopServer\x12\x11.server.EmptyArgs\x1a\x10.server.Response\"\x00\x12\x30\n\x07GetLoad\x12\x11.server.EmptyArgs\x1a\x10.server.Response\"\x00\x12\x31\n\x08GetStats\x12\x11.server.EmptyArgs\x1a\x10.server.Response\"\x00\x12\x33\n\nGetMetrics\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12\x30\n\x07Profile\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x12:\n\x11\x43heckSharedMemory\x12\x11.server.StringArg\x1a\x10.server.Response\"\x00\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'server_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_EMPTYARGS']._serialized_start=24
+  _globals['_EMPTYARGS']._serialized_end=35
+  _globals['_TEXTARGS']._serialized_start=37
+  _globals['_TEXTARGS']._serialized_end=108
+  _globals['_IMAGEARGS']._serialized_start=110
+  _globals['_IMAGEARGS']._serialized_end=203
+  _globals['_BATCHTEXTARGS']._serialized_start=205
+  _globals['_BATCHTEXTARGS']._serialized_end=282
+  _globals['_BATCHIMAGEARGS']._serialized_start=285
+  _globals['_BATCHIMAGEARGS']._serialized_end=421
+  _globals['_STREAMIMAGEARGS']._serialized_start=423
+  _globals['_STREAMIMAGEARGS']._serialized_end=543
+  _globals['_NUMPYIMAGE']._serialized_start=546
+  _globals['_NUMPYIMAGE']._serialized_end=707
+  _globals['_BATCHTENSOR']._serialized_start=710
+  _globals['_BATCHTENSOR']._serialized_end=841
+  _globals['_STRINGARG']._serialized_start=843
+  _globals['_STRINGARG']._serialized_end=868
+  _globals['_RESPONSE']._serialized_start=870
+  _globals['_RESPONSE']._serialized_end=929
+  _globals['_STREAMRESPONSE']._serialized_start=931
+  _globals['_STREAMRESPONSE']._serialized_end=1004
+  _globals['_IMAGERESPONSE']._serialized_start=1006
+  _globals['_IMAGERESPONSE']._serialized_end=1070
+  _globals['_BATCHIMAGERESPONSE']._serialized_start=1072
+  _globals['_BATCHIMAGERESPONSE']._serialized_end=1142
+  _globals['_SHAPE']._serialized_start=1144
+  _globals['_SHAPE']._serialized_end=1214
+  _globals['_SERVER']._serialized_start=1217
+  _globals['_SERVER']._serialized_end=2306
+# @@protoc_insertion_point(module_scope)
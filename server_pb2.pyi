@@ -10,58 +10,106 @@ class EmptyArgs(_message.Message):
     def __init__(self) -> None: ...
 
 class TextArgs(_message.Message):
-    __slots__ = ("text", "model", "args")
+    __slots__ = ("text", "model", "args", "encoding")
     TEXT_FIELD_NUMBER: _ClassVar[int]
     MODEL_FIELD_NUMBER: _ClassVar[int]
     ARGS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
     text: str
     model: str
     args: str
-    def __init__(self, text: _Optional[str] = ..., model: _Optional[str] = ..., args: _Optional[str] = ...) -> None: ...
+    encoding: str
+    def __init__(self, text: _Optional[str] = ..., model: _Optional[str] = ..., args: _Optional[str] = ..., encoding: _Optional[str] = ...) -> None: ...
 
 class ImageArgs(_message.Message):
-    __slots__ = ("image", "model", "args")
+    __slots__ = ("image", "model", "args", "encoding")
     IMAGE_FIELD_NUMBER: _ClassVar[int]
     MODEL_FIELD_NUMBER: _ClassVar[int]
     ARGS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
     image: NumpyImage
     model: str
     args: str
-    def __init__(self, image: _Optional[_Union[NumpyImage, _Mapping]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ...) -> None: ...
+    encoding: str
+    def __init__(self, image: _Optional[_Union[NumpyImage, _Mapping]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ..., encoding: _Optional[str] = ...) -> None: ...
 
 class BatchTextArgs(_message.Message):
-    __slots__ = ("texts", "model", "args")
+    __slots__ = ("texts", "model", "args", "encoding")
     TEXTS_FIELD_NUMBER: _ClassVar[int]
     MODEL_FIELD_NUMBER: _ClassVar[int]
     ARGS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
     texts: _containers.RepeatedScalarFieldContainer[str]
     model: str
     args: str
-    def __init__(self, texts: _Optional[_Iterable[str]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ...) -> None: ...
+    encoding: str
+    def __init__(self, texts: _Optional[_Iterable[str]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ..., encoding: _Optional[str] = ...) -> None: ...
 
 class BatchImageArgs(_message.Message):
-    __slots__ = ("images", "model", "args")
+    __slots__ = ("images", "model", "args", "encoding", "tensor")
     IMAGES_FIELD_NUMBER: _ClassVar[int]
     MODEL_FIELD_NUMBER: _ClassVar[int]
     ARGS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
+    TENSOR_FIELD_NUMBER: _ClassVar[int]
     images: _containers.RepeatedCompositeFieldContainer[NumpyImage]
     model: str
     args: str
-    def __init__(self, images: _Optional[_Iterable[_Union[NumpyImage, _Mapping]]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ...) -> None: ...
+    encoding: str
+    tensor: BatchTensor
+    def __init__(self, images: _Optional[_Iterable[_Union[NumpyImage, _Mapping]]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ..., encoding: _Optional[str] = ..., tensor: _Optional[_Union[BatchTensor, _Mapping]] = ...) -> None: ...
+
+class StreamImageArgs(_message.Message):
+    __slots__ = ("sequence_id", "image", "model", "args", "encoding")
+    SEQUENCE_ID_FIELD_NUMBER: _ClassVar[int]
+    IMAGE_FIELD_NUMBER: _ClassVar[int]
+    MODEL_FIELD_NUMBER: _ClassVar[int]
+    ARGS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
+    sequence_id: int
+    image: NumpyImage
+    model: str
+    args: str
+    encoding: str
+    def __init__(self, sequence_id: _Optional[int] = ..., image: _Optional[_Union[NumpyImage, _Mapping]] = ..., model: _Optional[str] = ..., args: _Optional[str] = ..., encoding: _Optional[str] = ...) -> None: ...
 
 class NumpyImage(_message.Message):
-    __slots__ = ("height", "width", "channels", "data", "dtype")
+    __slots__ = ("height", "width", "channels", "data", "dtype", "shm_name", "shm_offset", "encoding", "shape")
     HEIGHT_FIELD_NUMBER: _ClassVar[int]
     WIDTH_FIELD_NUMBER: _ClassVar[int]
     CHANNELS_FIELD_NUMBER: _ClassVar[int]
     DATA_FIELD_NUMBER: _ClassVar[int]
     DTYPE_FIELD_NUMBER: _ClassVar[int]
+    SHM_NAME_FIELD_NUMBER: _ClassVar[int]
+    SHM_OFFSET_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
+    SHAPE_FIELD_NUMBER: _ClassVar[int]
     height: int
     width: int
     channels: int
     data: bytes
     dtype: str
-    def __init__(self, height: _Optional[int] = ..., width: _Optional[int] = ..., channels: _Optional[int] = ..., data: _Optional[bytes] = ..., dtype: _Optional[str] = ...) -> None: ...
+    shm_name: str
+    shm_offset: int
+    encoding: str
+    shape: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, height: _Optional[int] = ..., width: _Optional[int] = ..., channels: _Optional[int] = ..., data: _Optional[bytes] = ..., dtype: _Optional[str] = ..., shm_name: _Optional[str] = ..., shm_offset: _Optional[int] = ..., encoding: _Optional[str] = ..., shape: _Optional[_Iterable[int]] = ...) -> None: ...
+
+class BatchTensor(_message.Message):
+    __slots__ = ("data", "dtype", "shape", "item_shapes", "shm_name", "shm_offset")
+    DATA_FIELD_NUMBER: _ClassVar[int]
+    DTYPE_FIELD_NUMBER: _ClassVar[int]
+    SHAPE_FIELD_NUMBER: _ClassVar[int]
+    ITEM_SHAPES_FIELD_NUMBER: _ClassVar[int]
+    SHM_NAME_FIELD_NUMBER: _ClassVar[int]
+    SHM_OFFSET_FIELD_NUMBER: _ClassVar[int]
+    data: bytes
+    dtype: str
+    shape: _containers.RepeatedScalarFieldContainer[int]
+    item_shapes: _containers.RepeatedCompositeFieldContainer[Shape]
+    shm_name: str
+    shm_offset: int
+    def __init__(self, data: _Optional[bytes] = ..., dtype: _Optional[str] = ..., shape: _Optional[_Iterable[int]] = ..., item_shapes: _Optional[_Iterable[_Union[Shape, _Mapping]]] = ..., shm_name: _Optional[str] = ..., shm_offset: _Optional[int] = ...) -> None: ...
 
 class StringArg(_message.Message):
     __slots__ = ("data",)
@@ -70,10 +118,22 @@ class StringArg(_message.Message):
     def __init__(self, data: _Optional[str] = ...) -> None: ...
 
 class Response(_message.Message):
-    __slots__ = ("data",)
+    __slots__ = ("data", "payload", "encoding")
     DATA_FIELD_NUMBER: _ClassVar[int]
+    PAYLOAD_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
     data: str
-    def __init__(self, data: _Optional[str] = ...) -> None: ...
+    payload: bytes
+    encoding: str
+    def __init__(self, data: _Optional[str] = ..., payload: _Optional[bytes] = ..., encoding: _Optional[str] = ...) -> None: ...
+
+class StreamResponse(_message.Message):
+    __slots__ = ("sequence_id", "response")
+    SEQUENCE_ID_FIELD_NUMBER: _ClassVar[int]
+    RESPONSE_FIELD_NUMBER: _ClassVar[int]
+    sequence_id: int
+    response: Response
+    def __init__(self, sequence_id: _Optional[int] = ..., response: _Optional[_Union[Response, _Mapping]] = ...) -> None: ...
 
 class ImageResponse(_message.Message):
     __slots__ = ("data", "image")
@@ -83,12 +143,22 @@ class ImageResponse(_message.Message):
     image: NumpyImage
     def __init__(self, data: _Optional[str] = ..., image: _Optional[_Union[NumpyImage, _Mapping]] = ...) -> None: ...
 
+class BatchImageResponse(_message.Message):
+    __slots__ = ("data", "images")
+    DATA_FIELD_NUMBER: _ClassVar[int]
+    IMAGES_FIELD_NUMBER: _ClassVar[int]
+    data: str
+    images: _containers.RepeatedCompositeFieldContainer[NumpyImage]
+    def __init__(self, data: _Optional[str] = ..., images: _Optional[_Iterable[_Union[NumpyImage, _Mapping]]] = ...) -> None: ...
+
 class Shape(_message.Message):
-    __slots__ = ("height", "width", "channels")
+    __slots__ = ("height", "width", "channels", "dims")
     HEIGHT_FIELD_NUMBER: _ClassVar[int]
     WIDTH_FIELD_NUMBER: _ClassVar[int]
     CHANNELS_FIELD_NUMBER: _ClassVar[int]
+    DIMS_FIELD_NUMBER: _ClassVar[int]
     height: int
     width: int
     channels: int
-    def __init__(self, height: _Optional[int] = ..., width: _Optional[int] = ..., channels: _Optional[int] = ...) -> None: ...
+    dims: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, height: _Optional[int] = ..., width: _Optional[int] = ..., channels: _Optional[int] = ..., dims: _Optional[_Iterable[int]] = ...) -> None: ...
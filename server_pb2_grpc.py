@@ -0,0 +1,874 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+import warnings
+
+import server_pb2 as server__pb2
+
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in server_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class ServerStub:
+    """Interface exported by the server.
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.RunText = channel.unary_unary(
+                '/server.Server/RunText',
+                request_serializer=server__pb2.TextArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.RunImage = channel.unary_unary(
+                '/server.Server/RunImage',
+                request_serializer=server__pb2.ImageArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.RunBatchText = channel.unary_unary(
+                '/server.Server/RunBatchText',
+                request_serializer=server__pb2.BatchTextArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.RunBatchImage = channel.unary_unary(
+                '/server.Server/RunBatchImage',
+                request_serializer=server__pb2.BatchImageArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.RunImageToImage = channel.unary_unary(
+                '/server.Server/RunImageToImage',
+                request_serializer=server__pb2.ImageArgs.SerializeToString,
+                response_deserializer=server__pb2.ImageResponse.FromString,
+                _registered_method=True)
+        self.RunBatchImageToImage = channel.unary_unary(
+                '/server.Server/RunBatchImageToImage',
+                request_serializer=server__pb2.BatchImageArgs.SerializeToString,
+                response_deserializer=server__pb2.BatchImageResponse.FromString,
+                _registered_method=True)
+        self.RunImageStream = channel.stream_stream(
+                '/server.Server/RunImageStream',
+                request_serializer=server__pb2.StreamImageArgs.SerializeToString,
+                response_deserializer=server__pb2.StreamResponse.FromString,
+                _registered_method=True)
+        self.ListModels = channel.unary_unary(
+                '/server.Server/ListModels',
+                request_serializer=server__pb2.EmptyArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetInputShape = channel.unary_unary(
+                '/server.Server/GetInputShape',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetPID = channel.unary_unary(
+                '/server.Server/GetPID',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetNumParallelWorkers = channel.unary_unary(
+                '/server.Server/GetNumParallelWorkers',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetTopology = channel.unary_unary(
+                '/server.Server/GetTopology',
+                request_serializer=server__pb2.EmptyArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.ReloadModel = channel.unary_unary(
+                '/server.Server/ReloadModel',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.StopServer = channel.unary_unary(
+                '/server.Server/StopServer',
+                request_serializer=server__pb2.EmptyArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetLoad = channel.unary_unary(
+                '/server.Server/GetLoad',
+                request_serializer=server__pb2.EmptyArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetStats = channel.unary_unary(
+                '/server.Server/GetStats',
+                request_serializer=server__pb2.EmptyArgs.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.GetMetrics = channel.unary_unary(
+                '/server.Server/GetMetrics',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.Profile = channel.unary_unary(
+                '/server.Server/Profile',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+        self.CheckSharedMemory = channel.unary_unary(
+                '/server.Server/CheckSharedMemory',
+                request_serializer=server__pb2.StringArg.SerializeToString,
+                response_deserializer=server__pb2.Response.FromString,
+                _registered_method=True)
+
+
+class ServerServicer:
+    """Interface exported by the server.
+    """
+
+    def RunText(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunImage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunBatchText(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunBatchImage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunImageToImage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunBatchImageToImage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def RunImageStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListModels(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetInputShape(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetPID(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetNumParallelWorkers(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetTopology(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReloadModel(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StopServer(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetLoad(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetStats(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetMetrics(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Profile(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CheckSharedMemory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ServerServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'RunText': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunText,
+                    request_deserializer=server__pb2.TextArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'RunImage': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunImage,
+                    request_deserializer=server__pb2.ImageArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'RunBatchText': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunBatchText,
+                    request_deserializer=server__pb2.BatchTextArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'RunBatchImage': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunBatchImage,
+                    request_deserializer=server__pb2.BatchImageArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'RunImageToImage': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunImageToImage,
+                    request_deserializer=server__pb2.ImageArgs.FromString,
+                    response_serializer=server__pb2.ImageResponse.SerializeToString,
+            ),
+            'RunBatchImageToImage': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunBatchImageToImage,
+                    request_deserializer=server__pb2.BatchImageArgs.FromString,
+                    response_serializer=server__pb2.BatchImageResponse.SerializeToString,
+            ),
+            'RunImageStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.RunImageStream,
+                    request_deserializer=server__pb2.StreamImageArgs.FromString,
+                    response_serializer=server__pb2.StreamResponse.SerializeToString,
+            ),
+            'ListModels': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListModels,
+                    request_deserializer=server__pb2.EmptyArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetInputShape': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetInputShape,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetPID': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetPID,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetNumParallelWorkers': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetNumParallelWorkers,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetTopology': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetTopology,
+                    request_deserializer=server__pb2.EmptyArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'ReloadModel': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReloadModel,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'StopServer': grpc.unary_unary_rpc_method_handler(
+                    servicer.StopServer,
+                    request_deserializer=server__pb2.EmptyArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetLoad': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetLoad,
+                    request_deserializer=server__pb2.EmptyArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetStats': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetStats,
+                    request_deserializer=server__pb2.EmptyArgs.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'GetMetrics': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetMetrics,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'Profile': grpc.unary_unary_rpc_method_handler(
+                    servicer.Profile,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+            'CheckSharedMemory': grpc.unary_unary_rpc_method_handler(
+                    servicer.CheckSharedMemory,
+                    request_deserializer=server__pb2.StringArg.FromString,
+                    response_serializer=server__pb2.Response.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'server.Server', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('server.Server', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class Server:
+    """Interface exported by the server.
+    """
+
+    @staticmethod
+    def RunText(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunText',
+            server__pb2.TextArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunImage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunImage',
+            server__pb2.ImageArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunBatchText(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunBatchText',
+            server__pb2.BatchTextArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunBatchImage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunBatchImage',
+            server__pb2.BatchImageArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunImageToImage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunImageToImage',
+            server__pb2.ImageArgs.SerializeToString,
+            server__pb2.ImageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunBatchImageToImage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/RunBatchImageToImage',
+            server__pb2.BatchImageArgs.SerializeToString,
+            server__pb2.BatchImageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def RunImageStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/server.Server/RunImageStream',
+            server__pb2.StreamImageArgs.SerializeToString,
+            server__pb2.StreamResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ListModels(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/ListModels',
+            server__pb2.EmptyArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetInputShape(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetInputShape',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetPID(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetPID',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetNumParallelWorkers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetNumParallelWorkers',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetTopology(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetTopology',
+            server__pb2.EmptyArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReloadModel(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/ReloadModel',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def StopServer(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/StopServer',
+            server__pb2.EmptyArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetLoad(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetLoad',
+            server__pb2.EmptyArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetStats(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetStats',
+            server__pb2.EmptyArgs.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetMetrics(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/GetMetrics',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Profile(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/Profile',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CheckSharedMemory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/server.Server/CheckSharedMemory',
+            server__pb2.StringArg.SerializeToString,
+            server__pb2.Response.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,165 @@
+import collections
+import contextlib
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import server_pb2
+
+# Offsets of the images within a segment are aligned to this many bytes
+ALIGNMENT = 64
+# Smallest segment created by the pool, so small images can share segments
+MIN_SEGMENT_SIZE = 1 << 20
+# Number of segments a server worker keeps mapped
+MAX_ATTACHED_SEGMENTS = 64
+
+_attached_lock = threading.Lock()
+_attached_segments = collections.OrderedDict()
+
+
+def _aligned(size: int):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def attach(name: str):
+    """Maps an existing segment created by another process, without tracking it.
+    Otherwise the resource tracker would unlink it when this process exits."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: # python < 3.13 always tracks it
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, 'shared_memory')  # pylint: disable=protected-access
+        return segment
+
+
+def _get_attached(name: str):
+    """Returns the segment with the given name, mapping it only once per process."""
+    with _attached_lock:
+        if name in _attached_segments:
+            _attached_segments.move_to_end(name)
+            return _attached_segments[name]
+
+        segment = attach(name)
+        _attached_segments[name] = segment
+        while len(_attached_segments) > MAX_ATTACHED_SEGMENTS:
+            _, old = _attached_segments.popitem(last=False)
+            try:
+                old.close()
+            except BufferError: # still used by an image, unmapped when it is released
+                pass
+        return segment
+
+
+def shared_memory_to_numpy(image, shape: tuple, dtype):
+    """Zero copy numpy view of an image written to shared memory by a client."""
+    segment = _get_attached(image.shm_name)
+    np_image = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=image.shm_offset)
+    # same as the images decoded from bytes, the client memory must not be changed
+    np_image.flags.writeable = False
+    return np_image
+
+
+def check_segment(name: str, token: bytes):
+    """Checks that a segment created by a client can be read from this process."""
+    try:
+        segment = attach(name)
+    except (FileNotFoundError, ValueError, OSError):
+        return False
+    try:
+        return bytes(segment.buf[:len(token)]) == token
+    finally:
+        segment.close()
+
+
+class SharedMemoryPool:
+    """Reusable shared memory segments where a client writes its images, so
+    that a server worker on the same host can map them instead of receiving
+    their bytes through gRPC.
+    """
+
+    def __init__(self, max_idle_segments: int=16):
+        self.max_idle_segments = max_idle_segments
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def _acquire(self, size: int):
+        with self.lock:
+            fits = [x for x in self.idle if x.size >= size]
+            if len(fits) > 0:
+                segment = min(fits, key=lambda x: x.size)
+                self.idle.remove(segment)
+                return segment
+        # rounds up to a power of two so the segments are easier to reuse
+        size = max(MIN_SEGMENT_SIZE, 1 << (size-1).bit_length())
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def _release(self, segment):
+        with self.lock:
+            self.idle.append(segment)
+            if len(self.idle) <= self.max_idle_segments:
+                return
+            segment = min(self.idle, key=lambda x: x.size)
+            self.idle.remove(segment)
+        segment.close()
+        segment.unlink()
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Segments acquired within this context are given back to the pool at its end,
+        after the server has answered the requests that use them."""
+        lease = SharedMemoryLease(self)
+        try:
+            yield lease
+        finally:
+            for segment in lease.segments:
+                self._release(segment)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for segment in idle:
+            segment.close()
+            segment.unlink()
+
+
+class SharedMemoryLease:
+    """Writes images into segments of a SharedMemoryPool, see SharedMemoryPool.lease."""
+
+    def __init__(self, pool: SharedMemoryPool):
+        self.pool = pool
+        self.segments = []
+
+    def numpy_list_to_proto(self, images: list, fields: list):
+        """Writes all images into a single segment, returning their NumpyImage protos
+        with the given dtype and shape fields of each one."""
+        segment = self.pool._acquire(sum(_aligned(im.nbytes) for im in images))  # pylint: disable=protected-access
+        self.segments.append(segment)
+
+        protos = []
+        offset = 0
+        for im, im_fields in zip(images, fields):
+            view = np.ndarray(im.shape, dtype=im.dtype, buffer=segment.buf, offset=offset)
+            np.copyto(view, im)
+            protos.append(server_pb2.NumpyImage(
+                shm_name=segment.name,
+                shm_offset=offset,
+                **im_fields))
+            del view
+            offset += _aligned(im.nbytes)
+        return protos
+
+    def numpy_batch_to_proto(self, images: list, tensor):
+        """Writes all images back to back into a single segment, setting it on the
+        given BatchTensor."""
+        segment = self.pool._acquire(sum(im.nbytes for im in images))  # pylint: disable=protected-access
+        self.segments.append(segment)
+
+        offset = 0
+        for im in images:
+            view = np.ndarray(im.shape, dtype=im.dtype, buffer=segment.buf, offset=offset)
+            np.copyto(view, im)
+            del view
+            offset += im.nbytes
+        tensor.shm_name = segment.name
+        tensor.shm_offset = 0
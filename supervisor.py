@@ -0,0 +1,242 @@
+import collections
+import logging
+import multiprocessing
+from multiprocessing import connection
+import os
+import signal
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def resident_memory_mb(pid='self'):
+    """Memory used by a process, or 0 where /proc isn't available."""
+    try:
+        with open(f'/proc/{pid}/statm', encoding='ascii') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0.
+    return pages*os.sysconf('SC_PAGE_SIZE')/(1024*1024)
+
+
+# How a Supervisor scales and replaces its workers, see Supervisor. None min
+# and max workers are the workers it starts with
+SupervisorSettings = collections.namedtuple(
+    'SupervisorSettings',
+    ['min_workers', 'max_workers', 'max_requests', 'max_rss_mb', 'interval_s', 'scale_window',
+     'scale_up_depth', 'scale_down_depth', 'backoff_s', 'max_backoff_s', 'stop_timeout_s'],
+    defaults=[None, None, 0, 0., 1., 30, 1.5, 0.25, 1., 60., 60.])
+
+
+class Supervisor:
+    """Runs the server workers, one forked process per slot, in place of a
+    multiprocessing Pool. Workers that crash are restarted with an exponential
+    backoff. While the requests per worker thread stay above scale_up_depth,
+    or below scale_down_depth, for scale_window checks, a worker is added or
+    removed, between min_workers and max_workers. A worker that served
+    max_requests, or uses more than max_rss_mb, is replaced: the new one starts
+    first, and the old one finishes its requests in flight before exiting.
+    Those limits come from the SupervisorSettings.
+
+    run_worker(slot) runs a worker in the forked process until it gets a
+    SIGTERM. The workers answer the 'load' command of the control channel with
+    their pid, requests in flight, requests waiting for a thread, requests
+    served so far and number of threads.
+    """
+
+    def __init__(self, run_worker, control, num_workers: int,
+                 settings: SupervisorSettings=SupervisorSettings()):
+        min_workers, max_workers = settings.min_workers, settings.max_workers
+        self.min_workers = num_workers if min_workers is None else min_workers
+        self.max_workers = num_workers if max_workers is None else max_workers
+        if not 1 <= self.min_workers <= self.max_workers:
+            raise ValueError(f'Expected 1 <= min workers ({self.min_workers}) '
+                             f'<= max workers ({self.max_workers})')
+        self.num_workers = min(max(num_workers, self.min_workers), self.max_workers)
+        self.run_worker = run_worker
+        self.control = control
+        self.control.on_stop = self.stop
+        self.max_requests = settings.max_requests
+        self.max_rss_mb = settings.max_rss_mb
+        self.interval_s = settings.interval_s
+        self.scale_up_depth = settings.scale_up_depth
+        self.scale_down_depth = settings.scale_down_depth
+        self.backoff_s = settings.backoff_s
+        self.max_backoff_s = settings.max_backoff_s
+        self.stop_timeout_s = settings.stop_timeout_s
+        # 1 while a slot has a worker, read by the workers, so it's shared memory
+        self.slots = multiprocessing.Array('b', self.max_workers, lock=False)
+        # slot -> current worker process
+        self.processes = {}
+        # slot -> old worker process, until its replacement is ready
+        self.retiring = {}
+        # pid -> (process, when it gets killed), of the workers asked to stop
+        self.stopping = {}
+        self.started = {}
+        # slot -> consecutive crashes, and when it's restarted
+        self.crashes = collections.Counter()
+        self.restarts = {}
+        self.depths = collections.deque(maxlen=settings.scale_window)
+        self.stopped = threading.Event()
+
+    def active_slots(self):
+        """Slots with a worker, which may be read from the workers."""
+        return [i for i in range(self.max_workers) if self.slots[i]]
+
+    def stop(self):
+        """Makes run stop every worker and return."""
+        self.stopped.set()
+
+    def run(self):
+        """Starts the workers and supervises them until stop is called."""
+        for slot in range(self.num_workers):
+            self._start(slot)
+        while not self.stopped.is_set():
+            self._reap(self.interval_s)
+            if self.stopped.is_set():
+                break
+            self._restart_crashed()
+            loads = self._poll_loads()
+            self._retire(loads)
+            self._scale(loads)
+        self._stop_all()
+
+    def _worker_main(self, slot, worker_connection, supervisor_connection):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # otherwise the worker wouldn't notice when the supervisor exits
+        supervisor_connection.close()
+        self.control.attach(worker_connection)
+        self.run_worker(slot)
+
+    def _start(self, slot):
+        parent_end, child_end = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=self._worker_main,
+                                          args=(slot, child_end, parent_end), name=f'worker-{slot}')
+        process.start()
+        child_end.close()
+        self.control.add(process.pid, parent_end)
+        self.processes[slot] = process
+        self.started[process.pid] = time.monotonic()
+        self.slots[slot] = 1
+        LOGGER.info('Started worker %d (PID %d)', slot, process.pid)
+
+    def _stop(self, process):
+        """Asks a worker to finish its requests and exit."""
+        process.terminate()
+        self.stopping[process.pid] = (process, time.monotonic()+self.stop_timeout_s)
+        self.started.pop(process.pid, None)
+
+    def _reap(self, timeout):
+        processes = {p.sentinel: p for p in self._all_processes()}
+        if len(processes) == 0:
+            self.stopped.wait(timeout)
+            return
+        for sentinel in connection.wait(list(processes), timeout):
+            self._exited(processes[sentinel])
+        now = time.monotonic()
+        for process, kill_at in list(self.stopping.values()):
+            if now > kill_at and process.is_alive():
+                LOGGER.warning('Worker PID %d did not stop in time, killing it', process.pid)
+                process.kill()
+
+    def _all_processes(self):
+        return list(self.processes.values()) + list(self.retiring.values()) \
+            + [process for process, _ in self.stopping.values()]
+
+    def _exited(self, process):
+        process.join()
+        if self.stopping.pop(process.pid, None) is not None:
+            return
+        for slot, old in list(self.retiring.items()):
+            if old is process:
+                del self.retiring[slot]
+                return
+
+        slot = next(slot for slot, x in self.processes.items() if x is process)
+        del self.processes[slot]
+        if time.monotonic()-self.started.pop(process.pid) > self.max_backoff_s:
+            self.crashes[slot] = 0
+        self.crashes[slot] += 1
+        delay = min(self.max_backoff_s, self.backoff_s*2**(self.crashes[slot]-1))
+        LOGGER.error('Worker %d (PID %d) exited with code %s, restarting it in %.1fs',
+                     slot, process.pid, process.exitcode, delay)
+        self.restarts[slot] = time.monotonic()+delay
+        if slot not in self.retiring:
+            self.slots[slot] = 0
+
+    def _restart_crashed(self):
+        now = time.monotonic()
+        for slot, restart_at in list(self.restarts.items()):
+            if now >= restart_at:
+                del self.restarts[slot]
+                self._start(slot)
+
+    def _poll_loads(self):
+        """pid -> load of every worker that answered."""
+        results = self.control.broadcast('load', {}, self.interval_s)
+        return {x['pid']: x for x in results if x is not None and 'error' not in x}
+
+    def _retire(self, loads: dict):
+        """Replaces the workers that served too many requests or use too much memory."""
+        for slot, process in list(self.processes.items()):
+            if slot in self.retiring:
+                if process.pid in self.control.ready:
+                    self._stop(self.retiring.pop(slot))
+                continue
+
+            reason = None
+            requests = loads.get(process.pid, {}).get('requests', 0)
+            if self.max_requests > 0 and requests >= self.max_requests:
+                reason = f'served {requests} requests'
+            elif self.max_rss_mb > 0:
+                memory_mb = resident_memory_mb(process.pid)
+                if memory_mb > self.max_rss_mb:
+                    reason = f'uses {memory_mb:.0f}MB'
+            if reason is not None:
+                LOGGER.info('Replacing worker %d (PID %d), it %s', slot, process.pid, reason)
+                self.retiring[slot] = process
+                self._start(slot)
+
+    def _scale(self, loads: dict):
+        workers = [loads[x.pid] for x in self.processes.values() if x.pid in loads]
+        if len(workers) == 0:
+            return
+        # requests per thread, in flight or waiting for one
+        self.depths.append(sum(x['in_flight']+x['waiting'] for x in workers)
+                           / max(1, sum(x['threads'] for x in workers)))
+        if len(self.depths) < self.depths.maxlen:
+            return
+        depth = sum(self.depths)/len(self.depths)
+        slots = sorted(set(self.processes) | set(self.restarts))
+        if depth >= self.scale_up_depth and len(slots) < self.max_workers:
+            slot = min(set(range(self.max_workers)) - set(slots))
+            LOGGER.info('Adding worker %d, %.2f requests per thread', slot, depth)
+            self._start(slot)
+            self.depths.clear()
+        elif depth <= self.scale_down_depth and len(slots) > self.min_workers:
+            slot = slots[-1]
+            LOGGER.info('Removing worker %d, %.2f requests per thread', slot, depth)
+            self.restarts.pop(slot, None)
+            for workers_of_slot in (self.processes, self.retiring):
+                if slot in workers_of_slot:
+                    self._stop(workers_of_slot.pop(slot))
+            self.slots[slot] = 0
+            self.depths.clear()
+
+    def _stop_all(self):
+        LOGGER.info('Stopping %d workers', len(self.processes))
+        for workers_of_slot in (self.processes, self.retiring):
+            for process in workers_of_slot.values():
+                self._stop(process)
+            workers_of_slot.clear()
+        self.restarts.clear()
+        for process, kill_at in list(self.stopping.values()):
+            process.join(max(0., kill_at-time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.stopping.clear()
+        for slot in range(self.max_workers):
+            self.slots[slot] = 0
@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import grpc
+
+from admission import AdmissionController, PrioritySemaphore, Rejected, \
+    PRIORITY_METADATA_KEY, BULK
+
+
+def get_context(remaining=None, active=True, priority=None):
+    context = mock.Mock()
+    context.time_remaining.return_value = remaining
+    context.is_active.return_value = active
+    context.invocation_metadata.return_value = \
+        () if priority is None else ((PRIORITY_METADATA_KEY, priority),)
+    return context
+
+
+class TestPrioritySemaphore(unittest.TestCase):
+    def test_priority_order(self):
+        semaphore = PrioritySemaphore(1)
+        semaphore.acquire()
+        order = []
+
+        def wait(name, priority):
+            semaphore.acquire(priority=priority)
+            order.append(name)
+            semaphore.release()
+
+        threads = []
+        for name, priority in [('bulk1', 1), ('bulk2', 1), ('interactive', 0)]:
+            threads.append(threading.Thread(target=wait, args=(name, priority)))
+            threads[-1].start()
+            time.sleep(0.05)
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['interactive', 'bulk1', 'bulk2'])
+
+    def test_timeout(self):
+        semaphore = PrioritySemaphore(1)
+        with semaphore:
+            self.assertFalse(semaphore.acquire(timeout=0.05))
+            self.assertFalse(semaphore.acquire(blocking=False))
+        # the waiter that timed out doesn't keep its place
+        self.assertTrue(semaphore.acquire(blocking=False))
+
+
+class TestAdmissionController(unittest.TestCase):
+    def admit(self, controller, context, in_flight=0, queued=0):
+        with controller.request(context, 'model', in_flight, queued) as request:
+            return request
+
+    def test_queue_limits(self):
+        rejected = []
+        controller = AdmissionController(max_in_flight=4, max_queued=2,
+                                         on_reject=lambda *x: rejected.append(x))
+        self.assertIsNotNone(self.admit(controller, get_context(), in_flight=3, queued=1))
+        with self.assertRaises(Rejected) as error:
+            self.admit(controller, get_context(), in_flight=4)
+        self.assertEqual(error.exception.code, grpc.StatusCode.RESOURCE_EXHAUSTED)
+        with self.assertRaises(Rejected):
+            self.admit(controller, get_context(), queued=2)
+        # bulk requests only get half of the queues
+        with self.assertRaises(Rejected):
+            self.admit(controller, get_context(priority=BULK), in_flight=2)
+        self.assertEqual(rejected, [('model', grpc.StatusCode.RESOURCE_EXHAUSTED)]*3)
+
+        context = get_context()
+        with self.assertRaises(Rejected):
+            self.admit(controller, context, in_flight=4)
+        context.set_code.assert_called_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+    def test_deadlines(self):
+        controller = AdmissionController()
+        # no estimate until the model runs
+        self.assertIsNotNone(self.admit(controller, get_context(remaining=0.01)))
+        controller.observe('model', 0.1)
+        self.assertAlmostEqual(controller.estimate('model', queued=4, concurrency=2), 0.3)
+        with self.assertRaises(Rejected) as error:
+            self.admit(controller, get_context(remaining=0.05))
+        self.assertEqual(error.exception.code, grpc.StatusCode.DEADLINE_EXCEEDED)
+        with self.assertRaises(Rejected) as error:
+            self.admit(controller, get_context(remaining=0.15), queued=1)
+        request = self.admit(controller, get_context(remaining=1))
+        self.assertAlmostEqual(request.remaining(), 1, places=1)
+        with self.assertRaises(Rejected) as error:
+            self.admit(controller, get_context(active=False))
+        self.assertEqual(error.exception.code, grpc.StatusCode.CANCELLED)
+
+    def test_batch_estimates(self):
+        controller = AdmissionController()
+        controller.observe('model', 0.01)
+        # the batches don't count as single runs, and the other way around
+        self.assertIsNone(controller.estimate('model', batch_size=8))
+        controller.observe('model', 0.8, batch_size=8)
+        self.assertAlmostEqual(controller.estimate('model'), 0.01)
+        self.assertAlmostEqual(controller.estimate('model', batch_size=4), 0.4)
+        self.assertAlmostEqual(controller.estimate('model', queued=2, batch_size=4), 1.2)
+        with controller.request(get_context(remaining=0.2), 'model', 0, 0):
+            pass
+        with self.assertRaises(Rejected):
+            with controller.request(get_context(remaining=0.2), 'model', 0, 0, batch_size=4):
+                pass
+
+    def test_current_request(self):
+        controller = AdmissionController()
+        self.assertIsNone(controller.current())
+        with controller.request(get_context(priority=BULK), 'model', 0, 0) as request:
+            self.assertIs(controller.current(), request)
+            self.assertEqual(request.priority, 1)
+            self.assertIsNone(request.deadline)
+        self.assertIsNone(controller.current())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BatchScheduler, Expired
+from model_interface import ModelInterface
+
+
+class CountingModel(ModelInterface):
+    def __init__(self):
+        self.batch_sizes = []
+
+    def run(self, data, args):
+        return data+args.get('suffix', '_processed')
+
+    def run_batch(self, data, args):
+        self.batch_sizes.append(len(data))
+        return [self.run(x, args) for x in data]
+
+
+class BrokenModel(ModelInterface):
+    def run(self, data, args):
+        raise ValueError('broken model')
+
+    def run_batch(self, data, args):
+        return []
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+    def test_merges_concurrent_calls(self):
+        model = CountingModel()
+        scheduler = BatchScheduler(model, threading.Lock(), max_batch_size=8, max_wait_ms=200)
+
+        texts = [f'text{i}' for i in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda x: scheduler.run(x, {}), texts))
+
+        self.assertEqual(results, [f'{x}_processed' for x in texts])
+        self.assertEqual(sum(model.batch_sizes), 8)
+        self.assertLess(len(model.batch_sizes), 8)
+        self.assertTrue(max(model.batch_sizes) <= 8)
+
+    def test_max_batch_size(self):
+        model = CountingModel()
+        scheduler = BatchScheduler(model, threading.Lock(), max_batch_size=2, max_wait_ms=50)
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda x: scheduler.run(x, {}), ['a']*6))
+
+        self.assertEqual(results, ['a_processed']*6)
+        self.assertTrue(max(model.batch_sizes) <= 2)
+
+    def test_different_args_are_not_merged(self):
+        model = CountingModel()
+        scheduler = BatchScheduler(model, threading.Lock(), max_batch_size=8, max_wait_ms=100)
+
+        args = [{'suffix': '_a'}, {'suffix': '_b'}]*4
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda x: scheduler.run('text', x), args))
+
+        self.assertEqual(results, ['text_a', 'text_b']*4)
+
+    def test_concurrent_batches(self):
+        model = CountingModel()
+        semaphore = threading.BoundedSemaphore(2)
+        scheduler = BatchScheduler(model, semaphore, max_batch_size=2,
+                                   max_wait_ms=10, num_threads=2)
+        self.assertEqual(len(scheduler.threads), 2)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda x: scheduler.run(x, {}), ['a']*8))
+        self.assertEqual(results, ['a_processed']*8)
+
+    def test_errors_reach_every_caller(self):
+        scheduler = BatchScheduler(BrokenModel(), threading.Lock(), max_batch_size=4,
+                                   max_wait_ms=10)
+        with self.assertRaises(ValueError):
+            scheduler.run('text', {})
+
+    def test_expired_calls_are_skipped(self):
+        model = CountingModel()
+        lock = threading.Lock()
+        scheduler = BatchScheduler(model, lock, max_batch_size=4, max_wait_ms=10)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with lock: # the model is busy with the first call until the deadline
+                first = executor.submit(scheduler.run, 'first', {})
+                time.sleep(0.05)
+                with self.assertRaises(Expired):
+                    scheduler.run('late', {}, deadline=time.monotonic()+0.05)
+            self.assertEqual(first.result(), 'first_processed')
+        self.assertEqual(scheduler.run('a', {}, deadline=time.monotonic()+5), 'a_processed')
+        # the late call never ran
+        self.assertEqual(model.batch_sizes, [1, 1])
+
+    def test_close(self):
+        model = CountingModel()
+        scheduler = BatchScheduler(model, threading.Lock(), max_batch_size=4,
+                                   max_wait_ms=10, num_threads=2)
+        self.assertEqual(scheduler.run('a', {}), 'a_processed')
+        scheduler.close()
+        for thread in scheduler.threads:
+            thread.join(timeout=1)
+            self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
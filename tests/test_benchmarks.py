@@ -0,0 +1,83 @@
+import unittest
+import threading
+import time
+
+from benchmarks.benchmark import compare, run_closed_loop, run_open_loop, summarize
+
+
+def _result(throughput_rps=100., p99_ms=10., errors=0):
+    return {'throughput_rps': throughput_rps, 'p99_ms': p99_ms, 'errors': errors}
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_summarize(self):
+        summary = summarize([i/1000 for i in range(1, 101)], errors=2, elapsed_s=2., batch=4)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['errors'], 2)
+        self.assertAlmostEqual(summary['throughput_rps'], 50)
+        self.assertAlmostEqual(summary['items_per_s'], 200)
+        self.assertAlmostEqual(summary['p50_ms'], 50.5)
+        self.assertAlmostEqual(summary['p99_ms'], 99.01)
+
+    def test_summarize_without_requests(self):
+        summary = summarize([], errors=3, elapsed_s=1.)
+        self.assertEqual(summary['requests'], 0)
+        self.assertEqual(summary['p99_ms'], 0)
+
+    def test_compare(self):
+        baseline = {'scenarios': {'a': _result(), 'b': _result()}}
+        within = {'scenarios': {'a': _result(throughput_rps=90, p99_ms=11)}}
+        self.assertEqual(compare(within, baseline, tolerance=0.2), [])
+
+        regressed = {'scenarios': {'a': _result(throughput_rps=70),
+                                   'b': _result(p99_ms=13, errors=1)}}
+        regressions = compare(regressed, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(regressions[0].startswith('a: throughput'))
+        self.assertTrue(regressions[1].startswith('b: p99'))
+        self.assertTrue(regressions[2].startswith('b: 1 errors'))
+
+    def test_closed_loop(self):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return True
+
+        latencies, errors, elapsed_s = run_closed_loop(call, concurrency=4, duration_s=0.2)
+        self.assertEqual(errors, 0)
+        self.assertEqual(in_flight[1], 4)
+        self.assertGreater(len(latencies), 20)
+        self.assertGreaterEqual(elapsed_s, 0.2)
+        self.assertTrue(all(x >= 0.01 for x in latencies))
+
+    def test_open_loop(self):
+        calls = iter(range(100))
+        latencies, errors, elapsed_s = run_open_loop(lambda: next(calls) % 2 == 0,
+                                                     rate=100, duration_s=0.3)
+        self.assertEqual(len(latencies), 30)
+        self.assertEqual(errors, 15)
+        self.assertGreaterEqual(elapsed_s, 0.29)
+
+    def test_open_loop_counts_queueing(self):
+        # a server that answers one request at a time, slower than they arrive
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                time.sleep(0.02)
+            return True
+
+        latencies, _, _ = run_open_loop(call, rate=100, duration_s=0.2)
+        self.assertGreater(max(latencies), 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cache import ResultCache, MISS
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_key(self):
+        im = np.zeros((20,30,3), dtype=np.uint8)
+        key = ResultCache.key('model', {'a': 1, 'b': 2}, im)
+        self.assertEqual(key, ResultCache.key('model', {'b': 2, 'a': 1}, im.copy()))
+        self.assertNotEqual(key, ResultCache.key('other_model', {'a': 1, 'b': 2}, im))
+        self.assertNotEqual(key, ResultCache.key('model', {'a': 1}, im))
+        self.assertNotEqual(key, ResultCache.key('model', {'a': 1, 'b': 2}, im.reshape((30,20,3))))
+        self.assertNotEqual(key, ResultCache.key('model', {'a': 1, 'b': 2}, im[::2]))
+        self.assertNotEqual(ResultCache.key('model', {}, 'ab', 'c'),
+                            ResultCache.key('model', {}, 'a', 'bc'))
+        self.assertEqual(ResultCache.key('model', {}, 'text'),
+                         ResultCache.key('model', {}, b'text'))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.put(b'a', 1)
+        cache.put(b'b', 2)
+        self.assertEqual(cache.get(b'a'), 1)
+        cache.put(b'c', 3)
+        self.assertIs(cache.get(b'b'), MISS)
+        self.assertEqual(cache.get(b'a'), 1)
+        self.assertEqual(cache.get(b'c'), 3)
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_memory_bound(self):
+        cache = ResultCache(max_mb=1)
+        big = np.zeros(400*1024, dtype=np.uint8)
+        for i in range(4):
+            cache.put(bytes([i]), big)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertTrue(cache.stats()['bytes'] <= 1024*1024)
+
+        # results larger than the cache are not stored
+        cache.put(b'huge', np.zeros(2*1024*1024, dtype=np.uint8))
+        self.assertIs(cache.get(b'huge'), MISS)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl_s=0.05)
+        cache.put(b'a', 1)
+        self.assertEqual(cache.get(b'a'), 1)
+        time.sleep(0.1)
+        self.assertIs(cache.get(b'a'), MISS)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_errors_are_not_cached(self):
+        cache = ResultCache()
+        cache.put(b'a', {'error': 'failed'})
+        self.assertIs(cache.get(b'a'), MISS)
+
+        def fail():
+            raise ValueError('failed')
+        with self.assertRaises(ValueError):
+            cache.get_or_compute(b'b', fail)
+        self.assertEqual(cache.get_or_compute(b'b', lambda: 2), 2)
+
+    def test_single_flight(self):
+        cache = ResultCache()
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 'result'
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(cache.get_or_compute, b'key', compute)
+            started.wait()
+            others = [executor.submit(cache.get_or_compute, b'key', compute) for _ in range(7)]
+            results = [first.result()] + [x.result() for x in others]
+
+        self.assertEqual(results, ['result']*8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['deduplicated'], 7)
+
+    def test_single_flight_retry(self):
+        cache = ResultCache()
+        started = threading.Event()
+
+        def rejected():
+            started.set()
+            time.sleep(0.1)
+            raise TimeoutError('deadline of the first call')
+
+        # the calls waiting for the rejected one compute the result themselves
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(cache.get_or_compute, b'key', rejected, (TimeoutError,))
+            started.wait()
+            others = [executor.submit(cache.get_or_compute, b'key', lambda: 'result',
+                                      (TimeoutError,)) for _ in range(3)]
+            with self.assertRaises(TimeoutError):
+                first.result()
+            self.assertEqual([x.result() for x in others], ['result']*3)
+        self.assertEqual(cache.get(b'key'), 'result')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import multiprocessing
+import time
+
+from control import ControlChannel
+
+
+def handler(channel, command, args):
+    if command == 'relay':
+        # a command broadcast by a worker instead of the supervisor
+        return channel.broadcast('reload', args, timeout=5,
+                                 ready_only=args.get('ready_only', False))
+    if command == 'fail':
+        raise ValueError(f'unknown command {command}')
+    return {'pid': os.getpid(), command: args}
+
+
+def run_worker(channel, worker_connection, listen, ready):
+    channel.attach(worker_connection)
+    if listen:
+        channel.listen(lambda command, args: handler(channel, command, args))
+    if ready:
+        channel.ready_to_serve()
+    multiprocessing.Event().wait(5)
+
+
+def start_worker(channel, listen=True, ready=True):
+    parent_end, child_end = multiprocessing.Pipe()
+    worker = multiprocessing.get_context('fork').Process(
+        target=run_worker, args=(channel, child_end, listen, ready), daemon=True)
+    worker.start()
+    child_end.close()
+    channel.add(worker.pid, parent_end)
+    return worker
+
+
+class TestControlChannel(unittest.TestCase):
+
+    def test_broadcast(self):
+        channel = ControlChannel()
+        workers = [start_worker(channel) for _ in range(2)]
+
+        results = channel.broadcast('reload', {'model': 'example'}, timeout=5)
+        self.assertEqual([x['reload'] for x in results], [{'model': 'example'}]*2)
+        self.assertEqual([x['pid'] for x in results], [x.pid for x in workers])
+
+        results = channel.broadcast('relay', {'model': 'example'}, timeout=10)
+        for relayed in results:
+            self.assertEqual([x['pid'] for x in relayed], [x.pid for x in workers])
+
+        for worker in workers:
+            worker.terminate()
+
+    def test_timeout_and_errors(self):
+        channel = ControlChannel()
+        # the second worker never answers
+        workers = [start_worker(channel), start_worker(channel, listen=False)]
+
+        results = channel.broadcast('fail', {}, timeout=0.2)
+        self.assertEqual(results, [{'pid': workers[0].pid, 'error': 'unknown command fail'}, None])
+
+        # the workers that exit aren't waited for
+        workers[1].terminate()
+        workers[1].join()
+        deadline = time.monotonic() + 5
+        while len(channel.workers) > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        begin = time.monotonic()
+        results = channel.broadcast('reload', {}, timeout=5)
+        self.assertLess(time.monotonic()-begin, 1)
+        self.assertEqual(results, [{'pid': workers[0].pid, 'reload': {}}])
+
+        workers[0].terminate()
+
+    def test_ready_only(self):
+        channel = ControlChannel()
+        # the second worker is still loading its models
+        workers = [start_worker(channel), start_worker(channel, listen=False, ready=False)]
+        deadline = time.monotonic() + 5
+        while workers[0].pid not in channel.ready and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        begin = time.monotonic()
+        results = channel.broadcast('reload', {}, timeout=5, ready_only=True)
+        self.assertLess(time.monotonic()-begin, 1)
+        self.assertEqual(results, [{'pid': workers[0].pid, 'reload': {}}])
+
+        # and so are they when a worker broadcasts
+        begin = time.monotonic()
+        results = channel.broadcast('relay', {'ready_only': True}, timeout=5, ready_only=True)
+        self.assertLess(time.monotonic()-begin, 1)
+        self.assertEqual(results, [[{'pid': workers[0].pid, 'reload': {'ready_only': True}}]])
+
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from metrics import Metrics, merge_snapshots, to_prometheus, LATENCY_BUCKETS
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_request(self):
+        metrics = Metrics()
+        with metrics.request('RunText', 'example_text') as request:
+            request.batch_size = 4
+            with metrics.stage('run'):
+                pass
+            metrics.add_stage('run', 0.02)
+            metrics.add_stage('wait', 0.5)
+        self.assertIsNone(metrics.current())
+        # no request within this thread
+        metrics.add_stage('run', 1)
+
+        with self.assertRaises(ValueError):
+            with metrics.request('RunText', 'example_text'):
+                raise ValueError('failed')
+
+        snapshot = metrics.snapshot()
+        labels = {'model': 'example_text', 'rpc': 'RunText'}
+        self.assertIn(['tms_requests_total', labels, 2], snapshot['counters'])
+        self.assertIn(['tms_errors_total', labels, 1], snapshot['counters'])
+
+        histograms = {(name, tuple(sorted(labels.items()))): values
+                      for name, labels, values in snapshot['histograms']}
+        run = histograms[('tms_stage_seconds', (('model', 'example_text'), ('rpc', 'RunText'),
+                                                ('stage', 'run')))]
+        self.assertEqual(sum(run[:-1]), 1)
+        self.assertEqual(run[LATENCY_BUCKETS.index(0.025)], 1)
+        self.assertAlmostEqual(run[-1], 0.02, places=3)
+        batch = histograms[('tms_batch_size', (('model', 'example_text'), ('rpc', 'RunText')))]
+        self.assertEqual(batch[2], 1) # bucket le=4
+
+    def test_merge_and_prometheus(self):
+        snapshots = []
+        for latency in (0.003, 20.):
+            metrics = Metrics()
+            metrics.inc('tms_requests_total', {'model': 'a', 'rpc': 'RunImage'})
+            metrics.observe('tms_request_seconds', {'model': 'a', 'rpc': 'RunImage'}, latency)
+            snapshots.append(metrics.snapshot())
+
+        snapshot = merge_snapshots(snapshots)
+        self.assertEqual(snapshot['counters'],
+                         [['tms_requests_total', {'model': 'a', 'rpc': 'RunImage'}, 2]])
+
+        text = to_prometheus(snapshot)
+        self.assertIn('# TYPE tms_request_seconds histogram', text)
+        self.assertIn('tms_requests_total{model="a",rpc="RunImage"} 2', text)
+        self.assertIn('tms_request_seconds_bucket{le="0.001",model="a",rpc="RunImage"} 0', text)
+        self.assertIn('tms_request_seconds_bucket{le="0.005",model="a",rpc="RunImage"} 1', text)
+        self.assertIn('tms_request_seconds_bucket{le="+Inf",model="a",rpc="RunImage"} 2', text)
+        self.assertIn('tms_request_seconds_count{model="a",rpc="RunImage"} 2', text)
+        self.assertIn('tms_request_seconds_sum{model="a",rpc="RunImage"} 20.003', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
 import unittest
+import asyncio
+import json
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
+import grpc
 import numpy as np
 from grpc._channel import _InactiveRpcError
 
-from model_client import ModelClient
+import server_pb2
+import utils
+from model_client import ModelClient, AsyncModelClient, ClientConfig, LoadBalancer, Worker, \
+    EJECT_AFTER_FAILURES, _split_host_port
 
 
 class TestModelClient(unittest.TestCase):
@@ -26,6 +35,78 @@ class TestModelClient(unittest.TestCase):
         res = model.run_image(im)
         self.assertEqual(res, [['object1', 0.3], ['object2', 0.5]])
 
+    def test_image_shared_memory(self):
+        for shared_memory in [True, False]:
+            model = ModelClient('example_image', 'localhost', shared_memory=shared_memory)
+            self.assertEqual(model.shm_pool is not None, shared_memory)
+
+            im = np.zeros((200,150,3), dtype=np.uint8)
+            res = model.run_image(im)
+            self.assertEqual(res, [['object1', 0.3], ['object2', 0.5]])
+            res = model.run_image_batch([im]*6)
+            self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*6)
+            model.close()
+
+    def test_tensors(self):
+        model = ModelClient('bench_sleep', 'localhost')
+        for dtype in [np.float16, np.int16, np.bool_]:
+            tensor = np.ones((2,3,4,5), dtype=dtype)
+            self.assertEqual(model.run_image(tensor, {'ms': 0}), {'size': 2})
+            self.assertEqual(model.run_image_batch([tensor]*3, {'ms': 0}), [{'size': 2}]*3)
+
+    def test_deadlines_and_priority(self):
+        with self.assertRaises(ValueError):
+            ModelClient('bench_sleep', 'localhost', priority='urgent')
+        model = ModelClient('bench_sleep', 'localhost', deadline_s=0.2, priority='bulk')
+        self.assertEqual(model.run_text('text', {'ms': 0}), {'size': 4})
+        details = []
+        for _ in range(20):
+            with self.assertRaises(_InactiveRpcError) as error:
+                model.run_text('text', {'ms': 500})
+            self.assertEqual(error.exception.code(), grpc.StatusCode.DEADLINE_EXCEEDED)
+            details.append(error.exception.details())
+        # once the workers learn how long the model takes, they don't even run it
+        self.assertTrue(any('Not enough time' in x for x in details))
+        model.close()
+
+    def test_image_preprocessing(self):
+        model = ModelClient('example_image', 'localhost')
+        images = [np.zeros((2160,3840,3), dtype=np.uint8), np.zeros((200,150), dtype=np.uint8),
+                  np.zeros((200,150,4), dtype=np.uint8)]
+        res = model.run_image_batch(images)
+        self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*3)
+        res = model.run_image(images[0])
+        self.assertEqual(res, [['object1', 0.3], ['object2', 0.5]])
+        stats = model.preprocessor.stats()
+        self.assertEqual(stats['images'], 4)
+        self.assertTrue(stats['seconds']['resize'] > 0)
+
+    def test_image_encoding(self):
+        im = np.zeros((200,150,3), dtype=np.uint8)
+        for encoding in ['jpeg', 'png', 'webp', 'zlib']:
+            model = ModelClient('example_image_to_image', 'localhost', image_encoding=encoding)
+            mask, _ = model.run_image_to_image(im)
+            self.assertEqual(mask.shape, (200,150))
+            res = model.run_image_to_image_batch([im]*3)
+            self.assertEqual([x[0].shape for x in res], [(200,150)]*3)
+
+        png = utils.numpy_to_encoded_proto(im, 'png').data
+        mask, _ = model.run_image_to_image(png)
+        self.assertEqual(mask.shape, (200,150))
+
+    def test_image_stream(self):
+        model = ModelClient('example_image', 'localhost')
+
+        frames = (np.zeros((200,150,3), dtype=np.uint8) for _ in range(20))
+        res = list(model.run_image_stream(frames, window=3))
+        self.assertEqual([x[0] for x in res], list(range(20)))
+        self.assertEqual([x[1] for x in res], [[['object1', 0.3], ['object2', 0.5]]]*20)
+
+        frames = (np.zeros((200,150,3), dtype=np.uint8) for _ in range(20))
+        res = list(model.run_image_stream(frames, window=1, drop_frames=True))
+        self.assertTrue(0 < len(res) <= 20)
+        self.assertEqual([x[0] for x in res], sorted(x[0] for x in res))
+
     def test_image_batch(self):
         model = ModelClient('example_image', 'localhost')
 
@@ -37,6 +118,288 @@ class TestModelClient(unittest.TestCase):
         res = model.run_image_batch([im,im,im,im])
         self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*4)
 
+    def test_image_batch_encoding(self):
+        model = ModelClient('example_image', 'localhost', max_chunk=3)
+
+        im = np.zeros((20,15,3), dtype=np.uint8)
+        res = model.run_image_batch([im]*5, encoding=utils.MSGPACK_ENCODING)
+        self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*5)
+
+    def test_image_batch_fan_out(self):
+        model = ModelClient('example_image', 'localhost', max_chunk=3)
+
+        im = np.zeros((20,15,3), dtype=np.uint8)
+        res = model.run_image_batch([im]*10)
+        self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*10)
+
+    def test_merge_chunks_partial_failure(self):
+        model = ModelClient.__new__(ModelClient)
+        chunks = [['a', 'b'], ['c'], ['d', 'e']]
+        responses = [['a_ok', 'b_ok'], {'error': 'failed'}, ValueError('lost worker')]
+        res = model._merge_chunks(chunks, responses)
+        self.assertEqual(res, ['a_ok', 'b_ok', {'error': 'failed'},
+                               {'error': 'lost worker'}, {'error': 'lost worker'}])
+
+    def test_select_workers(self):
+        model = ModelClient.__new__(ModelClient)
+        model.model = 'example_image'
+        workers = [{'pid': 1, 'models': ['example_image']},
+                   {'pid': 2, 'models': ['example_text']},
+                   {'pid': 3, 'models': ['example_image', 'example_text']}]
+        self.assertEqual([x['pid'] for x in model._select_workers(workers)], [1, 3])
+
+        # keeps every worker when none of them has the model
+        model.model = 'unknown'
+        self.assertEqual(model._select_workers(workers), workers)
+
+    def test_one_channel_per_worker(self):
+        model = ModelClient('example_image', 'localhost')
+        servers, _ = model._discover(5)
+        self.assertEqual(len(model._server_ids()), 1)
+        workers = next(iter(servers.values()))['workers']
+        self.assertEqual(sorted(x.pid for x in model.stubs), sorted(x['pid'] for x in workers))
+        for worker, stub in model.stubs.items():
+            response = stub.GetPID(server_pb2.StringArg(data='example_image'))
+            self.assertEqual(json.loads(response.data)['pid'], worker.pid)
+        model.close()
+
+    def test_many_hosts(self):
+        # the same server on two addresses is only used once
+        model = ModelClient('example_image', ['localhost', '127.0.0.1:50000'], refresh_s=0)
+        single = ModelClient('example_image', 'localhost')
+        self.assertEqual(sorted(x.pid for x in model.stubs), sorted(x.pid for x in single.stubs))
+        self.assertIsNotNone(model.shm_pool)
+        workers = set(model.stubs)
+        model.refresh()
+        self.assertEqual(set(model.stubs), workers)
+
+        # the requests schedule refreshes on the background
+        im = np.zeros((20,15,3), dtype=np.uint8)
+        for _ in range(4):
+            self.assertEqual(model.run_image(im), [['object1', 0.3], ['object2', 0.5]])
+        model.close()
+        single.close()
+
+    def test_apply_topology(self):
+        model = ModelClient.__new__(ModelClient)
+        model.model = 'example_image'
+        model._init_workers(['a', 'b'], '50000', None)
+
+        def server(server_id, *pids):
+            return {'server_id': server_id, 'workers': [
+                {'pid': pid, 'port': 1000+pid, 'models': ['example_image'], 'ready': True}
+                for pid in pids]}
+
+        def add(workers):
+            for worker in workers:
+                model._add_worker(worker, lambda *_args, **_kwargs: mock.Mock())
+                model._readmit(worker['key'])
+
+        # the same pids on different servers are different workers
+        added, removed = model._apply_topology(
+            {'a:50000': server('A', 1, 2), 'b:50000': server('B', 1), 'c:50000': server('A', 1)},
+            ['a:50000', 'b:50000', 'c:50000'])
+        self.assertEqual([x['key'] for x in added],
+                         [Worker('a:1001', 1), Worker('a:1002', 2), Worker('b:1001', 1)])
+        self.assertEqual(removed, [])
+        add(added)
+
+        # workers gone from their server, or from the addresses, are removed,
+        # and the servers that don't answer keep theirs
+        added, removed = model._apply_topology({'a:50000': server('A', 2, 3)}, ['a:50000'])
+        self.assertEqual([x['key'] for x in added], [Worker('a:1003', 3)])
+        self.assertEqual(removed, [Worker('a:1001', 1), Worker('b:1001', 1)])
+        added, removed = model._apply_topology({}, ['a:50000', 'b:50000'])
+        self.assertEqual((added, removed), ([], []))
+
+    def test_shared_memory_on_refresh(self):
+        model = ModelClient.__new__(ModelClient)
+        model.model = 'example_image'
+        model._init_workers(['a', 'b'], '50000', None)
+        pool = model.shm_pool = mock.Mock()
+
+        def server(server_id):
+            return {'server_id': server_id, 'workers': [
+                {'pid': 1, 'port': 1001, 'models': ['example_image'], 'ready': True}]}
+
+        pools = []
+        def connect_workers(workers, _timeout):
+            pools.append(model.shm_pool)
+            for worker in workers:
+                model._add_worker(worker, lambda *_args, **_kwargs: mock.Mock())
+                model._readmit(worker['key'])
+
+        servers = {'a:50000': server('A')}
+        with mock.patch.object(model, 'health_check'), \
+                mock.patch.object(model, '_discover', lambda _: (servers, list(servers))), \
+                mock.patch.object(model, '_connect_workers', connect_workers):
+            model.refresh()
+            # the workers of another server never get shared memory
+            servers['b:50000'] = server('B')
+            model.refresh()
+        self.assertEqual(pools, [pool, None])
+        self.assertIs(model.retired_shm_pool, pool)
+
+    def test_batch_tensor_feature(self):
+        model = ModelClient.__new__(ModelClient)
+        model.model, model.image_encoding = 'example_image', None
+        model._init_workers(['a', 'b'], '50000', None)
+        images = [np.zeros((20,30,1), dtype=np.uint8), np.zeros((5,7), dtype=np.uint8)]
+
+        def connect(servers):
+            added, _ = model._apply_topology(servers, list(servers))
+            for worker in added:
+                model._add_worker(worker, lambda *_args, **_kwargs: mock.Mock())
+
+        workers = [{'pid': 1, 'port': 1001, 'models': ['example_image'], 'ready': True}]
+        connect({'a:50000': {'server_id': 'A', 'workers': workers, 'features': ['batch_tensor']}})
+        request = model._get_batch_image_arg(images)
+        self.assertTrue(request.HasField('tensor'))
+        self.assertEqual([list(x.dims) for x in request.tensor.item_shapes], [[20,30,1], [5,7]])
+
+        # a server that would ignore the tensor gets the images
+        connect({'b:50000': {'server_id': 'B', 'workers': workers}})
+        request = model._get_batch_image_arg(images)
+        self.assertFalse(request.HasField('tensor'))
+        self.assertEqual(len(request.images), 2)
+
+    def test_ejection(self):
+        model = ModelClient.__new__(ModelClient)
+        model._init_workers('localhost', '50000', None)
+        workers = [Worker('localhost:1001', 1), Worker('localhost:1002', 2)]
+        for worker in workers:
+            model._add_worker({'key': worker, 'models': [], 'server': ('localhost:50000', 'A')},
+                              lambda *_args, **_kwargs: mock.Mock())
+            model._readmit(worker)
+        timed_out = mock.Mock()
+        timed_out.code.return_value = grpc.StatusCode.DEADLINE_EXCEEDED
+        for _ in range(EJECT_AFTER_FAILURES):
+            self.assertEqual(list(model.stubs), workers)
+            model.outstanding[workers[0]] += 1
+            model._release_pid(workers[0], None, timed_out)
+        self.assertEqual(list(model.stubs), [workers[1]])
+
+        # the last worker is never ejected
+        model._apply_health({'serving': [], 'stopped_serving': workers})
+        self.assertEqual(list(model.stubs), [workers[1]])
+        model._apply_health({'serving': workers, 'stopped_serving': []})
+        self.assertEqual(set(model.stubs), set(workers))
+
+    def test_unavailable_worker(self):
+        model = ModelClient.__new__(ModelClient)
+        model._init_workers('localhost', '50000', None)
+        model._set_deadline_and_priority(None, 'interactive')
+        model.balancer = LoadBalancer.ROUND_ROBIN
+        workers = [Worker('localhost:1001', 1), Worker('localhost:1002', 2)]
+        for worker in workers:
+            model._add_worker({'key': worker, 'models': [], 'server': ('localhost:50000', 'A')},
+                              lambda *_args, **_kwargs: mock.Mock())
+            model._readmit(worker)
+        refused = grpc.RpcError()
+        refused.code = lambda: grpc.StatusCode.UNAVAILABLE
+        refused.trailing_metadata = lambda: None
+        model.stubs[workers[0]].RunText.with_call.side_effect = refused
+        call = mock.Mock()
+        call.trailing_metadata.return_value = ()
+        model.stubs[workers[1]].RunText.with_call.return_value = ('ok', call)
+
+        # the request goes to the other worker, and so do the next ones
+        model.stub_idx = len(workers)-1
+        self.assertEqual(model._call('RunText', None, parse_response=str.upper), 'OK')
+        self.assertEqual(list(model.stubs), [workers[1]])
+        self.assertEqual(model._call('RunText', None, parse_response=str.upper), 'OK')
+
+        # the error of the last worker is raised
+        model.stubs[workers[1]].RunText.with_call.side_effect = refused
+        with self.assertRaises(grpc.RpcError):
+            model._call('RunText', None)
+        self.assertEqual(list(model.stubs), [workers[1]])
+
+    def test_unreachable_worker_ports(self):
+        get_topologies = ModelClient._get_topologies
+
+        def closed_ports(client, addresses):
+            results = get_topologies(client, addresses)
+            for result in results.values():
+                if isinstance(result, dict):
+                    for worker in result['workers']:
+                        worker['port'] = 1
+            return results
+
+        # the workers are reached on the shared port instead
+        with mock.patch.object(ModelClient, '_get_topologies', closed_ports):
+            model = ModelClient('example_text', 'localhost')
+            workers = set(model.stubs)
+            self.assertTrue(all(x.address.endswith(':50000') for x in workers))
+            self.assertEqual(model.run_text('text'), 'text_processed')
+            model.refresh()
+            self.assertEqual(set(model.stubs), workers)
+        self.assertEqual({x.pid for x in workers},
+                         {x.pid for x in ModelClient('example_text', 'localhost').stubs})
+
+    def test_executor_grows_with_workers(self):
+        model = ModelClient.__new__(ModelClient)
+        model.executor = None
+        model._init_workers('localhost', '50000', None)
+
+        def open_channels(workers, _timeout):
+            for worker in workers:
+                model._add_worker(worker, lambda *_args, **_kwargs: mock.Mock())
+                model._readmit(worker['key'])
+            return []
+
+        with mock.patch.object(model, '_open_channels', open_channels):
+            for num_workers in [2, 4, 3]:
+                workers = [{'key': Worker(f'localhost:{1000+i}', i), 'models': [],
+                            'server': ('localhost:50000', 'A')} for i in range(num_workers)]
+                model._connect_workers([x for x in workers if x['key'] not in model.channels], 1)
+            self.assertEqual(model.executor._max_workers, 4)
+
+    def test_async_setup(self):
+        kwargs = {'max_chunk': 2, 'image_encoding': 'jpeg', 'deadline_s': 1,
+                  'priority': 'bulk', 'shared_memory': False}
+        with mock.patch.object(ModelClient, 'connect') as connect:
+            model = ModelClient('example_text', 'localhost', **kwargs)
+            connect.assert_called_once()
+        # the same setup, but the connection waits for the event loop
+        async_model = AsyncModelClient('example_text', 'localhost', max_in_flight=4, **kwargs)
+        self.assertNotIsInstance(async_model, ModelClient)
+        self.assertTrue(set(vars(model)) - {'executor'} <= set(vars(async_model)))
+        for key in ['model', 'max_chunk', 'image_encoding', 'deadline_s', 'call_metadata',
+                    'hosts', 'port', 'timeout', 'shared_memory', 'refresh_s']:
+            self.assertEqual(getattr(model, key), getattr(async_model, key), key)
+        self.assertEqual(async_model.channels, {})
+        with self.assertRaises(ValueError):
+            AsyncModelClient('example_text', 'localhost', priority='urgent')
+
+        # the options may also come in a config, and override it
+        config = ClientConfig(**kwargs)
+        async_model = AsyncModelClient('example_text', 'localhost', config=config, max_chunk=3)
+        self.assertEqual(async_model.image_encoding, 'jpeg')
+        self.assertEqual(async_model.max_chunk, 3)
+        with self.assertRaises(TypeError):
+            AsyncModelClient('example_text', 'localhost', max_chunks=3)
+
+    def test_split_host_port(self):
+        self.assertEqual(_split_host_port('localhost', '50000'), ('localhost', '50000'))
+        self.assertEqual(_split_host_port('10.0.0.1:50001', '50000'), ('10.0.0.1', '50001'))
+        self.assertEqual(_split_host_port('[::1]:50001', '50000'), ('::1', '50001'))
+        self.assertEqual(_split_host_port('::1', '50000'), ('::1', '50000'))
+
+    def test_image_to_image(self):
+        model = ModelClient('example_image_to_image', 'localhost')
+
+        im = np.zeros((200,150,3), dtype=np.uint8)
+        mask, metadata = model.run_image_to_image(im)
+        self.assertEqual(mask.shape, (200,150))
+        self.assertEqual(metadata, {'classes': ['background']})
+
+        res = model.run_image_to_image_batch([im,im,im,im])
+        self.assertEqual(len(res), 4)
+        for mask, metadata in res:
+            self.assertEqual(mask.shape, (200,150))
+            self.assertEqual(metadata, {'classes': ['background']})
+
     def test_text(self):
         model = ModelClient('example_text', 'localhost')
 
@@ -51,6 +414,13 @@ class TestModelClient(unittest.TestCase):
         res = model.run_text_batch([text,text,text,text])
         self.assertEqual(res, [f'{text}_processed']*4)
 
+    def test_text_batch_fan_out(self):
+        model = ModelClient('example_text', 'localhost', max_chunk=2)
+
+        texts = [f'text {i}' for i in range(7)]
+        res = model.run_text_batch(texts)
+        self.assertEqual(res, [f'{text}_processed' for text in texts])
+
     def test_get_input_shape(self):
         model = ModelClient('example_image', 'localhost')
         model_text = ModelClient('example_text', 'localhost')
@@ -79,6 +449,52 @@ class TestModelClient(unittest.TestCase):
 
         self.setup_class()
 
+    def test_reload_model(self):
+        model = ModelClient('example_text', 'localhost')
+        res = model.reload_model()
+        self.assertTrue(res['ok'])
+        # with MODEL_PLACEMENT, the workers that don't load the model are skipped
+        workers = [x for x in res['workers'] if x['status'] != 'not_served']
+        self.assertEqual({x['pid'] for x in workers}, {x.pid for x in model.stubs})
+        self.assertTrue(all(x['version'] == res['version'] for x in workers))
+        self.assertEqual(model.run_text('text'), 'text_processed')
+
+    def test_profile(self):
+        model = ModelClient('example_image', 'localhost')
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(model.profile, 0.5, 'cprofile', False, True)
+            im = np.zeros((200,150,3), dtype=np.uint8)
+            while not future.done():
+                model.run_image(im)
+        summary, payload = future.result()
+        # however many workers there are, each profiled one serves the model
+        self.assertTrue(len(summary['pids']) > 0)
+        self.assertTrue(set(summary['pids']) <= {x.pid for x in model.stubs})
+        self.assertTrue(len(summary['functions']) > 0)
+        self.assertTrue(summary['model_s'] > 0)
+        self.assertTrue(len(payload) > 0)
+
+    def test_load_balancers(self):
+        for balancer in [LoadBalancer.LEAST_OUTSTANDING, LoadBalancer.POWER_OF_TWO]:
+            model = ModelClient('example_text', 'localhost', balancer=balancer)
+
+            text = 'my random text'
+            for _ in range(8):
+                res = model.run_text(text)
+                self.assertEqual(res, f'{text}_processed')
+            res = model.run_text_batch([text]*8)
+            self.assertEqual(res, [f'{text}_processed']*8)
+            self.assertTrue(all(v == 0 for v in model.outstanding.values()))
+
+            res = model.get_load()
+            self.assertEqual(set(res.keys()), set(model.stubs.keys()))
+
+    def test_stats(self):
+        model = ModelClient('example_text', 'localhost')
+        stats = model.get_stats()
+        self.assertIn('example_text', stats['models'])
+        self.assertIsInstance(stats['cache'], dict)
+
     def test_health(self):
         model = ModelClient('example_image', 'localhost')
 
@@ -86,6 +502,68 @@ class TestModelClient(unittest.TestCase):
         self.assertTrue(len(res['serving'])>0)
         self.assertTrue(len(res['stopped_serving'])==0)
 
+    def test_async_image(self):
+        async def run():
+            async with await AsyncModelClient.create('example_image', 'localhost') as model:
+                im = np.zeros((200,150,3), dtype=np.uint8)
+                res = await asyncio.gather(*[model.run_image(im) for _ in range(16)])
+                self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*16)
+
+                res = await model.run_image_batch([im,im,im,im])
+                self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*4)
+
+                res = await model.get_input_shape()
+                self.assertEqual(res, [1080, 1920, 3])
+
+                res = [x async for x in model.run_image_stream([im]*10, window=2)]
+                expected = [['object1', 0.3], ['object2', 0.5]]
+                self.assertEqual(res, [(i, expected) for i in range(10)])
+
+        asyncio.run(run())
+
+    def test_async_encodes_off_the_loop(self):
+        async def run():
+            async with await AsyncModelClient.create('example_image_to_image',
+                                                     'localhost') as model:
+                threads = []
+                to_proto = utils.numpy_to_proto
+
+                def numpy_to_proto(*args, **kwargs):
+                    threads.append(threading.current_thread())
+                    return to_proto(*args, **kwargs)
+
+                im = np.zeros((200,150,3), dtype=np.uint8)
+                with mock.patch.object(utils, 'numpy_to_proto', numpy_to_proto):
+                    image, _ = await model.run_image_to_image(im)
+                    res = [x async for x in model.run_image_stream([im]*2)]
+                self.assertEqual(image.shape[:2], im.shape[:2])
+                self.assertEqual(len(res), 2)
+                self.assertEqual(len(threads), 3)
+                self.assertNotIn(threading.main_thread(), threads)
+
+        asyncio.run(run())
+
+    def test_async_text(self):
+        async def run():
+            async with await AsyncModelClient.create('example_text', 'localhost',
+                                                     max_in_flight=2) as model:
+                text = 'my random text'
+                res = await asyncio.gather(*[model.run_text(text) for _ in range(8)])
+                self.assertEqual(res, [f'{text}_processed']*8)
+
+                res = await model.run_text_batch([text,text,text,text])
+                self.assertEqual(res, [f'{text}_processed']*4)
+
+                texts = [f'text {i}' for i in range(7)]
+                model.max_chunk = 2
+                res = await model.run_text_batch(texts)
+                self.assertEqual(res, [f'{text}_processed' for text in texts])
+
+                res = await model.health_check()
+                self.assertTrue(len(res['serving'])>0)
+
+        asyncio.run(run())
+
 
 if __name__ == '__main__':
     unittest.main()
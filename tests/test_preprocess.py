@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from preprocess import Preprocessor
+
+
+class TestPreprocessor(unittest.TestCase):
+
+    def test_output_shape(self):
+        preprocessor = Preprocessor((100, 150, 3))
+        self.assertEqual(preprocessor.output_shape((200, 200, 3)), (100, 100, 3))
+        self.assertEqual(preprocessor.output_shape((200, 400, 3)), (100, 150, 3))
+        # smaller images are not enlarged
+        self.assertEqual(preprocessor.output_shape((50, 60, 3)), (50, 60, 3))
+        self.assertEqual(preprocessor.output_shape((50, 60)), (50, 60, 3))
+        self.assertEqual(preprocessor.output_shape((50, 60, 4)), (50, 60, 3))
+        self.assertEqual(preprocessor.output_shape((50, 60, 2)), (50, 60, 2))
+
+        gray = Preprocessor((100, 150))
+        self.assertEqual(gray.output_shape((200, 200, 3)), (100, 100))
+        self.assertEqual(Preprocessor((None, None, 3)).output_shape((2000, 10)), (2000, 10, 3))
+
+    def test_run(self):
+        preprocessor = Preprocessor((100, 150, 3))
+        rgb = np.random.randint(0, 255, (200, 200, 3), dtype=np.uint8)
+        rgba = np.random.randint(0, 255, (50, 60, 4), dtype=np.uint8)
+        gray = np.random.randint(0, 255, (50, 60), dtype=np.uint8)
+        gray_3d = gray[:, :, None]
+        small = np.zeros((50, 60, 3), dtype=np.uint8)
+        floats = np.zeros((300, 300), dtype=np.float32)
+        empty = np.zeros((0, 10, 3), dtype=np.uint8)
+        stack = np.zeros((2, 300, 300, 3), dtype=np.uint8)
+        images = preprocessor.run([rgb, rgba, gray, gray_3d, small, floats, b'png', empty, stack])
+
+        self.assertEqual(images[0].shape, (100, 100, 3))
+        self.assertTrue(np.array_equal(images[1], rgba[:, :, :3]))
+        self.assertTrue(np.array_equal(images[2], np.stack([gray]*3, axis=2)))
+        self.assertTrue(np.array_equal(images[3], images[2]))
+        self.assertIs(images[4], small)
+        self.assertIs(images[5], floats)
+        self.assertEqual(images[6], b'png')
+        self.assertEqual(images[7].shape, (100, 150, 3))
+        self.assertIs(images[8], stack)
+        self.assertTrue(all(x.dtype == np.uint8 for x in images if isinstance(x, np.ndarray)
+                            and x is not floats))
+
+        stats = preprocessor.stats()
+        self.assertEqual(stats['images'], 9)
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(set(stats['seconds']), {'resize', 'convert', 'total'})
+
+    def test_run_gray(self):
+        preprocessor = Preprocessor((100, 150))
+        rgb = np.random.randint(0, 255, (200, 200, 3), dtype=np.uint8)
+        rgba = np.random.randint(0, 255, (50, 60, 4), dtype=np.uint8)
+        images = preprocessor.run([rgb, rgba])
+        self.assertEqual(images[0].shape, (100, 100))
+        self.assertEqual(images[1].shape, (50, 60))
+        self.assertTrue(np.array_equal(preprocessor.run([rgba])[0],
+                                       np.asarray(Image.fromarray(rgba).convert('L'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import marshal
+import pstats
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from profiler import RequestProfiler, run_profile, merge_profiles
+
+
+def busy_function(stop):
+    while not stop.is_set():
+        np.linalg.svd(np.random.rand(64, 64))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_sampling(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_function, args=(stop,), name='busy')
+        thread.start()
+        try:
+            result = run_profile(0.3, 'sample', memory=True)
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertTrue(result['server_samples'] > 0)
+        self.assertTrue(any(x.startswith('busy;') and 'busy_function' in x
+                            for x in result['stacks']))
+        self.assertIn('memory', result)
+
+        summary, payload = merge_profiles([result, result], top=5)
+        self.assertEqual(len(summary['functions']), 5)
+        self.assertEqual(summary['server_s'], 2*result['server_samples']*result['interval_s'])
+        line = [x for x in payload.decode().splitlines() if 'busy_function' in x][0]
+        stack, count = line.rsplit(' ', 1)
+        self.assertEqual(int(count), 2*result['stacks'][stack])
+
+    def test_cprofile(self):
+        profiler = RequestProfiler()
+
+        def requests():
+            while not profiler.active:
+                time.sleep(0.001)
+            for _ in range(5):
+                with profiler.profile():
+                    np.linalg.svd(np.eye(8))
+
+        thread = threading.Thread(target=requests)
+        thread.start()
+        result = run_profile(0.2, 'cprofile', request_profiler=profiler)
+        thread.join()
+
+        stats = marshal.loads(result['pstats'])
+        self.assertTrue(any(name == 'svd' for _, _, name in stats))
+        summary, payload = merge_profiles([result, result])
+        with tempfile.NamedTemporaryFile() as dump:
+            dump.write(payload)
+            dump.flush()
+            merged = pstats.Stats(dump.name)
+        svd = [v for k,v in merged.stats.items() if k[2] == 'svd'][0]
+        self.assertEqual(svd[1], 10) # calls of both workers
+        self.assertTrue(any(x['function'].startswith('svd') for x in summary['functions']))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            run_profile(0.1, 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,24 @@
 import unittest
+from unittest import mock
 import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
 import grpc
 from grpc_testing import server_from_dictionary, strict_real_time
 from grpc_health.v1 import health_pb2, health_pb2_grpc
+from grpc_health.v1.health import HealthServicer
 
+import server
 import server_pb2
+import server_pb2_grpc
 from server import ServerServicer
+from cache import ResultCache
 import utils
 
 
@@ -84,6 +95,127 @@ class TestYourServer(unittest.TestCase):
         self.assertEqual(res, [[['object1', 0.3], ['object2', 0.5]]]*4)
         self.assertIs(code, grpc.StatusCode.OK)
 
+    def test_run_batch_tensor(self):
+        method = self.service.methods_by_name['RunBatchImage']
+        ims = [np.zeros((20,15,3), dtype=np.uint8)]*4
+        request = server_pb2.BatchImageArgs(
+            tensor=utils.numpy_list_to_batch_proto(ims), model='example_image')
+        model = self.my_server.models['example_image']['object']
+        with mock.patch.object(model, 'run_batch', wraps=model.run_batch) as run_batch:
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+            response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertEqual(json.loads(response.data), [[['object1', 0.3], ['object2', 0.5]]]*4)
+        # the model gets the whole batch as a single array
+        batch = run_batch.call_args[0][0]
+        self.assertIsInstance(batch, np.ndarray)
+        self.assertEqual(batch.shape, (4,20,15,3))
+
+        ims = [np.zeros((20,15,3), dtype=np.uint8), np.zeros((10,5), dtype=np.uint8)]
+        request = server_pb2.BatchImageArgs(
+            tensor=utils.numpy_list_to_batch_proto(ims), model='example_image')
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertEqual(json.loads(response.data), [[['object1', 0.3], ['object2', 0.5]]]*2)
+
+    def test_run_encoded_image(self):
+        im = np.zeros((200,150,3), dtype=np.uint8)
+        method = self.service.methods_by_name['RunImageToImage']
+        for encoding in ['jpeg', 'png', 'zlib']:
+            request = server_pb2.ImageArgs(
+                image=utils.numpy_to_encoded_proto(im, encoding),
+                model='example_image_to_image')
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+
+            response, _, code, _ = rpc.termination()
+            self.assertIs(code, grpc.StatusCode.OK)
+            self.assertEqual(utils.proto_to_numpy(response.image).shape, (200,150))
+
+        method = self.service.methods_by_name['RunBatchImage']
+        png = utils.numpy_to_encoded_proto(im, 'png').data
+        request = server_pb2.BatchImageArgs(
+            images=[utils.image_file_to_proto(png)]*4, model='example_image')
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data), [[['object1', 0.3], ['object2', 0.5]]]*4)
+        self.assertIs(code, grpc.StatusCode.OK)
+
+    def test_run_image_to_image(self):
+        im = np.zeros((200,150,3), dtype=np.uint8)
+        method = self.service.methods_by_name['RunImageToImage']
+        request = get_image_arg('example_image_to_image', im)
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertEqual(json.loads(response.data), {'classes': ['background']})
+        mask = utils.proto_to_numpy(response.image)
+        self.assertEqual(mask.shape, (200,150))
+        self.assertEqual(mask.dtype, np.uint8)
+
+        # models that do not return an image
+        request = get_image_arg('example_image', im)
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertTrue('error' in json.loads(response.data))
+        self.assertFalse(response.HasField('image'))
+
+    def test_run_batch_image_to_image(self):
+        images = [np.zeros((20+i,15,3), dtype=np.uint8) for i in range(4)]
+        method = self.service.methods_by_name['RunBatchImageToImage']
+        request = get_batch_image_arg('example_image_to_image', images)
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertEqual(json.loads(response.data), [{'classes': ['background']}]*4)
+        masks = utils.proto_to_numpy_list(response.images)
+        self.assertEqual([x.shape for x in masks], [(20+i,15) for i in range(4)])
+
+    def test_run_image_stream(self):
+        method = self.service.methods_by_name['RunImageStream']
+        rpc = self.server.invoke_stream_stream(method, (), None)
+        im = np.zeros((200,150,3), dtype=np.uint8)
+        for sequence_id in range(4):
+            rpc.send_request(server_pb2.StreamImageArgs(
+                sequence_id=sequence_id,
+                image=utils.numpy_to_proto(im),
+                model='example_image'))
+        rpc.send_request(server_pb2.StreamImageArgs(
+            sequence_id=4, image=utils.numpy_to_proto(im), model='missing_model'))
+        rpc.requests_closed()
+
+        for sequence_id in range(4):
+            response = rpc.take_response()
+            self.assertEqual(response.sequence_id, sequence_id)
+            self.assertEqual(utils.decode_results(response.response),
+                             [['object1', 0.3], ['object2', 0.5]])
+        response = rpc.take_response()
+        self.assertEqual(response.sequence_id, 4)
+        self.assertEqual(utils.decode_results(response.response), {'error': 'Unitialized model'})
+
+        _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+
+    def test_run_image_stream_stopped(self):
+        im = utils.numpy_to_proto(np.zeros((200,150,3), dtype=np.uint8))
+        requests = (server_pb2.StreamImageArgs(sequence_id=i, image=im, model='example_image')
+                    for i in range(20))
+        context = mock.Mock()
+        context.is_active.return_value = True
+        threads = threading.active_count()
+        responses = self.my_server.RunImageStream(requests, context)
+        self.assertEqual(next(responses).sequence_id, 0)
+        time.sleep(0.2)
+        # the client went away with the queue of decoded frames full
+        responses.close()
+        deadline = time.monotonic() + 2
+        while threading.active_count() > threads and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(threading.active_count(), threads)
+
     def test_run_text(self):
         text = 'my dummy text'
         method = self.service.methods_by_name['RunText']
@@ -108,6 +240,193 @@ class TestYourServer(unittest.TestCase):
         self.assertEqual(res, [f'{text}_processed']*4)
         self.assertIs(code, grpc.StatusCode.OK)
 
+    def test_run_text_encoding(self):
+        text = 'my dummy text'
+        method = self.service.methods_by_name['RunBatchText']
+        for encoding in [utils.JSON_ENCODING, utils.MSGPACK_ENCODING]:
+            request = server_pb2.BatchTextArgs(
+                model='example_text', texts=[text,text], encoding=encoding)
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+
+            response, _, code, _ = rpc.termination()
+            self.assertEqual(utils.decode_results(response), [f'{text}_processed']*2)
+            self.assertIs(code, grpc.StatusCode.OK)
+
+    def test_check_shared_memory(self):
+        token = b'0123456789abcdef'
+        segment = shared_memory.SharedMemory(create=True, size=len(token))
+        segment.buf[:len(token)] = token
+        method = self.service.methods_by_name['CheckSharedMemory']
+        for name, expected in [(segment.name, True), ('tms_missing_segment', False)]:
+            request = server_pb2.StringArg(data=json.dumps({'name': name, 'token': token.hex()}))
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+            response, _, code, _ = rpc.termination()
+            self.assertEqual(json.loads(response.data), {'ok': expected})
+            self.assertIs(code, grpc.StatusCode.OK)
+        segment.close()
+        segment.unlink()
+
+    def test_results_cache(self):
+        self.my_server.models['example_text']['cache'] = ResultCache()
+        text = 'my dummy text'
+        method = self.service.methods_by_name['RunText']
+        for _ in range(3):
+            request = server_pb2.TextArgs(model='example_text', text=text)
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+            response, _, code, _ = rpc.termination()
+            self.assertEqual(json.loads(response.data), text+'_processed')
+
+        method = self.service.methods_by_name['RunBatchText']
+        request = server_pb2.BatchTextArgs(model='example_text', texts=[text, 'other text'])
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data), [text+'_processed', 'other text_processed'])
+
+        method = self.service.methods_by_name['GetStats']
+        rpc = self.server.invoke_unary_unary(method, (), server_pb2.EmptyArgs(), None)
+        response, _, code, _ = rpc.termination()
+        stats = json.loads(response.data)['cache']['example_text']
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 2)
+        self.assertIs(code, grpc.StatusCode.OK)
+
+    def test_cache_stats_of_all_workers(self):
+        self.my_server.control = mock.Mock()
+        self.my_server.control.broadcast.return_value = [
+            {'example_text': {'hits': 1, 'misses': 2}},
+            {'example_text': {'hits': 3, 'misses': 0}, 'example_image': {'hits': 1, 'misses': 1}},
+            None, {'error': 'failed'}]
+        method = self.service.methods_by_name['GetStats']
+        rpc = self.server.invoke_unary_unary(method, (), server_pb2.EmptyArgs(), None)
+        response, _, _, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data)['cache'], {
+            'example_text': {'hits': 4, 'misses': 2},
+            'example_image': {'hits': 1, 'misses': 1}})
+        self.my_server.control.broadcast.assert_called_with('cache_stats', {}, mock.ANY)
+
+    def test_results_cache_bad_batch(self):
+        entry = self.my_server.models['example_text']
+        entry['cache'] = ResultCache()
+        method = self.service.methods_by_name['RunBatchText']
+        request = server_pb2.BatchTextArgs(model='example_text', texts=['a', 'b'])
+        for computed in [{'error': 'failed'}, ['a_processed'], 'ab']:
+            with mock.patch.object(entry['object'], 'run_batch', return_value=computed):
+                rpc = self.server.invoke_unary_unary(method, (), request, None)
+                response, _, _, _ = rpc.termination()
+            results = json.loads(response.data)
+            self.assertEqual(len(results), 2)
+            self.assertTrue(all('error' in x for x in results))
+        self.assertEqual(entry['cache'].stats()['entries'], 0)
+
+    def test_results_cache_batch_tensor(self):
+        entry = self.my_server.models['example_image']
+        entry['cache'] = ResultCache()
+        method = self.service.methods_by_name['RunBatchImage']
+        ims = [np.full((20,15,3), i, dtype=np.uint8) for i in range(4)]
+        model = entry['object']
+        with mock.patch.object(model, 'run_batch', wraps=model.run_batch) as run_batch:
+            for batch in [ims[:2], ims]:
+                request = server_pb2.BatchImageArgs(
+                    tensor=utils.numpy_list_to_batch_proto(batch), model='example_image')
+                rpc = self.server.invoke_unary_unary(method, (), request, None)
+                response, _, code, _ = rpc.termination()
+                self.assertIs(code, grpc.StatusCode.OK)
+                self.assertEqual(len(json.loads(response.data)), len(batch))
+        # the model gets the misses as a single array too
+        batch = run_batch.call_args[0][0]
+        self.assertIsInstance(batch, np.ndarray)
+        np.testing.assert_array_equal(batch, np.stack(ims[2:]))
+
+    def test_metrics(self):
+        method = self.service.methods_by_name['RunText']
+        for model in ['example_text', 'example_text', 'missing']:
+            request = server_pb2.TextArgs(model=model, text='text')
+            rpc = self.server.invoke_unary_unary(method, (), request, None)
+            rpc.termination()
+
+        im = np.zeros((20,30,3), dtype=np.uint8)
+        method = self.service.methods_by_name['RunBatchImage']
+        request = get_batch_image_arg('example_image', [im]*3)
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        rpc.termination()
+
+        method = self.service.methods_by_name['GetMetrics']
+        rpc = self.server.invoke_unary_unary(method, (), server_pb2.StringArg(), None)
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        metrics = json.loads(response.data)
+        counters = {(name, labels['model'], labels['rpc']): value
+                    for name, labels, value in metrics['counters']}
+        self.assertEqual(counters[('tms_requests_total', 'example_text', 'RunText')], 2)
+        self.assertEqual(counters[('tms_requests_total', 'unknown', 'RunText')], 1)
+        self.assertEqual(counters[('tms_errors_total', 'unknown', 'RunText')], 1)
+        self.assertEqual(counters[('tms_requests_total', 'example_image', 'RunBatchImage')], 1)
+
+        stages = {labels['stage'] for name, labels, _ in metrics['histograms']
+                  if name == 'tms_stage_seconds' and labels['rpc'] == 'RunBatchImage'}
+        self.assertEqual(stages, {'wait', 'decode', 'run', 'encode'})
+
+        request = server_pb2.StringArg(data='prometheus')
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertIn('tms_batch_size_bucket{le="4",model="example_image",rpc="RunBatchImage"} 1',
+                      response.data)
+
+    def test_profile(self):
+        method = self.service.methods_by_name['Profile']
+        request = server_pb2.StringArg(data=json.dumps({'seconds': 0.1, 'memory': True}))
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        summary = json.loads(response.data)
+        self.assertEqual(summary['mode'], 'sample')
+        self.assertEqual(summary['pids'], [os.getpid()])
+        self.assertIn(str(os.getpid()), summary['memory'])
+
+        request = server_pb2.StringArg(data=json.dumps({'seconds': -1}))
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+        response, _, code, _ = rpc.termination()
+        self.assertIn('error', json.loads(response.data))
+
+    def test_profile_keeps_serving(self):
+        servicer = ServerServicer(['example_text'])
+        with mock.patch.object(server, 'NUM_THREADS_PER_WORKER', 1):
+            grpc_server = server._create_server(  # pylint: disable=protected-access
+                servicer, HealthServicer(), '127.0.0.1:0')
+        port = grpc_server.add_insecure_port('127.0.0.1:0')
+        grpc_server.start()
+        self.addCleanup(grpc_server.stop, None)
+
+        with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+            stub = server_pb2_grpc.ServerStub(channel)
+            profile = stub.Profile.future(server_pb2.StringArg(data=json.dumps({'seconds': 2})))
+            time.sleep(0.2)
+            begin = time.monotonic()
+            stub.RunText(server_pb2.TextArgs(text='text', model='example_text'), timeout=1)
+            self.assertLess(time.monotonic()-begin, 1)
+            self.assertNotIn('error', json.loads(profile.result().data))
+
+    def test_load_report(self):
+        text = 'my dummy text'
+        method = self.service.methods_by_name['RunText']
+        request = server_pb2.TextArgs(model='example_text', text=text)
+        rpc = self.server.invoke_unary_unary(method, (), request, None)
+
+        _, trailing_metadata, code, _ = rpc.termination()
+        self.assertIs(code, grpc.StatusCode.OK)
+        load = json.loads(dict(trailing_metadata)['tms-load'])
+        self.assertEqual(load['in_flight'], 0)
+        self.assertEqual(load['queued'], {})
+        self.assertTrue(load['p50_latency_ms'] >= 0)
+
+        method = self.service.methods_by_name['GetLoad']
+        rpc = self.server.invoke_unary_unary(method, (), server_pb2.EmptyArgs(), None)
+        response, _, code, _ = rpc.termination()
+        res = json.loads(response.data)
+        self.assertIs(code, grpc.StatusCode.OK)
+        self.assertEqual(set(res.keys()), {'pid', 'in_flight', 'queued', 'p50_latency_ms'})
+
     def test_get_input_shape(self):
         method = self.service.methods_by_name['GetInputShape']
         request = server_pb2.StringArg(data='example_image')
@@ -142,5 +461,358 @@ class TestYourServer(unittest.TestCase):
         res = json.loads(response.data)
         self.assertEqual(res, {'stopping': True})
 
+class TestModelPlacement(unittest.TestCase):
+    def test_model_placement(self):
+        models = ['detector', 'classifier', 'text']
+        workers = server.model_placement(models, 4, {'detector': 2, 'classifier': 1, 'missing': 1})
+        self.assertEqual(workers, [['detector', 'text'], ['detector', 'text'],
+                                   ['classifier', 'text'], ['text']])
+
+        workers = server.model_placement(models, 2, {'detector': 4, 'text': 0})
+        self.assertEqual(workers, [['detector', 'classifier'], ['detector', 'classifier']])
+
+    def test_model_placement_always_on(self):
+        # only 2 of the 4 workers are always running, b needs one of them too
+        workers = server.model_placement(['a', 'b', 'c'], 4, {'a': 2, 'b': 2}, always_on=2)
+        self.assertEqual(workers, [['a', 'b', 'c'], ['a', 'c'], ['b', 'c'], ['c']])
+        for model in ['a', 'b', 'c']:
+            self.assertTrue(any(model in x for x in workers[:2]), model)
+
+        supervisor = mock.Mock(max_workers=4, min_workers=2)
+        supervisor.active_slots.return_value = [0, 1]
+        servicer = ServerServicer(['example_text'])
+        service = server_pb2.DESCRIPTOR.services_by_name['Server']
+        test_server = server_from_dictionary({service: servicer}, strict_real_time())
+        placement = {'example_image': 2, 'example_text': 2}
+        with mock.patch.object(server, '_supervisor', supervisor), \
+                mock.patch.object(server, 'MODEL_PLACEMENT', placement):
+            for model in placement:
+                rpc = test_server.invoke_unary_unary(
+                    service.methods_by_name['GetNumParallelWorkers'], (),
+                    server_pb2.StringArg(data=model), None)
+                response, _, _, _ = rpc.termination()
+                self.assertGreaterEqual(json.loads(response.data)['model_workers'], 1, model)
+
+    def test_worker_loads_its_models(self):
+        servicer = ServerServicer(['example_text'])
+        self.assertEqual(list(servicer.models), ['example_text'])
+        self.assertEqual(servicer._run_image_model(  # pylint: disable=protected-access
+            get_image_arg('example_image', np.zeros((20,20,3), dtype=np.uint8))),
+            {'error': 'Unitialized model'})
+
+        service = server_pb2.DESCRIPTOR.services_by_name['Server']
+        test_server = server_from_dictionary({service: servicer}, strict_real_time())
+        rpc = test_server.invoke_unary_unary(
+            service.methods_by_name['GetPID'], (), server_pb2.StringArg(data='example_text'), None)
+        response, _, _, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data)['models'], ['example_text'])
+
+        with mock.patch.object(server, 'NUM_PARALLEL_WORKERS', 3), \
+                mock.patch.object(server, 'MODEL_PLACEMENT', {'example_image': 2}):
+            rpc = test_server.invoke_unary_unary(
+                service.methods_by_name['GetNumParallelWorkers'], (),
+                server_pb2.StringArg(data='example_image'), None)
+            response, _, _, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data), {'num_workers': 3, 'model_workers': 2})
+
+        # with a supervisor, only the slots that have a worker count
+        supervisor = mock.Mock(max_workers=3, min_workers=1)
+        supervisor.active_slots.return_value = [0, 2]
+        with mock.patch.object(server, '_supervisor', supervisor), \
+                mock.patch.object(server, 'MODEL_PLACEMENT', {'example_image': 2}):
+            rpc = test_server.invoke_unary_unary(
+                service.methods_by_name['GetNumParallelWorkers'], (),
+                server_pb2.StringArg(data='example_image'), None)
+            response, _, _, _ = rpc.termination()
+        self.assertEqual(json.loads(response.data), {'num_workers': 2, 'model_workers': 1})
+
+    def test_topology(self):
+        servicer = ServerServicer(['example_text'])
+        service = server_pb2.DESCRIPTOR.services_by_name['Server']
+        test_server = server_from_dictionary({service: servicer}, strict_real_time())
+
+        def get_topology():
+            rpc = test_server.invoke_unary_unary(
+                service.methods_by_name['GetTopology'], (), server_pb2.EmptyArgs(), None)
+            response, _, _, _ = rpc.termination()
+            return json.loads(response.data)
+
+        worker = {'pid': os.getpid(), 'port': None, 'models': ['example_text'], 'ready': False}
+        self.assertEqual(get_topology(), {'server_id': server.SERVER_ID, 'num_workers': 1,
+                                          'features': ['batch_tensor'], 'workers': [worker]})
+        servicer.port, servicer.serving = 50001, True
+        self.assertEqual(get_topology()['workers'], [{**worker, 'port': 50001, 'ready': True}])
+
+        # the workers that don't answer are left out
+        servicer.control = mock.Mock()
+        servicer.control.broadcast.return_value = [worker, None, {'error': 'failed'}]
+        supervisor = mock.Mock()
+        supervisor.active_slots.return_value = [0, 1, 2]
+        with mock.patch.object(server, '_supervisor', supervisor):
+            self.assertEqual(get_topology()['workers'], [worker])
+            self.assertEqual(get_topology()['num_workers'], 3)
+
+    def test_taken_ports(self):
+        # another server listening with SO_REUSEPORT, as gRPC does
+        taken = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        taken.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        taken.bind(('', 0))
+        taken.listen()
+        port = taken.getsockname()[1]
+        try:
+            self.assertFalse(server._port_is_free(port))
+            with self.assertRaises(RuntimeError):
+                with server._reserve_port(port):
+                    pass
+            ports = server._worker_ports(port-1, 2)
+            self.assertEqual(ports[1], 0)
+        finally:
+            taken.close()
+        self.assertTrue(server._port_is_free(port))
+
+    def test_worker_load(self):
+        servicer = ServerServicer(['example_text'])
+        servicer.executor = ThreadPoolExecutor(max_workers=2)
+        with servicer.load.track():
+            load = servicer._run_control_command('load', {})  # pylint: disable=protected-access
+        self.assertEqual((load['in_flight'], load['waiting'], load['threads'], load['requests']),
+                         (1, 0, 2, 1))
+        servicer.executor.shutdown()
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.servicer = ServerServicer(['example_text'])
+        self.service = server_pb2.DESCRIPTOR.services_by_name['Server']
+        self.server = server_from_dictionary({self.service: self.servicer}, strict_real_time())
+
+    def run_text(self, metadata=(), timeout=None):
+        rpc = self.server.invoke_unary_unary(
+            self.service.methods_by_name['RunText'], metadata,
+            server_pb2.TextArgs(text='text', model='example_text'), timeout)
+        _, _, code, details = rpc.termination()
+        return code, details
+
+    def test_overload(self):
+        self.servicer.admission.max_in_flight = 2
+        self.servicer.load.in_flight = 1
+        self.assertEqual(self.run_text()[0], grpc.StatusCode.OK)
+        # bulk requests are shed first
+        code, details = self.run_text(metadata=(('tms-priority', 'bulk'),))
+        self.assertEqual(code, grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertIn('overloaded', details)
+        self.servicer.load.in_flight = 2
+        self.assertEqual(self.run_text()[0], grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+        rejected = [x for x in self.servicer.metrics_snapshot()['counters']
+                    if x[0] == 'tms_rejected_total']
+        self.assertEqual(rejected, [['tms_rejected_total', {
+            'code': 'RESOURCE_EXHAUSTED', 'model': 'example_text', 'rpc': 'RunText'}, 2]])
+
+    def test_deadline_too_short(self):
+        self.assertEqual(self.run_text(timeout=5)[0], grpc.StatusCode.OK)
+        self.servicer.admission.observe('example_text', 100)
+        with mock.patch.object(self.servicer.models['example_text']['object'], 'run') as run:
+            code, details = self.run_text(timeout=5)
+            run.assert_not_called()
+        self.assertEqual(code, grpc.StatusCode.DEADLINE_EXCEEDED)
+        self.assertIn('Not enough time', details)
+        self.assertEqual(self.run_text()[0], grpc.StatusCode.OK)
+
+    def test_deadline_waiting_for_image_model(self):
+        servicer = ServerServicer(['example_image', 'example_image_to_image'])
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        for method, request in [
+                ('RunImage', get_image_arg('example_image', image)),
+                ('RunBatchImage', get_batch_image_arg('example_image', [image])),
+                ('RunImageToImage', get_image_arg('example_image_to_image', image)),
+                ('RunBatchImageToImage', get_batch_image_arg('example_image_to_image', [image]))]:
+            # the model stays busy for longer than the request deadline
+            semaphore = servicer.models[request.model]['semaphore']
+            busy = 0
+            while semaphore.acquire(blocking=False):
+                busy += 1
+            context = mock.Mock(abort=mock.Mock(side_effect=grpc.RpcError()))
+            context.time_remaining.return_value = 0.1
+            context.invocation_metadata.return_value = ()
+            with self.assertRaises(grpc.RpcError, msg=method):
+                getattr(servicer, method)(request, context)
+            for _ in range(busy):
+                semaphore.release()
+            code, details = context.abort.call_args[0]
+            self.assertEqual(code, grpc.StatusCode.DEADLINE_EXCEEDED)
+            self.assertIn('waiting for', details)
+
+    def test_waiting_for_a_rejected_request(self):
+        entry = self.servicer.models['example_text']
+        entry['cache'] = ResultCache()
+        request = server_pb2.TextArgs(text='text', model='example_text')
+
+        def context(remaining_s):
+            context = mock.Mock(abort=mock.Mock(side_effect=grpc.RpcError()))
+            context.time_remaining.return_value = remaining_s
+            context.invocation_metadata.return_value = ()
+            return context
+
+        # the first request times out waiting for the model, and the identical
+        # one waiting for its result runs the model within its own deadline
+        while entry['semaphore'].acquire(blocking=False):
+            pass
+        short, long = context(0.3), context(10)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.servicer.RunText, request, short)
+            time.sleep(0.1)
+            second = executor.submit(self.servicer.RunText, request, long)
+            with self.assertRaises(grpc.RpcError):
+                first.result()
+            entry['semaphore'].release()
+            response = second.result()
+        self.assertEqual(short.abort.call_args[0][0], grpc.StatusCode.DEADLINE_EXCEEDED)
+        long.abort.assert_not_called()
+        self.assertEqual(json.loads(response.data), 'text_processed')
+
+    def test_overload_single_thread_worker(self):
+        servicer = ServerServicer(['bench_sleep'])
+        servicer.admission.max_in_flight = 2
+        with mock.patch.object(server, 'NUM_THREADS_PER_WORKER', 1), \
+                mock.patch.object(server, 'MAX_IN_FLIGHT_PER_WORKER', 2):
+            grpc_server = server._create_server(  # pylint: disable=protected-access
+                servicer, HealthServicer(), '127.0.0.1:0')
+        port = grpc_server.add_insecure_port('127.0.0.1:0')
+        grpc_server.start()
+        self.addCleanup(grpc_server.stop, None)
+
+        # more requests than threads, the ones beyond the limit are rejected
+        with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+            stub = server_pb2_grpc.ServerStub(channel)
+            request = server_pb2.TextArgs(text='text', model='bench_sleep',
+                                          args=json.dumps({'ms': 200}))
+            calls = [stub.RunText.future(request) for _ in range(8)]
+            codes = []
+            for call in calls:
+                try:
+                    call.result()
+                    codes.append(grpc.StatusCode.OK)
+                except grpc.RpcError as e:
+                    codes.append(e.code())
+        self.assertGreaterEqual(codes.count(grpc.StatusCode.OK), 1)
+        self.assertGreaterEqual(codes.count(grpc.StatusCode.RESOURCE_EXHAUSTED), 4)
+
+
+class TestReloadModel(unittest.TestCase):
+    def setUp(self):
+        self.servicer = ServerServicer()
+        self.service = server_pb2.DESCRIPTOR.services_by_name['Server']
+        self.server = server_from_dictionary({self.service: self.servicer}, strict_real_time())
+
+    def reload(self, model):
+        rpc = self.server.invoke_unary_unary(
+            self.service.methods_by_name['ReloadModel'], (), server_pb2.StringArg(data=model), None)
+        response, _, _, _ = rpc.termination()
+        return json.loads(response.data)
+
+    def test_reload(self):
+        old = self.servicer.models['example_text']
+        res = self.reload('example_text')
+        self.assertTrue(res['ok'])
+        self.assertEqual(res['workers'], [{'pid': os.getpid(), 'status': 'reloaded',
+                                           'version': res['version'], 'drained': True}])
+        self.assertIsNot(self.servicer.models['example_text'], old)
+
+        res = self.reload('missing')
+        self.assertEqual(res['workers'][0]['status'], 'not_served')
+
+    def test_drains_running_requests(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.servicer._loaded('example_text') as old:  # pylint: disable=protected-access
+                future = executor.submit(self.reload, 'example_text')
+                time.sleep(0.1)
+                # new requests already run on the new version
+                self.assertFalse(future.done())
+                self.assertIsNot(self.servicer.models['example_text'], old)
+                self.assertEqual(self.servicer._run_text_model(  # pylint: disable=protected-access
+                    server_pb2.TextArgs(model='example_text', text='text')), 'text_processed')
+            self.assertTrue(future.result()['ok'])
+        self.assertEqual(old['in_use'], 0)
+
+
+class TestLazyLoading(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(server, 'LAZY_LOAD_MODELS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.servicer = ServerServicer()
+
+    def run_text(self, text='text'):
+        return self.servicer._run_text_model(  # pylint: disable=protected-access
+            server_pb2.TextArgs(model='example_text', text=text))
+
+    def test_loads_on_first_request(self):
+        self.assertEqual(self.servicer.models, {})
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(self.run_text, ['a', 'b', 'c', 'd']))
+        self.assertEqual(results, ['a_processed', 'b_processed', 'c_processed', 'd_processed'])
+        self.assertEqual(list(self.servicer.models), ['example_text'])
+
+        stats = self.servicer._stats()['models']  # pylint: disable=protected-access
+        self.assertEqual(stats['example_text']['loads'], 1)
+        self.assertTrue(stats['example_text']['loaded'])
+        self.assertIsNotNone(stats['example_text']['load_ms'])
+
+        self.assertEqual(self.servicer._run_text_model(  # pylint: disable=protected-access
+            server_pb2.TextArgs(model='missing', text='text')), {'error': 'Unitialized model'})
+
+    def test_memory_budget(self):
+        self.run_text()
+        self.servicer.models['example_text']['memory_mb'] = 100
+        with mock.patch.object(server, 'MODEL_MEMORY_BUDGET_MB', 50):
+            self.servicer._run_image_model(  # pylint: disable=protected-access
+                get_image_arg('example_image', np.zeros((20,20,3), dtype=np.uint8)))
+        self.assertEqual(list(self.servicer.models), ['example_image'])
+
+        stats = self.servicer._stats()['models']  # pylint: disable=protected-access
+        self.assertEqual(stats['example_text']['evictions'], 1)
+        self.assertFalse(stats['example_text']['loaded'])
+
+        # loaded again on its next request
+        self.assertEqual(self.run_text(), 'text_processed')
+        stats = self.servicer._stats()['models']  # pylint: disable=protected-access
+        self.assertEqual(stats['example_text']['loads'], 2)
+
+    def test_idle_timeout(self):
+        self.run_text()
+        with mock.patch.object(server, 'MODEL_IDLE_TIMEOUT_S', 0.01):
+            with self.servicer._loaded('example_text'):  # pylint: disable=protected-access
+                time.sleep(0.05)
+                self.servicer._evict_models()  # pylint: disable=protected-access
+                self.assertIn('example_text', self.servicer.models)
+            time.sleep(0.05)
+            self.servicer._evict_models()  # pylint: disable=protected-access
+        self.assertEqual(self.servicer.models, {})
+
+
+class TestPreloadModels(unittest.TestCase):
+    def tearDown(self):
+        server._preloaded_models.clear()  # pylint: disable=protected-access
+
+    def test_workers_use_preloaded_models(self):
+        preloaded = server.preload_models()
+        self.assertEqual(set(preloaded), set(os.listdir('./models/')))
+
+        servicer = ServerServicer()
+        for model, obj in preloaded.items():
+            self.assertIs(servicer.models[model]['object'], obj)
+        self.assertEqual(servicer._run_text_model(  # pylint: disable=protected-access
+            server_pb2.TextArgs(model='example_text', text='text')), 'text_processed')
+
+    def test_fork_unsafe_models_are_not_preloaded(self):
+        model_class = server._import_model('example_text').Model  # pylint: disable=protected-access
+        module = mock.Mock(Model=model_class)
+        with mock.patch.object(model_class, 'is_fork_safe', return_value=False), \
+                mock.patch.object(server, '_import_model', return_value=module):
+            preloaded = server.preload_models()
+        self.assertEqual(preloaded, {})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+import functools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import unittest
+
+from control import ControlChannel
+from supervisor import Supervisor, SupervisorSettings, resident_memory_mb
+
+
+def run_worker(control, depth, recycle_pid, crashes, slot):
+    # the second worker crashes once on startup
+    if slot == 1 and crashes.value == 0:
+        crashes.value += 1
+        os._exit(3)  # pylint: disable=protected-access
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    def load(_command, _args):
+        requests = 1000 if os.getpid() == recycle_pid.value else 0
+        return {'pid': os.getpid(), 'in_flight': depth.value, 'waiting': 0,
+                'threads': 1, 'requests': requests}
+    control.listen(load, on_close=stopping.set)
+    control.ready_to_serve()
+    stopping.wait()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.02)
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.control = ControlChannel()
+        self.depth = multiprocessing.Value('d', 0.5)
+        self.recycle_pid = multiprocessing.Value('i', 0)
+        self.crashes = multiprocessing.Value('i', 0)
+        self.supervisor = Supervisor(
+            functools.partial(run_worker, self.control, self.depth, self.recycle_pid,
+                              self.crashes),
+            self.control, num_workers=2,
+            settings=SupervisorSettings(min_workers=1, max_workers=3, max_requests=100,
+                                        interval_s=0.05, scale_window=3, backoff_s=0.1,
+                                        stop_timeout_s=5))
+        self.thread = threading.Thread(target=self.supervisor.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.supervisor.stop()
+        self.thread.join()
+
+    def pids(self):
+        return {slot: x.pid for slot, x in list(self.supervisor.processes.items())}
+
+    def wait_for_start(self):
+        # the slots are active before the second worker crashes, so this
+        # waits for its replacement to be ready too
+        wait_for(lambda: self.supervisor.crashes[1] == 1
+                 and self.supervisor.active_slots() == [0, 1]
+                 and set(self.pids().values()) <= self.control.ready)
+
+    def test_restart_and_stop(self):
+        self.wait_for_start()
+        self.assertEqual(self.crashes.value, 1)
+        self.assertEqual(self.supervisor.crashes[1], 1)
+        processes = list(self.supervisor.processes.values())
+
+        self.supervisor.stop()
+        self.thread.join()
+        self.assertFalse(any(x.is_alive() for x in processes))
+        self.assertEqual(self.supervisor.active_slots(), [])
+
+    def test_scaling(self):
+        self.wait_for_start()
+        self.depth.value = 3
+        wait_for(lambda: self.supervisor.active_slots() == [0, 1, 2])
+        self.depth.value = 0
+        wait_for(lambda: self.supervisor.active_slots() == [0])
+        self.depth.value = 0.5
+        time.sleep(0.5)
+        self.assertEqual(self.supervisor.active_slots(), [0])
+
+    def test_recycling(self):
+        self.wait_for_start()
+        old = self.supervisor.processes[0]
+        self.recycle_pid.value = old.pid
+        wait_for(lambda: self.pids().get(0) not in (None, old.pid) and not old.is_alive()
+                 and old.pid not in self.control.workers)
+        self.assertEqual(self.supervisor.active_slots(), [0, 1])
+        # a replaced worker isn't a crash
+        self.assertEqual(self.supervisor.crashes[0], 0)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            Supervisor(None, ControlChannel(), 2, SupervisorSettings(min_workers=3, max_workers=2))
+
+    def test_resident_memory(self):
+        self.assertGreater(resident_memory_mb(), 0)
+        self.assertEqual(resident_memory_mb(-1), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
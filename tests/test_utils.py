@@ -1,7 +1,9 @@
 import unittest
+import json
 
 import numpy as np
 
+import shm
 import utils
 import server_pb2
 
@@ -26,23 +28,64 @@ class TestUtils(unittest.TestCase):
 
 
     def test_numpy_to_proto_invalid_dtype(self):
-        mat = np.zeros((300,400,3), dtype=np.int32)
+        mat = np.zeros((300,400,3), dtype='U4')
         with self.assertRaises(KeyError):
             _ = utils.numpy_to_proto(mat)
 
 
     def test_proto_to_numpy_invalid_dtype(self):
-        mat = np.zeros((300,400,3), dtype=np.int32)
+        mat = np.zeros((300,400,3), dtype='U4')
         proto_mat = server_pb2.NumpyImage(
             height=mat.shape[0],
             width=mat.shape[1],
             channels=(1 if len(mat.shape)==2 else mat.shape[2]),
             data=mat.tobytes(),
-            dtype='int32'
+            dtype='object'
         )
         with self.assertRaises(KeyError):
             _ = utils.proto_to_numpy(proto_mat)
 
+    def test_numpy_to_proto_any_shape_and_dtype(self):
+        dtypes = [np.bool_, np.int8, np.int16, np.int32, np.int64, np.uint16, np.uint32,
+                  np.uint64, np.float16, np.complex64, np.dtype('>i4'), np.dtype('>f8')]
+        for dtype in dtypes:
+            for shape in [(7,), (200,300,1), (2,3,4,5), (0,3)]:
+                mat = (np.random.rand(*shape)*100).astype(dtype)
+                proto_mat = utils.numpy_to_proto(mat)
+                self.assertEqual(list(proto_mat.shape), list(shape))
+                self.assertEqual(proto_mat.dtype, np.dtype(dtype).str)
+                mat_from_proto = utils.proto_to_numpy(proto_mat)
+                self.assertEqual(mat_from_proto.dtype, dtype)
+                self.assertEqual(mat_from_proto.shape, shape)
+                self.assertTrue(np.array_equal(mat, mat_from_proto))
+
+        # the dtypes of older versions keep their names, and so are readable by them
+        self.assertEqual(utils.numpy_to_proto(np.zeros((2,3), dtype=np.float32)).dtype, 'float32')
+        self.assertEqual(utils.str_to_dtype('int16'), np.int16)
+        with self.assertRaises(ValueError):
+            utils.numpy_to_proto(np.array(1))
+
+    def test_numpy_to_proto_non_contiguous(self):
+        mat = np.random.rand(20,30,3)[:, ::2]
+        self.assertFalse(mat.flags.c_contiguous)
+        for encoding in ['', 'zlib']:
+            proto_mat = utils.numpy_to_proto(mat) if encoding == '' \
+                else utils.numpy_to_encoded_proto(mat, encoding)
+            self.assertTrue(np.array_equal(utils.proto_to_numpy(proto_mat), mat))
+
+    def test_proto_to_numpy_old_messages(self):
+        # from clients that only set height, width and channels
+        mat = np.random.rand(20,30,3).astype(np.float32)
+        proto_mat = server_pb2.NumpyImage(height=20, width=30, channels=3,
+                                          data=mat.tobytes(), dtype='float32')
+        self.assertTrue(np.array_equal(utils.proto_to_numpy(proto_mat), mat))
+        proto_mat = server_pb2.NumpyImage(height=20, width=90, channels=1,
+                                          data=mat.tobytes(), dtype='float32')
+        self.assertEqual(utils.proto_to_numpy(proto_mat).shape, (20,90))
+        # and new messages still set them for 2-D and 3-D arrays
+        proto_mat = utils.numpy_to_proto(mat)
+        self.assertEqual((proto_mat.height, proto_mat.width, proto_mat.channels), (20,30,3))
+
     def test_numpy_to_proto_list_and_back(self):
         valid_dtypes = [np.uint8, np.float32, np.float64]
         dtypes_str_name = ['uint8', 'float32', 'float64']
@@ -64,7 +107,7 @@ class TestUtils(unittest.TestCase):
 
                     
     def test_numpy_list_to_proto_invalid_dtype(self):
-        mat = np.zeros((300,400,3), dtype=np.int32)
+        mat = np.zeros((300,400,3), dtype='U4')
         with self.assertRaises(KeyError):
             _ = utils.numpy_list_to_proto([mat,mat,mat])
 
@@ -73,9 +116,189 @@ class TestUtils(unittest.TestCase):
         mat = np.zeros((300,400,3), dtype=np.float32)
         proto_mat = utils.numpy_list_to_proto([mat,mat,mat])
         for idx, _ in enumerate(proto_mat):
-            proto_mat[idx].dtype='int32'
+            proto_mat[idx].dtype='object'
         with self.assertRaises(KeyError):
             _ = utils.proto_to_numpy_list(proto_mat)
 
+    def test_numpy_to_shared_memory_and_back(self):
+        pool = shm.SharedMemoryPool()
+        try:
+            for dtype in [np.uint8, np.float32, np.float64, np.int16, np.float16]:
+                mat_list = [np.random.rand(*shape).astype(dtype)
+                            for shape in [(20,30), (21,31,3), (5,7,3), (2,3,4,5)]]
+                with pool.lease() as lease:
+                    proto_mat_list = utils.numpy_list_to_proto(mat_list, lease)
+                    self.assertEqual(len({x.shm_name for x in proto_mat_list}), 1)
+                    for mat, proto_mat in zip(mat_list, proto_mat_list):
+                        self.assertEqual(proto_mat.data, b'')
+                        self.assertEqual(proto_mat.shm_offset % shm.ALIGNMENT, 0)
+                        mat_from_proto = utils.proto_to_numpy(proto_mat)
+                        self.assertTrue(np.array_equal(mat, mat_from_proto))
+                        self.assertFalse(mat_from_proto.flags.writeable)
+                        del mat_from_proto
+
+            # the segment was given back and is reused
+            self.assertEqual(len(pool.idle), 1)
+            with pool.lease() as lease:
+                proto_mat = utils.numpy_to_proto(np.ones((10,10), dtype=np.uint8), lease)
+                self.assertEqual(proto_mat.shm_name, proto_mat_list[0].shm_name)
+                self.assertTrue(np.array_equal(utils.proto_to_numpy(proto_mat), np.ones((10,10))))
+        finally:
+            pool.close()
+
+    def test_numpy_to_shared_memory_invalid_dtype(self):
+        pool = shm.SharedMemoryPool()
+        mat = np.zeros((30,40,3), dtype='U4')
+        with pool.lease() as lease:
+            with self.assertRaises(KeyError):
+                _ = utils.numpy_to_proto(mat, lease)
+            with self.assertRaises(KeyError):
+                _ = utils.numpy_list_to_proto([mat,mat], lease)
+        pool.close()
+
+    def test_numpy_list_to_batch_proto_and_back(self):
+        for dtype in [np.uint8, np.float32, np.float64]:
+            mat_list = [np.random.rand(20,30,3).astype(dtype) for _ in range(4)]
+            proto = utils.numpy_list_to_batch_proto(mat_list)
+            self.assertEqual(list(proto.shape), [4,20,30,3])
+            self.assertEqual(len(proto.item_shapes), 0)
+            self.assertEqual(utils.batch_proto_len(proto), 4)
+            batch = utils.batch_proto_to_numpy(proto)
+            self.assertIsInstance(batch, np.ndarray)
+            self.assertEqual(batch.dtype, dtype)
+            self.assertTrue(np.array_equal(batch, np.stack(mat_list)))
+
+        # ragged batch, including a non contiguous image
+        mat_list = [np.random.rand(20,30,3), np.random.rand(5,7), np.random.rand(30,20,3)[:,::2]]
+        proto = utils.numpy_list_to_batch_proto(mat_list)
+        self.assertEqual(len(proto.shape), 0)
+        self.assertEqual(utils.batch_proto_len(proto), 3)
+        mat_from_proto_list = utils.batch_proto_to_numpy(proto)
+        for mat, mat_from_proto in zip(mat_list, mat_from_proto_list):
+            self.assertTrue(np.array_equal(mat, mat_from_proto))
+
+        # single channel images keep their channel
+        mat_list = [np.random.rand(20,30,1), np.random.rand(5,7), np.random.rand(8,8,1)]
+        mat_from_proto_list = utils.batch_proto_to_numpy(utils.numpy_list_to_batch_proto(mat_list))
+        self.assertEqual([x.shape for x in mat_from_proto_list], [x.shape for x in mat_list])
+        for mat, mat_from_proto in zip(mat_list, mat_from_proto_list):
+            self.assertTrue(np.array_equal(mat, mat_from_proto))
+
+    def test_is_batch_tensor(self):
+        mat = np.zeros((20,30,3), dtype=np.uint8)
+        self.assertTrue(utils.is_batch_tensor([mat, mat]))
+        self.assertTrue(utils.is_batch_tensor([mat, np.zeros((5,5), dtype=np.uint8)]))
+        self.assertTrue(utils.is_batch_tensor([np.zeros((2,3,4,5), dtype=np.float32)]*2))
+        self.assertFalse(utils.is_batch_tensor([]))
+        self.assertFalse(utils.is_batch_tensor([mat, b'\x89PNG']))
+        self.assertFalse(utils.is_batch_tensor([mat, mat.astype(np.float32)]))
+        self.assertFalse(utils.is_batch_tensor([mat.astype('U4')]))
+        self.assertFalse(utils.is_batch_tensor([np.zeros((2,3,4,5)), np.zeros((2,3,4,6))]))
+
+    def test_batch_proto_to_numpy_invalid_dtype(self):
+        proto = utils.numpy_list_to_batch_proto([np.zeros((3,4,3), dtype=np.float32)])
+        proto.dtype = 'object'
+        with self.assertRaises(KeyError):
+            _ = utils.batch_proto_to_numpy(proto)
+
+    def test_numpy_list_to_batch_shared_memory_and_back(self):
+        pool = shm.SharedMemoryPool()
+        try:
+            for mat_list in ([np.random.rand(20,30,3).astype(np.float32)]*3,
+                             [np.random.rand(20,30,3), np.random.rand(5,7)]):
+                with pool.lease() as lease:
+                    proto = utils.numpy_list_to_batch_proto(mat_list, lease)
+                    self.assertEqual(proto.data, b'')
+                    self.assertTrue(proto.shm_name)
+                    batch = utils.batch_proto_to_numpy(proto)
+                    # the views of the segment go before the lease gives it back
+                    for mat, mat_from_proto in zip(mat_list, batch):
+                        self.assertTrue(np.array_equal(mat, mat_from_proto))
+                        self.assertFalse(mat_from_proto.flags.writeable)
+                        del mat_from_proto
+                    del batch
+        finally:
+            pool.close()
+
+    def test_numpy_to_encoded_proto_and_back(self):
+        mat = np.zeros((60,80,3), dtype=np.uint8)
+        mat[10:30, 20:50] = (200, 100, 50)
+        for encoding in ['zlib', 'png', 'webp', 'jpeg']:
+            for image in [mat, mat[...,0]]:
+                proto_mat = utils.numpy_to_encoded_proto(image, encoding, quality=95)
+                self.assertEqual(proto_mat.encoding, encoding)
+                self.assertTrue(len(proto_mat.data) < image.nbytes)
+                mat_from_proto = utils.proto_to_numpy(proto_mat)
+                self.assertEqual(mat_from_proto.shape, image.shape)
+                self.assertEqual(mat_from_proto.dtype, np.uint8)
+                if encoding in ['zlib', 'png']:
+                    self.assertTrue(np.array_equal(image, mat_from_proto))
+                else:
+                    self.assertTrue(np.abs(image.astype(int)-mat_from_proto).mean() < 5)
+
+        # lossless compression works for any dtype
+        mat = np.zeros((30,40,2), dtype=np.float32)
+        mat_from_proto = utils.proto_to_numpy(utils.numpy_to_encoded_proto(mat, 'zlib'))
+        self.assertTrue(np.array_equal(mat, mat_from_proto))
+        with self.assertRaises(ValueError):
+            utils.numpy_to_encoded_proto(mat, 'png')
+        with self.assertRaises(ValueError):
+            utils.numpy_to_encoded_proto(mat, 'gif')
+
+    def test_image_file_to_proto(self):
+        mat = np.full((20,30,3), 128, dtype=np.uint8)
+        png = utils.numpy_to_encoded_proto(mat, 'png').data
+        jpeg = utils.numpy_to_encoded_proto(mat, 'jpeg').data
+        for data, encoding in [(png, 'png'), (jpeg, 'jpeg')]:
+            proto_mat = utils.image_file_to_proto(data)
+            self.assertEqual(proto_mat.encoding, encoding)
+            self.assertEqual(utils.proto_to_numpy(proto_mat).shape, (20,30,3))
+
+        mat_list = utils.proto_to_numpy_list([utils.image_file_to_proto(png)]*8)
+        self.assertEqual(len(mat_list), 8)
+        self.assertTrue(all(np.array_equal(x, mat) for x in mat_list))
+
+        with self.assertRaises(ValueError):
+            utils.image_file_to_proto(b'not an image')
+
+    def test_encode_results_json(self):
+        results = {'boxes': np.zeros((2,4), dtype=np.float32), 'score': np.float32(0.5)}
+        response = utils.encode_results(results)
+        self.assertEqual(response.encoding, '')
+        self.assertEqual(json.loads(response.data), {'boxes': [[0.]*4]*2, 'score': 0.5})
+        self.assertEqual(utils.decode_results(response), {'boxes': [[0.]*4]*2, 'score': 0.5})
+
+    @unittest.skipIf(utils.msgpack is None, 'msgpack is not installed')
+    def test_encode_results_msgpack(self):
+        results = [['object1', 0.3], ['object2', 0.5]]
+        response = utils.encode_results(results, utils.MSGPACK_ENCODING)
+        self.assertEqual(response.encoding, utils.MSGPACK_ENCODING)
+        self.assertEqual(response.data, '')
+        self.assertEqual(utils.decode_results(response), results)
+
+    def test_encode_results_tensor(self):
+        for dtype in [np.uint8, np.float32, np.float64, np.int64]:
+            results = np.arange(12, dtype=dtype).reshape((3,4))
+            response = utils.encode_results(results, utils.TENSOR_ENCODING)
+            self.assertEqual(response.encoding, utils.TENSOR_ENCODING)
+            decoded = utils.decode_results(response)
+            self.assertEqual(decoded.dtype, dtype)
+            self.assertTrue(np.array_equal(decoded, results))
+
+        # a list of embeddings
+        results = [np.ones(8, dtype=np.float32)]*3
+        decoded = utils.decode_results(utils.encode_results(results, utils.TENSOR_ENCODING))
+        self.assertEqual(decoded.shape, (3,8))
+        self.assertEqual(decoded.dtype, np.float32)
+
+    def test_encode_results_fallback(self):
+        for results in [{'error': 'failed'}, [[1,2], [3]], ['text']]:
+            response = utils.encode_results(results, utils.TENSOR_ENCODING)
+            self.assertEqual(response.encoding, '')
+            self.assertEqual(utils.decode_results(response), results)
+
+        response = utils.encode_results([1,2], 'unknown')
+        self.assertEqual(utils.decode_results(response), [1,2])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,46 +1,298 @@
+import functools
+import io
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+from PIL import Image
 
 import server_pb2
+import shm
+
+try:
+    import msgpack
+except ImportError: # optional, only needed by the msgpack encoding
+    msgpack = None
 
 
+# Names of the dtypes on the messages of older versions, that only had these.
+# They are still sent for them, so older servers keep reading them
 np_dtype_to_str = {
-    np.dtype(np.uint8)   : 'uint8',
-    np.dtype(np.float32) : 'float32',
-    np.dtype(np.float64) : 'float64',
+    np.dtype('<u1') : 'uint8',
+    np.dtype('<f4') : 'float32',
+    np.dtype('<f8') : 'float64',
 }
 str_to_np_dtype = {v: k for k,v in np_dtype_to_str.items()}
+# Kinds of the fixed width dtypes: bool, signed and unsigned integers, floats and complex
+DTYPE_KINDS = 'biufc'
 
 
-def numpy_to_proto(mat):
-    try:
-        dtype_str = np_dtype_to_str[mat.dtype]
-    except KeyError as exc:
-        raise KeyError(
-            f'Invalid numpy dtype. Available types: {str_to_np_dtype.keys()}') from exc
+def _invalid_dtype(dtype):
+    return KeyError(f'Invalid numpy dtype {dtype}. Only fixed width bool, integer, '
+                    'float and complex dtypes are supported')
 
-    return server_pb2.NumpyImage(
-            height=mat.shape[0],
-            width=mat.shape[1],
-            channels=(1 if len(mat.shape)==2 else mat.shape[2]),
-            data=mat.tobytes(),
-            dtype=dtype_str
-        )
+def dtype_to_str(dtype):
+    """Name of a numpy dtype on the messages: the old names of uint8, float32 and
+    float64, or the numpy type string, with explicit byte order, such as '<f2',
+    '>i4' or '|b1'."""
+    dtype = np.dtype(dtype)
+    if dtype.kind not in DTYPE_KINDS:
+        raise _invalid_dtype(dtype)
+    return np_dtype_to_str.get(dtype, dtype.str)
 
-def proto_to_numpy(image):
-    try:
-        dtype = str_to_np_dtype[image.dtype]
-    except KeyError as exc:
-        raise KeyError(
-            f'Invalid numpy dtype. Available types: {str_to_np_dtype.keys()}') from exc
-    np_image = np.frombuffer(image.data, dtype=dtype)
+def str_to_dtype(name: str):
+    """Numpy dtype of a name on the messages. Besides the ones of dtype_to_str,
+    numpy names such as 'int16' are taken in the native byte order."""
+    dtype = str_to_np_dtype.get(name)
+    if dtype is None:
+        try:
+            dtype = np.dtype(name)
+        except TypeError as exc:
+            raise _invalid_dtype(name) from exc
+    if dtype.kind not in DTYPE_KINDS:
+        raise _invalid_dtype(name)
+    return dtype
+
+def _image_fields(mat):
+    """Dtype and shape fields of the NumpyImage of an array. Height, width and
+    channels are still set for 2-D and 3-D arrays, so older servers read them."""
+    if mat.ndim == 0:
+        raise ValueError('Invalid numpy array, it must have at least one dimension')
+    fields = {'dtype': dtype_to_str(mat.dtype), 'shape': mat.shape}
+    if mat.ndim in (2, 3):
+        fields.update(height=mat.shape[0], width=mat.shape[1],
+                      channels=1 if mat.ndim==2 else mat.shape[2])
+    return fields
+
+def _proto_shape(image):
+    if len(image.shape) > 0:
+        return tuple(image.shape)
+    # from older clients
     if image.channels == 1:
-        shape = (image.height, image.width)
-    else:
-        shape = (image.height, image.width, image.channels)
+        return (image.height, image.width)
+    return (image.height, image.width, image.channels)
+
+def numpy_to_proto(mat, lease=None):
+    """Packs a numpy array of any shape into a NumpyImage. Given a shared memory
+    lease, the array is written to shared memory instead of the message."""
+    fields = _image_fields(mat)
+    if lease is not None:
+        return lease.numpy_list_to_proto([mat], [fields])[0]
+    # a single copy, even for non contiguous arrays
+    return server_pb2.NumpyImage(data=mat.tobytes(), **fields)
+
+def proto_to_numpy(image):
+    if image.encoding in IMAGE_FILE_ENCODINGS:
+        return _decode_image_file(image)
+    dtype = str_to_dtype(image.dtype)
+    shape = _proto_shape(image)
+    if image.shm_name:
+        return shm.shared_memory_to_numpy(image, shape, dtype)
+    data = image.data
+    if image.encoding == ZLIB_ENCODING:
+        data = zlib.decompress(data)
+    np_image = np.frombuffer(data, dtype=dtype)
     return np_image.reshape(shape)
 
-def numpy_list_to_proto(images):
+def numpy_list_to_proto(images, lease=None):
+    if lease is not None and len(images) > 0:
+        fields = [_image_fields(im) for im in images]
+        # all the images share a single segment
+        return lease.numpy_list_to_proto(images, fields)
     return [numpy_to_proto(im) for im in images]
 
 def proto_to_numpy_list(images):
-    return [proto_to_numpy(im) for im in images]
\ No newline at end of file
+    if len(images) > 1 and any(im.encoding for im in images):
+        # decoding releases the GIL, so the images are decoded in parallel
+        return list(_get_decode_executor().map(proto_to_numpy, images))
+    return [proto_to_numpy(im) for im in images]
+
+def is_batch_tensor(images):
+    """Whether the images can be sent as a single BatchTensor: numpy arrays of
+    one of the supported dtypes, all of the same dtype."""
+    if len(images) == 0 or not all(isinstance(im, np.ndarray) for im in images):
+        return False
+    dtype = images[0].dtype
+    if dtype.kind not in DTYPE_KINDS or any(im.dtype != dtype for im in images):
+        return False
+    # the shapes of ragged batches are sent as Shape, only fit for images
+    shape = images[0].shape
+    return all(im.shape == shape for im in images) or all(im.ndim in (2, 3) for im in images)
+
+def numpy_list_to_batch_proto(images, lease=None, tensor=None):
+    """Packs a batch of numpy images into a single BatchTensor, copying each image
+    once into its buffer. Given a shared memory lease, the buffer is a segment.
+    Setting a message field copies it, so pass the tensor field of a request
+    to fill it in place."""
+    tensor = server_pb2.BatchTensor() if tensor is None else tensor
+    if lease is not None:
+        lease.numpy_batch_to_proto(images, tensor)
+    else:
+        # join preallocates the whole buffer and copies each image into it
+        tensor.data = b''.join(memoryview(im) if im.flags.c_contiguous else im.tobytes()
+                               for im in images)
+    tensor.dtype = dtype_to_str(images[0].dtype)
+    shapes = [im.shape for im in images]
+    if all(x == shapes[0] for x in shapes):
+        tensor.shape.extend((len(images),) + shapes[0])
+    else:
+        tensor.item_shapes.extend(
+            server_pb2.Shape(height=x[0], width=x[1], channels=1 if len(x)==2 else x[2], dims=x)
+            for x in shapes)
+    return tensor
+
+def _item_shape(shape):
+    if len(shape.dims) > 0:
+        return tuple(shape.dims)
+    # sent by clients without dims
+    if shape.channels == 1:
+        return (shape.height, shape.width)
+    return (shape.height, shape.width, shape.channels)
+
+def batch_proto_len(tensor):
+    """Number of images of a BatchTensor."""
+    return len(tensor.item_shapes) or (tensor.shape[0] if len(tensor.shape) > 0 else 0)
+
+def batch_proto_to_numpy(tensor):
+    """Unpacks a BatchTensor without copies: a single numpy array when all images
+    have the same shape, or a list of views of its buffer otherwise."""
+    dtype = str_to_dtype(tensor.dtype)
+    if len(tensor.item_shapes) == 0:
+        shapes = None
+        size = int(np.prod(tensor.shape))
+    else:
+        shapes = [_item_shape(x) for x in tensor.item_shapes]
+        size = sum(int(np.prod(x)) for x in shapes)
+
+    if tensor.shm_name:
+        flat = shm.shared_memory_to_numpy(tensor, (size,), dtype)
+    else:
+        flat = np.frombuffer(tensor.data, dtype=dtype, count=size)
+    if shapes is None:
+        return flat.reshape(tuple(tensor.shape))
+
+    images = []
+    offset = 0
+    for shape in shapes:
+        end = offset + int(np.prod(shape))
+        images.append(flat[offset:end].reshape(shape))
+        offset = end
+    return images
+
+
+# Encodings of the NumpyImage data. Empty means raw pixels, zlib compresses them
+# losslessly, and the others are image files decoded with Pillow
+ZLIB_ENCODING = 'zlib'
+IMAGE_FILE_ENCODINGS = ('jpeg', 'png', 'webp')
+IMAGE_ENCODINGS = (ZLIB_ENCODING,) + IMAGE_FILE_ENCODINGS
+
+_mode_by_channels = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+
+@functools.cache
+def _get_decode_executor():
+    # created on first use, so that forked server workers get their own threads
+    return ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def _decode_image_file(image):
+    with Image.open(io.BytesIO(image.data)) as pil_image:
+        mode = _mode_by_channels.get(image.channels)
+        if mode is None: # unknown channels, e.g. a file passed through by the client
+            mode = pil_image.mode if pil_image.mode in ('L', 'RGB', 'RGBA') else 'RGB'
+        return np.asarray(pil_image.convert(mode))
+
+def image_file_encoding(data: bytes):
+    """Returns the encoding of an image file from its magic bytes."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    raise ValueError('Unknown image file, expected JPEG, PNG or WebP bytes')
+
+def image_file_to_proto(data: bytes):
+    """Packs an encoded image file as it is, to be decoded by the server."""
+    return server_pb2.NumpyImage(
+            data=data,
+            dtype='uint8',
+            encoding=image_file_encoding(data)
+        )
+
+def numpy_to_encoded_proto(mat, encoding: str, quality: int=90):
+    """Packs a numpy image into a NumpyImage, compressing its data with the
+    given encoding. Image file encodings only support uint8 images."""
+    if encoding not in IMAGE_ENCODINGS:
+        raise ValueError(f'Invalid image encoding. Available encodings: {IMAGE_ENCODINGS}')
+    fields = _image_fields(mat)
+    if encoding == ZLIB_ENCODING:
+        # compresses the array memory itself when it is contiguous, without copying it
+        data = memoryview(mat) if mat.flags.c_contiguous else mat.tobytes()
+        return server_pb2.NumpyImage(data=zlib.compress(data, 1), encoding=encoding, **fields)
+
+    if mat.dtype != np.uint8 or fields.get('channels') not in _mode_by_channels:
+        raise ValueError(f'{encoding} encoding only supports uint8 images with 1, 3 or 4 channels')
+    buffer = io.BytesIO()
+    pil_image = Image.fromarray(mat)
+    if encoding == 'jpeg' and pil_image.mode == 'RGBA':
+        raise ValueError('jpeg encoding does not support images with alpha')
+    pil_image.save(buffer, format=encoding.upper(), quality=quality)
+    return server_pb2.NumpyImage(data=buffer.getvalue(), encoding=encoding, **fields)
+
+
+# Results encodings of a Response. JSON is kept on the data string field, so it
+# stays compatible with older clients, while the others go to payload
+JSON_ENCODING = 'json'
+MSGPACK_ENCODING = 'msgpack'
+TENSOR_ENCODING = 'tensor'
+
+
+def _to_builtin(obj):
+    """Converts numpy objects that JSON and msgpack can't serialize."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+def _to_tensor(results):
+    """Returns results as a numeric numpy array, or None if it isn't one."""
+    try:
+        tensor = np.asarray(results)
+    except ValueError: # ragged lists
+        return None
+    if tensor.dtype.kind not in 'biuf':
+        return None
+    return tensor
+
+def encode_results(results, encoding: str=JSON_ENCODING):
+    """Encodes the results into a Response. Falls back to JSON when the encoding
+    is unknown, unavailable, or can't represent the results (e.g. error dicts
+    with the tensor encoding), so check the encoding of the Response."""
+    if encoding == MSGPACK_ENCODING and msgpack is not None:
+        return server_pb2.Response(
+                payload=msgpack.packb(results, default=_to_builtin, use_bin_type=True),
+                encoding=MSGPACK_ENCODING)
+
+    if encoding == TENSOR_ENCODING:
+        tensor = _to_tensor(results)
+        if tensor is not None:
+            buffer = io.BytesIO()
+            np.save(buffer, tensor, allow_pickle=False)
+            return server_pb2.Response(
+                    payload=buffer.getvalue(),
+                    encoding=TENSOR_ENCODING)
+
+    return server_pb2.Response(
+            data=json.dumps(results, default=_to_builtin))
+
+def decode_results(response):
+    if response.encoding == MSGPACK_ENCODING:
+        if msgpack is None:
+            raise ImportError('msgpack is required to decode this response')
+        return msgpack.unpackb(response.payload, raw=False)
+    if response.encoding == TENSOR_ENCODING:
+        return np.load(io.BytesIO(response.payload), allow_pickle=False)
+    return json.loads(response.data)